@@ -0,0 +1,285 @@
+"""
+scoring.json 채점 모델의 과거 성과 백테스트.
+
+모든 종목 × 모든 과거 거래일의 지표와 점수를 (날짜 × 종목) 패널로 한 번에 계산하고
+(compute_indicator_panel + 컴파일한 scoring.json 평가 함수), 등급/판단별로
+그날 종가 기준 이후 N거래일 수익률을 모은다. 종목별로 fetch_stats를 반복하지 않는다.
+
+- 거래일이 다른 한국/미국 종목은 시장별 패널로 나눠 계산한다.
+- 상대강도의 기준시장 수익률은 기준지수 종가를 종목 시장의 거래일에 맞춰(직전 값) 쓴다.
+  한국 종목의 미국 기준지수(SOXX 등)는 같은 날짜 봉이 KRX 마감 뒤에 끝나므로 전날 봉까지만 쓴다.
+- 가격은 로컬 가격 저장소(최근 1년치)를 쓰지 않고 --period만큼 새로 받는다.
+
+사용 예:
+    python backtest.py
+    python backtest.py --period 5y --horizons 5,20,60 --output backtest.json
+    python backtest.py --tickers NVDA,005930.KS --period 2y
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import stock_alert as sa
+
+DEFAULT_PERIOD = "2y"
+DEFAULT_HORIZONS = [5, 20, 60]
+
+
+def price_frames(prices, tickers):
+    """종목별 OHLCV를 날짜로 맞춘 (날짜 × 종목) 종가/거래량 DataFrame으로 모은다."""
+    close = {}
+    volume = {}
+
+    for t in tickers:
+        df = prices.get(t)
+
+        if df is None or df.empty:
+            continue
+
+        index = pd.DatetimeIndex(df.index)
+
+        if index.tz is not None:
+            index = index.tz_localize(None)
+
+        index = index.normalize()
+
+        close[t] = pd.Series(df["Close"].to_numpy(dtype=float), index=index)
+        volume[t] = pd.Series(df["Volume"].to_numpy(dtype=float), index=index)
+
+    close = pd.DataFrame(close).sort_index()
+    volume = pd.DataFrame(volume).reindex(close.index)
+
+    return close, volume
+
+
+def benchmark_change(close, k, dates, strict=False):
+    """
+    기준지수 k거래일 수익률(%)을 dates에 맞춘다. 그날 지수 봉이 없으면 직전 값.
+    strict면 같은 날짜 봉도 쓰지 않고 그 전 봉을 쓴다 (한국 종목의 미국 기준지수:
+    같은 날짜 미국 봉은 KRX 마감 약 14시간 뒤에 끝나므로 실제 실행에서는 아직 없다).
+    """
+    change = (close / close.shift(k) - 1.0) * 100.0
+
+    pos = change.index.searchsorted(dates, side="left" if strict else "right") - 1
+    values = change.to_numpy()[np.maximum(pos, 0)]
+
+    return np.where(pos >= 0, values, np.nan)
+
+
+def benchmark_after_close(market, key):
+    """기준지수 봉이 그 시장의 같은 날짜 마감보다 늦게 끝나는지 (한국 종목 ↔ 미국 지수)."""
+    return market == "kr" and sa.exchange_market(sa.MARKET_INDEX[key]) == "us"
+
+
+def forward_returns(close, horizon):
+    """각 행 종가에서 horizon거래일 뒤 종가까지의 수익률(%). 뒤쪽 horizon행은 NaN."""
+    out = np.full(close.shape, np.nan)
+
+    if horizon < close.shape[0]:
+        out[:-horizon] = (close[horizon:] / close[:-horizon] - 1.0) * 100.0
+
+    return out
+
+
+def score_panel(close, volume, benchmarks, market):
+    """
+    시장 하나(market: kr / us)의 (날짜 × 종목) 패널 전체를 채점한다.
+    benchmarks: {기준시장 키: 지수 종가 Series}
+    (컬럼형 채점 결과 {필드: 2D 배열}, 채점 가능한 칸 마스크)
+    """
+    ind = sa.compute_indicator_panel(close.to_numpy(), volume.to_numpy())
+    columns = {field: ind[field] for field in sa.STAT_FIELDS}
+
+    dates = close.index
+    market_chg20 = np.full(ind["close"].shape, np.nan)
+    market_chg60 = np.full(ind["close"].shape, np.nan)
+
+    # 기준시장별로 한 번만 날짜를 맞춘다. 기준지수가 없으면 리포트와 같이 기준 수익률 0
+    changes = {
+        key: (
+            benchmark_change(bench, 20, dates, strict=benchmark_after_close(market, key)),
+            benchmark_change(bench, 60, dates, strict=benchmark_after_close(market, key)),
+        )
+        for key, bench in benchmarks.items()
+    }
+
+    for j, t in enumerate(close.columns):
+        chg20, chg60 = changes.get(sa.get_market_key(t), (0.0, 0.0))
+        market_chg20[:, j] = chg20
+        market_chg60[:, j] = chg60
+
+    sa.score_columns(columns, market_chg20, market_chg60)
+
+    valid = ind["valid"] & np.isfinite(market_chg20) & np.isfinite(market_chg60)
+
+    return columns, valid
+
+
+def summarize(labels, order, valid, returns):
+    """라벨(등급/판단)별 관측 수, 평균/중앙값 수익률, 상승 비율."""
+    rows = []
+
+    for label in order + ["전체"]:
+        mask = valid & np.isfinite(returns)
+
+        if label != "전체":
+            mask &= labels == label
+
+        values = returns[mask]
+
+        if values.size == 0:
+            rows.append({"label": label, "count": 0})
+            continue
+
+        rows.append({
+            "label": label,
+            "count": int(values.size),
+            "mean": float(values.mean()),
+            "median": float(np.median(values)),
+            "hit_rate": float((values > 0).mean() * 100.0),
+        })
+
+    return rows
+
+
+def run_backtest(tickers, period, horizons):
+    rules = sa.scoring_rules()
+    grade_order = [g["grade"] for g in rules["grades"]] + [rules["default_grade"]]
+    decision_order = list(dict.fromkeys(
+        [d["decision"] for d in rules["decisions"]] + [rules["default_decision"]]
+    ))
+
+    benchmark_tickers = list(sa.MARKET_INDEX.values())
+
+    start = time.perf_counter()
+    prices = sa.download_prices(sa.universe_tickers(benchmark_tickers, tickers), period=period)
+    fetch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+
+    bench_close, _ = price_frames(prices, benchmark_tickers)
+    benchmarks = {
+        key: bench_close[t].dropna()
+        for key, t in sa.MARKET_INDEX.items()
+        if t in bench_close
+    }
+
+    grades = []
+    decisions = []
+    valid = []
+    returns = {h: [] for h in horizons}
+    n_dates = 0
+    n_tickers = 0
+
+    # 시장별 패널을 따로 채점하고 칸 단위 1D로 이어 붙인다
+    for market in ("kr", "us"):
+        group = [t for t in tickers if sa.exchange_market(t) == market]
+        close, volume = price_frames(prices, group)
+
+        if close.empty:
+            continue
+
+        columns, ok = score_panel(close, volume, benchmarks, market)
+
+        grades.append(columns["grade"].ravel())
+        decisions.append(columns["decision"].ravel())
+        valid.append(ok.ravel())
+
+        for h in horizons:
+            returns[h].append(forward_returns(close.to_numpy(), h).ravel())
+
+        n_dates = max(n_dates, len(close.index))
+        n_tickers += close.shape[1]
+
+    if not valid:
+        raise ValueError("백테스트할 가격 데이터 없음")
+
+    grades = np.concatenate(grades)
+    decisions = np.concatenate(decisions)
+    valid = np.concatenate(valid)
+
+    report = {
+        "period": period,
+        "tickers": n_tickers,
+        "dates": n_dates,
+        "observations": int(valid.sum()),
+        "horizons": {},
+    }
+
+    for h in horizons:
+        fwd = np.concatenate(returns[h])
+
+        report["horizons"][str(h)] = {
+            "by_grade": summarize(grades, grade_order, valid, fwd),
+            "by_decision": summarize(decisions, decision_order, valid, fwd),
+        }
+
+    report["seconds"] = {"fetch": fetch_seconds, "backtest": time.perf_counter() - start}
+
+    return report
+
+
+def print_report(report):
+    print(
+        f"종목 {report['tickers']}개 / 거래일 {report['dates']}일 / "
+        f"채점 {report['observations']:,}건 (기간 {report['period']})"
+    )
+
+    for h, tables in report["horizons"].items():
+        for title, rows in (("등급", tables["by_grade"]), ("판단", tables["by_decision"])):
+            print()
+            print(f"[{title}별 {h}거래일 수익률]")
+            print(f"  {'':<14} {'건수':>8} {'평균':>8} {'중앙값':>8} {'상승비율':>8}")
+
+            for r in rows:
+                if r["count"] == 0:
+                    print(f"  {r['label']:<14} {0:>8}")
+                    continue
+
+                print(
+                    f"  {r['label']:<14} {r['count']:>8,} {r['mean']:>+7.2f}% "
+                    f"{r['median']:>+7.2f}% {r['hit_rate']:>7.1f}%"
+                )
+
+    seconds = report["seconds"]
+    print()
+    print(f"다운로드 {seconds['fetch']:.2f}s / 백테스트 {seconds['backtest']:.2f}s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scoring.json 등급/판단별 과거 수익률 백테스트")
+    parser.add_argument("--tickers", help="종목 (쉼표 구분, 기본: 포트폴리오 + 관심종목)")
+    parser.add_argument("--universe", action="store_true", help="구성종목 파일(universe/)의 종목도 포함")
+    parser.add_argument("--period", default=DEFAULT_PERIOD, help="받을 기간 (yfinance period, 예: 2y, 5y, max)")
+    parser.add_argument("--horizons", default=",".join(map(str, DEFAULT_HORIZONS)),
+                        help="이후 수익률을 볼 거래일 수 (쉼표 구분)")
+    parser.add_argument("--output", help="결과 JSON 파일")
+    args = parser.parse_args()
+
+    if args.tickers:
+        tickers = [t.strip() for t in args.tickers.split(",") if t.strip()]
+    else:
+        tickers = sa.universe_tickers(
+            sa.TICKERS_KR, sa.TICKERS_US, sa.WATCHLIST_KR, sa.WATCHLIST_US,
+        )
+
+    if args.universe:
+        tickers = sa.universe_tickers(tickers, *[row[3] for row in sa.screen_sections()])
+
+    horizons = [int(x) for x in args.horizons.split(",") if x.strip()]
+
+    report = run_backtest(tickers, args.period, horizons)
+    print_report(report)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+합성 유니버스로 리포트 파이프라인 단계별 소요 시간을 잰다.
+
+네트워크(yfinance)와 메일(SMTP)은 쓰지 않는다.
+- 시세: 종목 코드로 시드를 고정한 합성 OHLCV (SyntheticProvider)
+- 알림: deliver를 아무것도 보내지 않는 함수로 교체
+
+사용 예:
+    python benchmark.py
+    python benchmark.py --sizes 50,500 --repeat 3 --output bench.json
+    python benchmark.py --sizes 20000 --workers 4 --no-main
+
+결과는 커밋 간 비교할 수 있도록 JSON으로 출력한다.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+# stock_alert import 전에 설정해야 하는 값들 (메일 계정, 로컬 저장소 위치).
+# 스크리닝 프로세스 풀(spawn)은 이 파일을 다시 import하므로 부모가 만든 임시 디렉터리를 물려받는다
+os.environ.setdefault("NAVER_EMAIL", "benchmark@example.com")
+os.environ.setdefault("NAVER_APP_PASSWORD", "benchmark")
+# 이 프로세스가 만든 임시 디렉터리만 끝날 때 지운다
+OWNS_STATE_DIR = "STOCK_ALERT_BENCH_STATE_DIR" not in os.environ
+
+if OWNS_STATE_DIR:
+    os.environ["STOCK_ALERT_BENCH_STATE_DIR"] = tempfile.mkdtemp(prefix="stock-alert-bench-")
+
+os.environ["STOCK_ALERT_STATE_DIR"] = os.environ["STOCK_ALERT_BENCH_STATE_DIR"]
+
+import numpy as np
+import pandas as pd
+
+import stock_alert as sa
+
+DEFAULT_SIZES = [50, 500, 5000, 20000]
+DEFAULT_BARS = 260
+
+
+class SyntheticProvider:
+    """
+    종목 코드에서 시드를 만들어 항상 같은 합성 일봉을 돌려주는 시세 제공자.
+    start 요청은 해당 날짜 이후 봉만 돌려준다.
+    """
+
+    host = None
+
+    def __init__(self, n_bars=DEFAULT_BARS, end=None):
+        # 다운로드 구간(plan_history_start)이 오늘 기준이므로 합성 봉도 오늘(직전 평일)에서 끝낸다
+        end = end or pd.Timestamp.today().normalize()
+        self.dates = pd.bdate_range(end=end, periods=n_bars, name="Date")
+
+    def history(self, ticker, window):
+        rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+        n = len(self.dates)
+
+        close = 100.0 * np.exp(np.cumsum(rng.normal(0.0005, 0.02, n)))
+        volume = rng.integers(100_000, 1_000_000, n).astype(float)
+
+        df = pd.DataFrame(
+            {
+                "Open": close,
+                "High": close * 1.01,
+                "Low": close * 0.99,
+                "Close": close,
+                "Adj Close": close,
+                "Volume": volume,
+            },
+            index=self.dates,
+        )
+
+        if "start" in window:
+            df = df[df.index >= pd.Timestamp(window["start"])]
+
+        return df
+
+
+def synthetic_universe(n):
+    """절반은 한국(.KS), 절반은 미국 종목 코드."""
+    kr = [f"{i:06d}.KS" for i in range(n // 2)]
+    us = [f"SYN{i:05d}" for i in range(n - n // 2)]
+    return kr + us
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def render_blocks(results):
+    """리포트와 같은 경로(ReportWriter, plain text + HTML)로 종목 블록을 쓴다."""
+    writer = sa.ReportWriter(html=True)
+
+    for r in results:
+        writer.block(r)
+
+    return writer.text(), writer.html()
+
+
+def run_stages(n, include_main, workers=0):
+    tickers = synthetic_universe(n)
+    index_tickers = list(sa.MARKET_INDEX.values())
+    stages = {}
+
+    prices, stages["fetch_stubbed"] = timed(sa.download_prices, index_tickers + tickers)
+
+    universe_stats, stages["indicators"] = timed(
+        sa.compute_universe_stats, prices, index_tickers + tickers
+    )
+
+    markets = sa.fetch_market_stats(universe_stats)
+    results = [universe_stats[t].copy() for t in tickers if t in universe_stats]
+
+    _, stages["scoring"] = timed(sa.score_stats_list, results, markets)
+
+    _, stages["sort_bucket"] = timed(sa.rank_results, results)
+
+    _, stages["render"] = timed(render_blocks, results)
+
+    # 구성종목 스크리닝 경로: 스크리닝 패널 읽기 → 컬럼형 채점 + 상위 N.
+    # workers > 1이면 이 전체를 프로세스 풀이 종목 구간별로 나눠 한다 (패널은 미리 채워 둔다)
+    sa.screen_section("benchmark", tickers, prices, markets, workers=0)
+    _, stages["screening"] = timed(sa.screen_section, "benchmark", tickers, None, markets, workers=workers)
+
+    if include_main:
+        stages["main"] = time_main(tickers)
+
+    return stages
+
+
+def time_main(tickers):
+    """
+    main 전체를 합성 유니버스로 돌린다. 종목은 네 섹션에 고르게 나눈다.
+    실행마다 로컬 상태를 비워, 앞선 실행의 가격 저장소/알림 상태 때문에
+    생략·변동분 경로로 빠지지 않고 매번 같은 콜드 스타트 전체 리포트를 잰다.
+    """
+    quarter = max(1, len(tickers) // 4)
+
+    sa.TICKERS_KR = tickers[:quarter]
+    sa.WATCHLIST_KR = tickers[quarter:len(tickers) // 2]
+    sa.TICKERS_US = tickers[len(tickers) // 2:len(tickers) // 2 + quarter]
+    sa.WATCHLIST_US = tickers[len(tickers) // 2 + quarter:]
+    sa.deliver = lambda items, now=None: []
+
+    shutil.rmtree(sa.STATE_DIR, ignore_errors=True)
+    sa.STATE_DIR.mkdir(parents=True)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, elapsed = timed(sa.main)
+
+    return elapsed
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stock_alert 파이프라인 벤치마크")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="종목 수 목록 (쉼표 구분)")
+    parser.add_argument("--bars", type=int, default=DEFAULT_BARS, help="종목당 합성 봉 수")
+    parser.add_argument("--repeat", type=int, default=1, help="크기별 반복 횟수 (단계별 최솟값 기록)")
+    parser.add_argument("--no-main", action="store_true", help="main 전체 실행 시간은 재지 않음")
+    parser.add_argument("--workers", type=int, default=0, help="스크리닝 채점 프로세스 수 (0: 단일 프로세스)")
+    parser.add_argument("--output", help="결과 JSON 파일 (없으면 stdout)")
+    args = parser.parse_args()
+
+    try:
+        run_benchmark(args)
+    finally:
+        if OWNS_STATE_DIR:
+            shutil.rmtree(sa.STATE_DIR, ignore_errors=True)
+
+
+def run_benchmark(args):
+    sa.set_provider(SyntheticProvider(n_bars=args.bars))
+
+    report = {
+        "benchmark": "stock_alert_pipeline",
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "bars": args.bars,
+        "workers": args.workers,
+        "results": [],
+    }
+
+    for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        best = {}
+
+        for _ in range(args.repeat):
+            stages = run_stages(n, include_main=not args.no_main, workers=args.workers)
+
+            for name, elapsed in stages.items():
+                best[name] = min(elapsed, best.get(name, elapsed))
+
+        report["results"].append({"n_tickers": n, "seconds": best})
+
+        summary = " / ".join(f"{k} {v:.3f}s" for k, v in best.items())
+        print(f"[{n:>6} tickers] {summary}", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,70 @@
-import yfinance as yf
-import pandas as pd
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import csv
+import importlib
+import itertools
+import operator
+import sys
+import hashlib
+import heapq
+import io
 import json
 import os
+import re
+import threading
+import time
+import zipfile
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime, timedelta
+import math
+from datetime import date, datetime, timedelta, timezone
+from html import escape
+from zoneinfo import ZoneInfo
+
+try:
+    import fcntl
+except ImportError:  # Windows: 프로세스 간 잠금 없이 스레드 잠금만 쓴다
+    fcntl = None
+
+
+class _LazyModule:
+    """
+    처음 속성을 쓸 때 import하는 모듈 대리 객체.
+    설정 검증/도움말처럼 numpy/pandas/yfinance가 필요 없는 경로는 import 비용을 내지 않는다.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas")
+yf = _LazyModule("yfinance")
+requests = _LazyModule("requests")
+smtplib = _LazyModule("smtplib")
+asyncio = _LazyModule("asyncio")
 
 BASE_DIR = Path(__file__).resolve().parent
 
-# 네이버 메일 설정
-NAVER_EMAIL = os.environ["NAVER_EMAIL"]
-NAVER_APP_PASSWORD = os.environ["NAVER_APP_PASSWORD"]
-TO_EMAIL = os.environ.get("TO_EMAIL", NAVER_EMAIL)
+# 실행 간에 유지되는 로컬 데이터(가격 저장소 등). GitHub Actions에서는 actions/cache로 복원한다.
+STATE_DIR = Path(os.environ.get("STOCK_ALERT_STATE_DIR", BASE_DIR / ".state"))
+
+# 네이버 메일 설정은 실제로 보낼 때 읽는다 (mail_account)
+MAIL_ATTRS = ("NAVER_EMAIL", "NAVER_APP_PASSWORD", "TO_EMAIL")
+
+
+def mail_account():
+    """(보내는 주소, 앱 비밀번호, 받는 주소). 계정 환경변수가 없으면 KeyError."""
+    email = os.environ["NAVER_EMAIL"]
+    return email, os.environ["NAVER_APP_PASSWORD"], os.environ.get("TO_EMAIL", email)
 
 
 # =========================
@@ -52,803 +103,4313 @@ def load_tickers():
     return portfolio_kr, portfolio_us, watchlist_kr, watchlist_us, ticker_name_map
 
 
-TICKERS_KR, TICKERS_US, WATCHLIST_KR, WATCHLIST_US, TICKER_NAME_MAP = load_tickers()
+TICKER_ATTRS = ("TICKERS_KR", "TICKERS_US", "WATCHLIST_KR", "WATCHLIST_US", "TICKER_NAME_MAP")
 
 
-# =========================
-# 데이터 수집
-# =========================
+def ticker_config(name):
+    """
+    tickers.json은 처음 필요할 때 한 번 읽어 모듈 속성으로 둔다.
+    이미 있는 속성(벤치마크 등에서 바꿔 끼운 값)은 덮어쓰지 않는다.
+    """
+    g = globals()
 
-def fetch_stats(ticker, period="1y"):
-    df = yf.download(ticker, period=period, auto_adjust=False, progress=False)
+    if name not in g:
+        for attr, value in zip(TICKER_ATTRS, load_tickers()):
+            g.setdefault(attr, value)
 
-    if df.empty:
-        return None
+    return g[name]
 
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = [c[0] for c in df.columns]
 
-    close = df["Close"].astype(float)
-    volume = df["Volume"].astype(float)
+def ticker_name(ticker):
+    name = ticker_config("TICKER_NAME_MAP").get(ticker)
 
-    ma5 = close.rolling(5).mean()
-    ma10 = close.rolling(10).mean()
-    ma20 = close.rolling(20).mean()
-    ma60 = close.rolling(60).mean()
-    vol_ma20 = volume.rolling(20).mean()
+    # 스크리닝 종목은 구성종목 색인의 이름 (색인을 이미 읽은 실행에서만)
+    if name is None and _UNIVERSE.get("index") is not None:
+        name = _UNIVERSE["index"].name(ticker)
 
-    last_idx = ma60.last_valid_index()
+    return name or ticker
 
-    if last_idx is None:
-        return None
 
-    pos = df.index.get_loc(last_idx)
+def __getattr__(name):
+    """종목 목록/메일 계정/채점 규칙은 import 시점이 아니라 처음 쓸 때 읽는다."""
+    if name in TICKER_ATTRS:
+        return ticker_config(name)
 
-    if pos < 61:
-        return None
+    if name in MAIL_ATTRS:
+        return mail_account()[MAIL_ATTRS.index(name)]
 
-    close0 = float(close.iloc[pos])
-    close1 = float(close.iloc[pos - 1])
-    close5 = float(close.iloc[pos - 5])
-    close20 = float(close.iloc[pos - 20])
-    close60 = float(close.iloc[pos - 60])
+    if name == "SCORING_RULES":
+        return scoring_rules()
 
-    ma5v = float(ma5.iloc[pos])
-    ma10v = float(ma10.iloc[pos])
-    ma20v = float(ma20.iloc[pos])
-    ma60v = float(ma60.iloc[pos])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    ma20_prev = float(ma20.iloc[pos - 1])
-    ma60_prev = float(ma60.iloc[pos - 1])
 
-    close_prev = float(close.iloc[pos - 1])
+# =========================
+# 실행 지표 (단계별 시간 / 종목별 다운로드 / 누락 종목)
+# =========================
 
-    # 이벤트 감지
-    cross20_up = (close_prev < ma20_prev) and (close0 >= ma20v)
-    cross20_down = (close_prev >= ma20_prev) and (close0 < ma20v)
-    cross60_down = (close_prev >= ma60_prev) and (close0 < ma60v)
+METRICS_DIR = STATE_DIR / "metrics"
 
-    # 수익률
-    chg1d = (close0 / close1 - 1.0) * 100.0
-    chg5d = (close0 / close5 - 1.0) * 100.0
-    chg20d = (close0 / close20 - 1.0) * 100.0
-    chg60d = (close0 / close60 - 1.0) * 100.0
+# 남겨 둘 실행별 지표 파일 수
+METRICS_KEEP = 200
 
-    # 이평선 기울기
-    ma20_slope = (ma20v / ma20_prev - 1.0) * 100.0
-    ma60_slope = (ma60v / ma60_prev - 1.0) * 100.0
+# node_exporter textfile collector 경로 (설정 시 Prometheus 형식도 기록)
+PROMETHEUS_TEXTFILE = os.environ.get("STOCK_ALERT_PROM_FILE")
 
-    # 거래량
-    vol_today = float(volume.iloc[pos])
-    vol_avg20 = float(vol_ma20.iloc[pos])
-    vol_ratio = (vol_today / vol_avg20) if vol_avg20 and vol_avg20 > 0 else 0.0
+# Prometheus에 종목별로 내보낼 느린 다운로드 수
+PROMETHEUS_SLOWEST = 10
 
-    return {
-        "ticker": ticker,
-        "close": close0,
-        "ma5": ma5v,
-        "ma10": ma10v,
-        "ma20": ma20v,
-        "ma60": ma60v,
-        "chg1d": chg1d,
-        "chg5d": chg5d,
-        "chg20d": chg20d,
-        "chg60d": chg60d,
-        "ma20_slope": ma20_slope,
-        "ma60_slope": ma60_slope,
-        "vol_ratio": vol_ratio,
-        "cross20_up": cross20_up,
-        "cross20_down": cross20_down,
-        "cross60_down": cross60_down,
-        "above5": close0 >= ma5v,
-        "above10": close0 >= ma10v,
-        "above20": close0 >= ma20v,
-        "above60": close0 >= ma60v,
-        "is_aligned": close0 >= ma5v >= ma10v >= ma20v >= ma60v,
-    }
 
+class RunMetrics:
+    """
+    한 번의 실행에서 단계별 소요 시간, 종목별 다운로드(시간/크기/재시도), 누락 종목을 모은다.
+    다운로드 스레드에서 동시에 기록하므로 lock으로 보호한다.
+    """
 
-# =========================
-# 시장 기준
-# =========================
+    def __init__(self):
+        self.started_at = datetime.utcnow()
+        self.status = "ok"
+        self.market = None
+        self.stages = {}
+        self.fetches = {}
+        self.missing = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """같은 이름의 단계는 시간이 누적된다 (섹션별 채점/렌더링 등)."""
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def record_fetch(self, ticker, seconds, size, retries, ok):
+        with self.lock:
+            self.fetches[ticker] = {
+                "seconds": seconds,
+                "bytes": size,
+                "retries": retries,
+                "ok": ok,
+            }
 
-def get_market_key(ticker: str) -> str:
-    kr_semi = [
-        "005930.KS",  # 삼성전자
-        "000660.KS",  # SK하이닉스
-        "009150.KS",  # 삼성전기
-        "011070.KS",  # LG이노텍
-        "319660.KQ",  # 피에스케이
+    def add_missing(self, tickers):
+        with self.lock:
+            self.missing.extend(t for t in tickers if t not in self.missing)
+
+    def to_dict(self):
+        fetches = self.fetches.values()
+
+        return {
+            "started_at": self.started_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "status": self.status,
+            "market": self.market,
+            "stages": self.stages,
+            "total_seconds": (datetime.utcnow() - self.started_at).total_seconds(),
+            "fetch": {
+                "count": len(self.fetches),
+                "failed": sum(1 for f in fetches if not f["ok"]),
+                "retries": sum(f["retries"] for f in fetches),
+                "bytes": sum(f["bytes"] for f in fetches),
+                "tickers": self.fetches,
+            },
+            "missing": self.missing,
+        }
+
+    def write(self):
+        data = self.to_dict()
+
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        # 같은 초에 시작한 샤드끼리 덮어쓰지 않도록 pid를 붙인다
+        path = METRICS_DIR / f"run-{self.started_at.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        for old in sorted(METRICS_DIR.glob("run-*.json"))[:-METRICS_KEEP]:
+            old.unlink(missing_ok=True)
+
+        if PROMETHEUS_TEXTFILE:
+            write_prometheus_textfile(data, Path(PROMETHEUS_TEXTFILE))
+
+        return path
+
+
+def write_prometheus_textfile(data, path: Path):
+    """textfile collector가 반쯤 쓴 파일을 읽지 않도록 임시 파일에 쓰고 교체한다."""
+    fetch = data["fetch"]
+
+    lines = [
+        "# HELP stock_alert_stage_seconds Seconds spent in each stage of the last run.",
+        "# TYPE stock_alert_stage_seconds gauge",
     ]
+    for stage, seconds in data["stages"].items():
+        lines.append(f'stock_alert_stage_seconds{{stage="{stage}"}} {seconds:.6f}')
 
-    if ticker in kr_semi:
-        return "semi"
-
-    if ticker.endswith(".KS") or ticker.endswith(".KQ"):
-        return "kr"
+    slowest = sorted(fetch["tickers"].items(), key=lambda kv: kv[1]["seconds"], reverse=True)
 
-    semi_keywords = [
-        "NVDA", "AMD", "MU", "TSM", "LRCX", "ASML", "AMAT",
-        "WDC", "ARM", "MRVL", "DELL", "AVGO", "TER", "COHR",
-        "SOXX", "INTC", "SNDK"
+    lines += [
+        "# HELP stock_alert_fetch_seconds Download seconds of the slowest tickers in the last run.",
+        "# TYPE stock_alert_fetch_seconds gauge",
+    ]
+    for ticker, f in slowest[:PROMETHEUS_SLOWEST]:
+        lines.append(f'stock_alert_fetch_seconds{{ticker="{ticker}"}} {f["seconds"]:.6f}')
+
+    lines += [
+        "# HELP stock_alert_run_seconds Total seconds of the last run.",
+        "# TYPE stock_alert_run_seconds gauge",
+        f"stock_alert_run_seconds {data['total_seconds']:.6f}",
+        "# HELP stock_alert_run_success Whether the last run finished without an exception.",
+        "# TYPE stock_alert_run_success gauge",
+        f"stock_alert_run_success {1 if data['status'] == 'ok' else 0}",
+        "# HELP stock_alert_fetch_requests Ticker downloads in the last run.",
+        "# TYPE stock_alert_fetch_requests gauge",
+        f"stock_alert_fetch_requests {fetch['count']}",
+        "# HELP stock_alert_fetch_failed Ticker downloads that failed after retries.",
+        "# TYPE stock_alert_fetch_failed gauge",
+        f"stock_alert_fetch_failed {fetch['failed']}",
+        "# HELP stock_alert_fetch_retries Download retries in the last run.",
+        "# TYPE stock_alert_fetch_retries gauge",
+        f"stock_alert_fetch_retries {fetch['retries']}",
+        "# HELP stock_alert_fetch_bytes In-memory size of downloaded price frames.",
+        "# TYPE stock_alert_fetch_bytes gauge",
+        f"stock_alert_fetch_bytes {fetch['bytes']}",
+        "# HELP stock_alert_missing_tickers Tickers without enough data in the last run.",
+        "# TYPE stock_alert_missing_tickers gauge",
+        f"stock_alert_missing_tickers {len(data['missing'])}",
+        "# HELP stock_alert_last_run_timestamp_seconds Unix time the last run finished.",
+        "# TYPE stock_alert_last_run_timestamp_seconds gauge",
+        f"stock_alert_last_run_timestamp_seconds {time.time():.0f}",
     ]
 
-    clean_ticker = ticker.replace(".US", "").upper()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tmp.replace(path)
 
-    if clean_ticker in semi_keywords:
-        return "semi"
 
-    return "us"
+# 현재 실행의 지표 (main이 실행마다 새로 만든다)
+METRICS = RunMetrics()
 
 
 # =========================
-# 점수 계산
+# 데이터 수집
 # =========================
 
-def calc_stock_score(stats, market_stats):
-    """
-    =========================
-    종목 점수 산정 기준
-    =========================
-
-    기본 방향:
-    - 단순히 많이 오른 종목이 아니라
-      1) 정배열인지
-      2) 이평선이 상승 중인지
-      3) 시장보다 강한지
-      4) 거래량이 붙었는지
-      5) 20/60일선 이탈이 있는지
-      를 합산해서 점수화한다.
-
-    점수 구성:
-
-    1. 정배열 구조: 최대 30점
-       - 현재가 >= 5일선 >= 10일선 >= 20일선 >= 60일선이면 +30점
-       - 완전 정배열이 아니어도 부분 점수 부여
-         20일선 위: +8
-         60일선 위: +8
-         5일선 >= 10일선: +5
-         10일선 >= 20일선: +5
-         20일선 >= 60일선: +5
-
-    2. 이평선 기울기: 최대 24점
-       - 20일선 상승 중이면 +12
-       - 60일선 상승 중이면 +12
-
-    3. 상대강도: 최대 36점
-       - 20일 수익률이 기준시장보다 높으면 +12
-       - 20일 상대강도가 +5%p 초과면 추가 +6
-       - 60일 수익률이 기준시장보다 높으면 +12
-       - 60일 상대강도가 +10%p 초과면 추가 +6
-
-       예:
-       종목 20D +18%, 기준시장 20D +7%
-       => 상대강도 +11%p
-       => +12점 + 추가 6점
-
-    4. 거래량: 최대 10점
-       - 20일 평균 거래량 대비 2.0배 이상이면 +10
-       - 1.5배 이상이면 +6
-       - 0.7배 이하이면 -3
-
-    5. 이벤트 점수
-       - 20일선 상향돌파: +8
-       - 20일선 하향이탈: -20
-       - 60일선 하향이탈: -35
-
-    참고:
-    - 20일선 이격도는 사용하지 않는다.
-    - 많이 오른 종목을 과열로 감점하지 않는다.
-    - 대신 20일선/60일선 이탈 여부로 추세 훼손을 판단한다.
-    """
-
-    score = 0
-
-    # =========================
-    # 1. 정배열 구조 점수
-    # =========================
-    # 완전 정배열:
-    # 현재가 >= 5일선 >= 10일선 >= 20일선 >= 60일선
-    # 추세추종에서 가장 기본이 되는 강한 상승 구조
-    if stats["is_aligned"]:
-        score += 30
-
-    else:
-        # 완전 정배열은 아니지만,
-        # 현재가가 주요 이평선 위에 있거나
-        # 단기/중기 이평선 배열이 좋아지는 경우 부분 점수 부여
-        if stats["above20"]:
-            score += 8
-
-        if stats["above60"]:
-            score += 8
-
-        if stats["ma5"] >= stats["ma10"]:
-            score += 5
-
-        if stats["ma10"] >= stats["ma20"]:
-            score += 5
-
-        if stats["ma20"] >= stats["ma60"]:
-            score += 5
-
-    # =========================
-    # 2. 이평선 기울기 점수
-    # =========================
-    # 정배열이어도 이평선이 꺾이면 추세가 약해질 수 있음.
-    # 그래서 20일선과 60일선 자체가 상승 중인지 확인.
-    if stats["ma20_slope"] > 0:
-        score += 12
-
-    if stats["ma60_slope"] > 0:
-        score += 12
-
-    # =========================
-    # 3. 상대강도 점수
-    # =========================
-    # 주도주는 시장보다 강해야 한다.
-    # 한국 일반주는 KOSPI,
-    # 미국 일반주는 NASDAQ,
-    # 반도체주는 SOXX 대비 상대강도를 계산.
-    rs20 = stats["chg20d"] - market_stats.get("chg20d", 0)
-    rs60 = stats["chg60d"] - market_stats.get("chg60d", 0)
+# 동시에 진행할 최대 다운로드 수
+FETCH_CONCURRENCY = int(os.environ.get("STOCK_ALERT_FETCH_CONCURRENCY", "8"))
 
-    # 20일 상대강도
-    if rs20 > 0:
-        score += 12
+# Yahoo 요청 속도 제한 (초당 요청 수 / 순간 허용량)
+FETCH_RATE_PER_SEC = float(os.environ.get("STOCK_ALERT_FETCH_RATE", "5"))
+FETCH_RATE_BURST = int(os.environ.get("STOCK_ALERT_FETCH_BURST", "20"))
 
-    if rs20 > 5:
-        score += 6
+# 실패 시 재시도 횟수와 첫 대기 시간(초, 재시도마다 2배)
+FETCH_RETRIES = 2
+FETCH_RETRY_BACKOFF = 2.0
 
-    # 60일 상대강도
-    if rs60 > 0:
-        score += 12
+# 저장/계산에 쓰는 OHLCV 컬럼
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
 
-    if rs60 > 10:
-        score += 6
 
-    # =========================
-    # 4. 거래량 점수
-    # =========================
-    # 상승에 거래량이 붙으면 수급이 강하다고 판단.
-    # 거래량이 너무 적으면 신뢰도가 낮다고 보고 소폭 감점.
-    if stats["vol_ratio"] >= 2.0:
-        score += 10
+class TokenBucket:
+    """
+    스레드 안전 토큰 버킷.
+    acquire()는 토큰이 생길 때까지 기다렸다가 하나를 소비한다.
+    """
 
-    elif stats["vol_ratio"] >= 1.5:
-        score += 6
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-    elif stats["vol_ratio"] <= 0.7:
-        score -= 3
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
 
-    # =========================
-    # 5. 이벤트 점수
-    # =========================
-    # 사용자의 기존 원칙 반영:
-    # 20일선 상향돌파 = 재매수/추가매수 후보
-    # 20일선 하향이탈 = 일부 매도 검토
-    # 60일선 하향이탈 = 강한 매도 검토
-    if stats["cross20_up"]:
-        score += 8
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
 
-    if stats["cross20_down"]:
-        score -= 20
+                wait = (1.0 - self.tokens) / self.rate
 
-    if stats["cross60_down"]:
-        score -= 35
+            time.sleep(wait)
 
-    return score, rs20, rs60
 
+# 요청 대상 호스트별 속도 제한 (현재는 Yahoo Finance 하나)
+RATE_LIMITERS = {
+    "yahoo": TokenBucket(FETCH_RATE_PER_SEC, FETCH_RATE_BURST),
+}
 
-def grade_from_score(score):
-    if score >= 80:
-        return "A"
-    if score >= 65:
-        return "B+"
-    if score >= 50:
-        return "B"
-    if score >= 35:
-        return "C"
-    return "D"
 
+# =========================
+# 시세 제공자 (live / record / replay)
+# =========================
 
-def decision_from_stats(stats, score):
-    if stats["cross60_down"]:
-        return "전량 매도 검토"
+# STOCK_ALERT_PROVIDER: yfinance(기본) / record / replay
+PROVIDER_NAME = os.environ.get("STOCK_ALERT_PROVIDER", "yfinance")
+RECORDINGS_DIR = Path(os.environ.get("STOCK_ALERT_RECORDINGS_DIR", STATE_DIR / "recordings"))
 
-    if stats["cross20_down"]:
-        return "30% 매도 검토"
 
-    if score >= 80:
-        return "비중 확대 후보"
+def recording_path(directory: Path, ticker: str) -> Path:
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", ticker)
+    return directory / f"{safe}.pkl"
 
-    if score >= 65:
-        return "보유 유지 / 분할매수 후보"
 
-    if score >= 50:
-        return "관망 후보"
+class YFinanceProvider:
+    """yfinance 일봉 원본 응답. 데이터가 없는 종목은 None."""
 
-    if score >= 35:
-        return "비중 축소 후보"
+    host = "yahoo"
 
-    return "약세 / 매수 제외"
+    def history(self, ticker, window):
+        try:
+            return yf.Ticker(ticker).history(
+                interval="1d",
+                auto_adjust=False,
+                actions=False,
+                raise_errors=True,
+                **window,
+            )
+        except yf.exceptions.YFPricesMissingError:
+            return None
 
 
-# =========================
-# 시장 판단
-# =========================
+class RecordingProvider:
+    """
+    다른 제공자의 원본 응답을 종목별 pickle로 저장하면서 그대로 돌려준다.
+    같은 종목을 여러 번 받으면(증분 동기화 등) 날짜 기준으로 합쳐 둔다.
+    """
 
-def fetch_market_stats():
-    markets = {}
+    def __init__(self, inner, directory: Path):
+        self.inner = inner
+        self.directory = directory
+        self.host = inner.host
+        self.lock = threading.Lock()
 
-    for key, ticker in MARKET_INDEX.items():
-        stats = fetch_stats(ticker)
+    def __getstate__(self):
+        # 스크리닝 프로세스 풀로 넘길 때 잠금은 빼고 보낸다 (종목별 파일이라 프로세스 간 충돌 없음)
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
 
-        if stats is None:
-            continue
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
 
-        markets[key] = stats
+    def history(self, ticker, window):
+        df = self.inner.history(ticker, window)
 
-    return markets
+        if df is None or df.empty:
+            return df
 
+        path = recording_path(self.directory, ticker)
 
-def market_status_text(markets):
-    lines = ["💰 전체 주식 비중 가이드", ""]
+        with self.lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
 
-    valid = []
+            if path.exists():
+                old = pd.read_pickle(path)
+                recorded = pd.concat([old[~old.index.isin(df.index)], df]).sort_index()
+            else:
+                recorded = df
 
-    for key in ["kr", "us", "semi"]:
-        if key not in markets:
-            continue
+            recorded.to_pickle(path)
 
-        m = markets[key]
-        valid.append(m)
+        return df
 
-        lines.append(
-            f"- {MARKET_NAME[key]}: "
-            f"20일선 {'위' if m['above20'] else '아래'} / "
-            f"60일선 {'위' if m['above60'] else '아래'} / "
-            f"20D {fmt_pct_dot(m['chg20d'])} / "
-            f"60D {fmt_pct_dot(m['chg60d'])}"
-        )
 
-    if not valid:
-        lines.append("시장 데이터 없음")
-        lines.append("")
-        return lines, "데이터 부족", 30, 60
+class ReplayProvider:
+    """
+    RecordingProvider가 남긴 응답을 네트워크 없이 돌려준다.
+    start 요청은 기록된 봉 중 해당 날짜 이후만, period 요청은 기록 전체를 준다.
+    """
 
-    above20_count = sum(1 for m in valid if m["above20"])
-    above60_count = sum(1 for m in valid if m["above60"])
-    aligned_count = sum(1 for m in valid if m["is_aligned"])
+    host = None
 
-    score = above20_count + above60_count + aligned_count
+    def __init__(self, directory: Path):
+        self.directory = directory
 
-    lines.append("")
+    def history(self, ticker, window):
+        path = recording_path(self.directory, ticker)
 
-    if score >= 8:
-        market_status = "공격 가능"
-        min_weight, max_weight = 70, 100
-        comment = "지수와 반도체가 대부분 20/60일선 위에 있음. 주도주 중심 비중 확대 가능."
-    elif score >= 6:
-        market_status = "양호"
-        min_weight, max_weight = 60, 90
-        comment = "시장 추세는 양호. 정배열 강한 종목 위주로 비중 유지 또는 확대."
-    elif score >= 4:
-        market_status = "중립"
-        min_weight, max_weight = 40, 70
-        comment = "시장 추세가 애매함. 주도주만 선별하고 후행주는 관망."
-    elif score >= 2:
-        market_status = "방어"
-        min_weight, max_weight = 20, 50
-        comment = "지수 추세가 약함. 신규매수보다 20/60일선 이탈 관리 우선."
-    else:
-        market_status = "위험"
-        min_weight, max_weight = 0, 30
-        comment = "시장 대부분이 약세. 현금비중 확대와 손절 기준 준수 우선."
+        if not path.exists():
+            return None
 
-    lines.append(f"시장판단: {market_status}")
-    lines.append(f"권장 주식 비중 구간: {min_weight}~{max_weight}%")
-    lines.append(f"해석: {comment}")
-    lines.append("")
+        df = pd.read_pickle(path)
 
-    return lines, market_status, min_weight, max_weight
+        if "start" in window:
+            start = pd.Timestamp(window["start"])
 
+            if df.index.tz is not None:
+                start = start.tz_localize(df.index.tz)
 
-# =========================
-# 출력 포맷
-# =========================
+            df = df[df.index >= start]
 
-def fmt_pct_dot(x: float) -> str:
-    if x > 0:
-        return f"🟢{x:+.2f}%"
-    elif x < 0:
-        return f"🔴{x:+.2f}%"
-    else:
-        return f"{x:+.2f}%"
+        return df
 
 
-def ma_flag(close: float, ma: float) -> str:
-    return "🟢▲" if close >= ma else "🔴▼"
+def make_provider(name=PROVIDER_NAME):
+    if name == "yfinance":
+        return YFinanceProvider()
 
+    if name == "record":
+        return RecordingProvider(YFinanceProvider(), RECORDINGS_DIR)
 
-def vol_badge(vol_ratio: float) -> str:
-    if vol_ratio >= 2.0:
-        return "🔥"
-    if vol_ratio >= 1.5:
-        return "⚡"
-    if vol_ratio <= 0.7:
-        return "💧"
-    return ""
+    if name == "replay":
+        return ReplayProvider(RECORDINGS_DIR)
 
+    raise ValueError(f"알 수 없는 STOCK_ALERT_PROVIDER: {name!r}")
 
-def format_price(ticker, price):
-    if ticker.endswith(".KS") or ticker.endswith(".KQ"):
-        return f"{price:,.0f}원"
-    return f"${price:,.2f}"
 
+PROVIDER = make_provider()
 
-def trend_msg(stats):
-    if stats["is_aligned"] and stats["ma20_slope"] > 0 and stats["ma60_slope"] > 0:
-        return "완전 정배열 + 20/60일선 상승"
 
-    if stats["is_aligned"]:
-        return "완전 정배열"
+def set_provider(provider):
+    """벤치마크/오프라인 실행에서 시세 제공자를 바꿔 끼운다."""
+    global PROVIDER
+    PROVIDER = provider
 
-    if stats["above20"] and stats["above60"] and stats["ma20"] >= stats["ma60"]:
-        return "중기 상승 구조"
 
-    if stats["above20"] and not stats["above60"]:
-        return "단기 반등"
+def universe_tickers(*ticker_lists):
+    """
+    여러 종목 리스트를 순서를 유지한 채 중복 없이 합친다.
+    (예: SOXX는 기준지수이면서 포트폴리오 종목)
+    """
+    seen = set()
+    universe = []
 
-    if not stats["above20"] and stats["above60"]:
-        return "중기선 위 조정"
+    for tickers in ticker_lists:
+        for t in tickers:
+            if t in seen:
+                continue
+            seen.add(t)
+            universe.append(t)
 
-    return "약세 또는 정배열 아님"
+    return universe
 
 
-def format_block(r):
-    ticker = r["ticker"]
-    name = TICKER_NAME_MAP.get(ticker, ticker)
-
-    # 등급별 아이콘
-    if r["grade"] == "A":
-        grade_icon = "🟢"
-    elif r["grade"] == "B+":
-        grade_icon = "🟢"
-    elif r["grade"] == "B":
-        grade_icon = "🟡"
-    elif r["grade"] == "C":
-        grade_icon = "🟠"
-    else:
-        grade_icon = "🔴"
+def normalize_prices(df):
+    """yfinance 일봉을 저장소 형식(타임존 없는 날짜 인덱스 + PRICE_COLUMNS)으로 맞춘다."""
+    if df is None or df.empty:
+        return None
 
-    # 추세 상태
-    trend_tags = []
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = [c[0] for c in df.columns]
 
-    if r["is_aligned"]:
-        trend_tags.append("정배열")
-    elif r["above20"] and r["above60"]:
-        trend_tags.append("20/60위")
-    elif r["above20"]:
-        trend_tags.append("20위")
-    elif r["above60"]:
-        trend_tags.append("60위")
-    else:
-        trend_tags.append("20/60아래")
+    df = df[[c for c in PRICE_COLUMNS if c in df.columns]]
 
-    # 이벤트
-    if r["cross20_up"] and r["vol_ratio"] >= 2.0:
-        trend_tags.append("🚀20돌파")
-    elif r["cross20_up"]:
-        trend_tags.append("⭐20돌파")
+    if getattr(df.index, "tz", None) is not None:
+        df.index = df.index.tz_localize(None)
 
-    if r["cross20_down"]:
-        trend_tags.append("⚠️20이탈")
+    df.index.name = "Date"
+    df = df.dropna(how="all")
 
-    if r["cross60_down"]:
-        trend_tags.append("🚨60이탈")
+    if df.empty:
+        return None
 
-    trend_text = " / ".join(trend_tags)
+    return df
 
-    # 거래량
-    if r["vol_ratio"] >= 2.0:
-        vol_text = f"VOL {r['vol_ratio']:.1f}x🔥"
-    elif r["vol_ratio"] >= 1.5:
-        vol_text = f"VOL {r['vol_ratio']:.1f}x⚡"
-    elif r["vol_ratio"] <= 0.7:
-        vol_text = f"VOL {r['vol_ratio']:.1f}x💧"
-    else:
-        vol_text = f"VOL {r['vol_ratio']:.1f}x"
 
-    return (
-        f"{name} ({ticker})\n"
-        f"{grade_icon} {r['grade']} {r['score']:.0f}점 | {r['decision']}\n"
-        f"추세: {trend_text} | {vol_text}\n"
-        f"RS: 20D {r['rs20']:+.1f}%p / 60D {r['rs60']:+.1f}%p\n"
-        f"종가: {format_price(ticker, r['close'])}\n"
-        f"수익: 1D {fmt_pct_dot(r['chg1d'])} / 5D {fmt_pct_dot(r['chg5d'])}\n"
-        f"수익: 20D {fmt_pct_dot(r['chg20d'])} / 60D {fmt_pct_dot(r['chg60d'])}\n"
-        f"MA: 5일 {format_price(ticker, r['ma5'])} {ma_flag(r['close'], r['ma5'])} / "
-        f"10일 {format_price(ticker, r['ma10'])} {ma_flag(r['close'], r['ma10'])}\n"
-        f"MA: 20일 {format_price(ticker, r['ma20'])} {ma_flag(r['close'], r['ma20'])} / "
-        f"60일 {format_price(ticker, r['ma60'])} {ma_flag(r['close'], r['ma60'])}\n"
-    )
+def download_one(ticker, window):
+    """
+    현재 시세 제공자에서 한 종목 일봉을 받는다.
+    제공자 호스트의 속도 제한을 지키고 실패 시 지수 백오프로 재시도한다.
+    yf.download는 모듈 전역 상태를 공유해 여러 스레드에서 동시에 부를 수 없으므로
+    종목별 Ticker.history를 쓴다 (yf.download도 내부적으로 종목마다 같은 요청을 보낸다).
+    """
+    provider = PROVIDER
+    limiter = RATE_LIMITERS.get(provider.host)
+    start = time.perf_counter()
+
+    for attempt in range(FETCH_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            df = provider.history(ticker, window)
+        except Exception as e:
+            if attempt == FETCH_RETRIES:
+                print(f"[fetch] {ticker} 다운로드 실패: {e}")
+                METRICS.record_fetch(ticker, time.perf_counter() - start, 0, attempt, ok=False)
+                return None
+
+            time.sleep(FETCH_RETRY_BACKOFF * (2 ** attempt))
+            continue
 
+        # 원본 응답 크기 대신 받은 DataFrame의 메모리 크기를 기록한다
+        size = int(df.memory_usage(deep=True).sum()) if df is not None else 0
+        METRICS.record_fetch(ticker, time.perf_counter() - start, size, attempt, ok=df is not None)
 
-# =========================
-# 섹션 구성
-# =========================
+        return normalize_prices(df)
 
-def build_section_lines(title: str, tickers: list[str], markets: dict):
-    lines = [title]
-    results = []
-    missing = []
+    return None
 
-    event_list = {
-        "cross20_up": [],
-        "cross20_up_volume": [],
-        "cross20_down": [],
-        "cross60_down": [],
-        "strong_buy": [],
-    }
 
-    for t in tickers:
-        stats = fetch_stats(t)
+def iter_downloads(jobs, concurrency=None):
+    """
+    (ticker, window) 작업들을 concurrency(기본 FETCH_CONCURRENCY)개 스레드로 동시에 받으며
+    끝나는 순서대로 (ticker, DataFrame 또는 None)을 내보낸다.
+    window는 {"start": "YYYY-MM-DD"} 또는 {"period": "1y"}.
+    """
+    if not jobs:
+        return
 
-        if stats is None:
-            missing.append(t)
-            continue
+    workers = max(1, min(concurrency or FETCH_CONCURRENCY, len(jobs)))
 
-        market_key = get_market_key(t)
-        market_stats = markets.get(market_key)
+    from concurrent.futures import ThreadPoolExecutor, as_completed
 
-        if market_stats is None:
-            market_stats = {
-                "chg20d": 0,
-                "chg60d": 0,
-            }
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(download_one, ticker, window): ticker
+            for ticker, window in jobs
+        }
 
-        score, rs20, rs60 = calc_stock_score(stats, market_stats)
+        for future in as_completed(futures):
+            yield futures[future], future.result()
 
-        grade = grade_from_score(score)
-        decision = decision_from_stats(stats, score)
-        market_name = MARKET_NAME.get(market_key, "시장")
 
-        stats["score"] = score
-        stats["rs20"] = rs20
-        stats["rs60"] = rs60
-        stats["grade"] = grade
-        stats["decision"] = decision
-        stats["market_key"] = market_key
-        stats["market_name"] = market_name
+def history_window(period=None, start=None):
+    """
+    다운로드 구간. start > period 순으로 쓰고,
+    둘 다 없으면 지표 설정에서 계산한 최소 구간(plan_history_start)만 받는다.
+    """
+    if start is not None:
+        return {"start": start}
 
-        name = TICKER_NAME_MAP.get(t, t)
+    if period is not None:
+        return {"period": period}
 
-        if stats["cross20_up"]:
-            if stats["vol_ratio"] >= 2.0:
-                event_list["cross20_up_volume"].append(
-                    f"- {name} ({t}) | 매수 적극 검토 | 거래량 {stats['vol_ratio']:.2f}x / 점수 {score:.0f}"
-                )
-            else:
-                event_list["cross20_up"].append(
-                    f"- {name} ({t}) | 매수 고려 | 점수 {score:.0f}"
-                )
+    return {"start": plan_history_start()}
 
-        if stats["cross20_down"]:
-            event_list["cross20_down"].append(
-                f"- {name} ({t}) | 30% 매도 검토 | 점수 {score:.0f}"
-            )
 
-        if stats["cross60_down"]:
-            event_list["cross60_down"].append(
-                f"- {name} ({t}) | 전량 매도 검토 | 점수 {score:.0f}"
-            )
+def download_prices(tickers, period=None, start=None, concurrency=None):
+    """
+    종목들을 동시에 받아 {ticker: OHLCV DataFrame} 형태로 돌려준다.
+    구간은 history_window 규칙을 따른다.
+    받지 못한 종목은 결과에 포함되지 않는다.
+    """
+    window = history_window(period, start)
 
-        if score >= 80:
-            event_list["strong_buy"].append(
-                f"- {name} ({t}) | 비중 확대 후보 | 등급 {grade} / 점수 {score:.0f}"
-            )
+    frames = {}
 
-        results.append(stats)
+    for ticker, df in iter_downloads([(t, window) for t in tickers], concurrency):
+        if df is not None:
+            frames[ticker] = df
 
-    # 정렬 기준
-    # 점수 높은 순 → 정배열 → 상대강도 → 이평선 기울기 → 거래량
-    results.sort(
-        key=lambda x: (
-            x["score"],
-            x["is_aligned"],
-            x["rs20"],
-            x["rs60"],
-            x["ma20_slope"],
-            x["vol_ratio"],
-        ),
-        reverse=True
-    )
+    return frames
 
-    upper = [r for r in results if r["score"] >= 65]
-    middle = [r for r in results if 45 <= r["score"] < 65]
-    lower = [r for r in results if r["score"] < 45]
 
-    if upper:
-        lines.append("")
-        lines.append("🟢 상단: 비중 확대 / 보유 우선 후보")
+# =========================
+# 거래일 캘린더 (새 봉이 없으면 다운로드/계산/발송 생략)
+# =========================
+
+# 거래소별 시간대와 정규장 시간 (시, 분)
+EXCHANGES = {
+    "krx": {"tz": ZoneInfo("Asia/Seoul"), "open": (9, 0), "close": (15, 30)},
+    "nyse": {"tz": ZoneInfo("America/New_York"), "open": (9, 30), "close": (16, 0)},
+}
+
+# KRX 휴장일. 음력 명절/대체공휴일/선거일은 규칙으로 계산할 수 없어 연도별로 적는다.
+# 표에 없는 연도는 주말만 쉬는 것으로 본다 (휴장일에도 다운로드할 뿐 봉을 놓치지는 않는다).
+KRX_HOLIDAYS = {
+    2025: [
+        "01-01", "01-27", "01-28", "01-29", "01-30", "03-03", "05-01", "05-05", "05-06",
+        "06-03", "06-06", "08-15", "10-03", "10-06", "10-07", "10-08", "10-09", "12-25", "12-31",
+    ],
+    2026: [
+        "01-01", "02-16", "02-17", "02-18", "03-02", "05-01", "05-05", "05-25", "06-03",
+        "08-17", "09-24", "09-25", "10-05", "10-09", "12-25", "12-31",
+    ],
+    2027: [
+        "01-01", "02-08", "02-09", "03-01", "05-05", "05-13", "08-16", "09-14", "09-15",
+        "09-16", "10-04", "10-11", "12-27", "12-31",
+    ],
+}
+
+_HOLIDAY_CACHE = {}
+
+
+def ticker_exchange(ticker: str) -> str:
+    if ticker.endswith(".KS") or ticker.endswith(".KQ") or ticker in ("^KS11", "^KQ11"):
+        return "krx"
+    return "nyse"
+
+
+def easter_sunday(year):
+    """그레고리력 부활절 (Meeus/Jones/Butcher 방식)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+
+    return date(year, month, day + 1)
+
+
+def nth_weekday(year, month, weekday, n):
+    """month월의 n번째 weekday (n=-1이면 마지막)."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(day):
+    """토요일 공휴일은 금요일, 일요일 공휴일은 월요일에 쉰다."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def nyse_holidays(year):
+    """NYSE/NASDAQ 정규 휴장일 (조기 폐장일은 정상 거래일로 본다)."""
+    days = {
+        nth_weekday(year, 1, 0, 3),   # Martin Luther King Jr. Day
+        nth_weekday(year, 2, 0, 3),   # Presidents' Day
+        easter_sunday(year) - timedelta(days=2),  # Good Friday
+        nth_weekday(year, 5, 0, -1),  # Memorial Day
+        observed(date(year, 7, 4)),
+        nth_weekday(year, 9, 0, 1),   # Labor Day
+        nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        observed(date(year, 12, 25)),
+    }
+
+    # 신정이 토요일이면 전년 12/31에 쉬지 않는다
+    if date(year, 1, 1).weekday() != 5:
+        days.add(observed(date(year, 1, 1)))
+
+    if year >= 2022:
+        days.add(observed(date(year, 6, 19)))  # Juneteenth
+
+    return days
+
+
+def exchange_holidays(exchange, year):
+    key = (exchange, year)
+
+    if key not in _HOLIDAY_CACHE:
+        if exchange == "krx":
+            _HOLIDAY_CACHE[key] = {
+                date.fromisoformat(f"{year}-{md}") for md in KRX_HOLIDAYS.get(year, [])
+            }
+        else:
+            _HOLIDAY_CACHE[key] = nyse_holidays(year)
+
+    return _HOLIDAY_CACHE[key]
+
+
+def is_trading_day(exchange, day):
+    return day.weekday() < 5 and day not in exchange_holidays(exchange, day.year)
+
+
+def session_time(exchange, day, hm, minutes=0):
+    tz = EXCHANGES[exchange]["tz"]
+    local = datetime(day.year, day.month, day.day, hm[0], hm[1], tzinfo=tz)
+    return local + timedelta(minutes=minutes)
+
+
+def in_session(exchange, now=None):
+    """now가 정규장 시간 안이면 True (오늘 봉이 아직 바뀌는 중)."""
+    now = now or datetime.now(timezone.utc)
+    config = EXCHANGES[exchange]
+    day = now.astimezone(config["tz"]).date()
+
+    return (
+        is_trading_day(exchange, day)
+        and session_time(exchange, day, config["open"]) <= now < session_time(exchange, day, config["close"])
+    )
+
+
+def latest_session(exchange, now=None):
+    """now 시점에 정규장이 끝난 가장 최근 거래일 (거래소 현지 날짜)."""
+    now = now or datetime.now(timezone.utc)
+    config = EXCHANGES[exchange]
+    day = now.astimezone(config["tz"]).date()
+
+    if is_trading_day(exchange, day) and now >= session_time(exchange, day, config["close"]):
+        return day
+
+    # 오늘 장이 아직 끝나지 않았거나 휴장일 → 직전 거래일
+    for _ in range(30):
+        day -= timedelta(days=1)
+
+        if is_trading_day(exchange, day):
+            return day
+
+    return None
+
+
+def needs_refresh(ticker, last_bar, now=None):
+    """
+    가진 마지막 봉 날짜(last_bar)보다 새로 끝난 거래일이 있거나
+    정규장 중이면(장중 값 변경) True.
+    장중에 받은 마지막 봉은 다음 거래일 동기화 때 겹치는 봉으로 다시 받아 확정값으로 바뀐다.
+    """
+    if last_bar is None:
+        return True
+
+    exchange = ticker_exchange(ticker)
+
+    if in_session(exchange, now):
+        return True
+
+    session = latest_session(exchange, now)
+
+    return session is None or last_bar < session
+
+
+# =========================
+# 가격 저장소 (종목별 OHLCV + 증분 동기화)
+# =========================
+
+PRICE_STORE_DIR = STATE_DIR / "prices"
+
+# 종목당 보관할 최대 봉 수 (1년치 + 여유)
+PRICE_STORE_MAX_BARS = 400
+
+# 증분 동기화 시 다시 받는 마지막 저장 봉 수.
+# 마지막 봉은 장중 값이었을 수 있어 덮어쓰고,
+# 그 앞 봉은 확정값이므로 저장값과 달라졌으면 액면분할 등으로 과거가 수정된 것으로 본다.
+PRICE_STORE_OVERLAP = 2
+
+# 겹치는 확정 봉의 종가가 이 비율 이상 다르면 전체 기간을 다시 받는다.
+PRICE_RESTATE_TOLERANCE = 0.005
+
+# 종목별 저장된 마지막 봉 날짜 (거래일 캘린더와 비교해 받을 봉이 없으면 다운로드 생략)
+PRICE_SYNC_LOG_PATH = PRICE_STORE_DIR / "last_bars.json"
+
+
+def price_store_path(ticker: str) -> Path:
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", ticker)
+    return PRICE_STORE_DIR / f"{safe}.csv"
+
+
+def load_stored_prices(ticker):
+    path = price_store_path(ticker)
+
+    if not path.exists():
+        return None
+
+    try:
+        df = pd.read_csv(path, index_col=0, parse_dates=True)
+    except (OSError, ValueError) as e:
+        print(f"[price store] {ticker} 캐시 읽기 실패, 전체 기간 재다운로드: {e}")
+        return None
+
+    if df.empty:
+        return None
+
+    return df
+
+
+def save_stored_prices(ticker, df):
+    PRICE_STORE_DIR.mkdir(parents=True, exist_ok=True)
+
+    df = df.iloc[-PRICE_STORE_MAX_BARS:]
+    df.index.name = "Date"
+
+    path = price_store_path(ticker)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    df.to_csv(tmp)
+    tmp.replace(path)
+
+
+@contextmanager
+def file_lock(path: Path):
+    """다른 프로세스(같은 상태 디렉터리를 쓰는 샤드 등)와 같은 파일을 동시에 고치지 않도록 path를 잠근다."""
+    if fcntl is None:
+        yield
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_sync_log():
+    if not PRICE_SYNC_LOG_PATH.exists():
+        return {}
+
+    try:
+        with open(PRICE_SYNC_LOG_PATH, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[price store] 동기화 기록 읽기 실패, 전 종목 동기화: {e}")
+        return {}
+
+    return {t: date.fromisoformat(v) for t, v in raw.items()}
+
+
+def save_sync_log(updates):
+    """
+    이번 동기화에서 바뀐 종목의 마지막 봉 날짜만 저장된 기록에 합친다.
+    같은 상태 디렉터리를 쓰는 다른 프로세스의 기록을 덮어쓰지 않도록 잠근 채 다시 읽고 쓴다.
+    """
+    with file_lock(PRICE_SYNC_LOG_PATH.with_suffix(".lock")):
+        synced = load_sync_log()
+        synced.update(updates)
+        raw = {t: v.isoformat() for t, v in sorted(synced.items())}
+
+        tmp = PRICE_SYNC_LOG_PATH.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(raw, indent=2), encoding="utf-8")
+        tmp.replace(PRICE_SYNC_LOG_PATH)
+
+
+def stale_tickers(tickers, now=None):
+    """네트워크 호출 없이, 이번 동기화에서 다운로드가 필요한 종목만 돌려준다."""
+    synced = load_sync_log()
+
+    return [
+        t for t in tickers
+        if needs_refresh(t, synced.get(t), now) or not price_store_path(t).exists()
+    ]
+
+
+def merge_price_delta(stored, delta):
+    """
+    저장된 봉 뒤에 새로 받은 봉을 이어 붙인다.
+    겹치는 날짜는 새로 받은 값으로 덮어쓴다.
+    과거 확정 봉이 수정된 것으로 보이면 None을 돌려 전체 재다운로드를 유도한다.
+    """
+    delta = delta[stored.columns.intersection(delta.columns)]
+    overlap = stored.index.intersection(delta.index)
+
+    # 마지막 봉(장중 값 가능)을 제외한 겹치는 확정 봉으로 과거 수정 여부 확인
+    settled = overlap[overlap < stored.index[-1]]
+
+    if len(settled) > 0:
+        old_close = stored.loc[settled, "Close"].astype(float)
+        new_close = delta.loc[settled, "Close"].astype(float)
+        drift = ((new_close / old_close) - 1.0).abs().max()
+
+        if drift > PRICE_RESTATE_TOLERANCE:
+            return None
+
+    merged = pd.concat([stored[~stored.index.isin(delta.index)], delta])
+    merged = merged.sort_index()
+
+    return merged
+
+
+def sync_prices(tickers, period=None):
+    """
+    로컬 가격 저장소를 기준으로 {ticker: OHLCV DataFrame}을 돌려준다.
+
+    - 저장된 적 없거나 지표 계산에 봉이 모자란 종목:
+      필요한 최소 구간(period를 주면 period 전체)을 다운로드
+    - 저장된 종목: 마지막 저장 봉 근처부터 새 봉만 받아 이어 붙임
+
+    - 저장된 마지막 봉 이후 끝난 거래일이 없는 종목(휴장일/주말): 다운로드 없이 저장값 사용
+
+    모든 다운로드는 한 스케줄러에서 동시에 진행하고, 끝나는 대로 병합/저장한다.
+    새 봉을 받지 못한 종목은 저장된 값을 그대로 쓴다.
+    """
+    now = datetime.now(timezone.utc)
+    synced = load_sync_log()
+    updates = {}
+    prices = {}
+    jobs = []
+
+    for t in tickers:
+        stored = load_stored_prices(t)
+
+        if stored is None or len(stored) < max(MIN_BARS, PRICE_STORE_OVERLAP + 1):
+            jobs.append((t, history_window(period)))
+            continue
+
+        prices[t] = stored
+
+        if not needs_refresh(t, synced.get(t), now):
+            continue
+
+        start = stored.index[-PRICE_STORE_OVERLAP].strftime("%Y-%m-%d")
+        jobs.append((t, {"start": start}))
+
+    restated = []
+
+    for t, new in iter_downloads(jobs):
+        if new is None:
+            continue
+
+        if t in prices:
+            merged = merge_price_delta(prices[t], new)
+
+            if merged is None:
+                print(f"[price store] {t} 과거 가격 수정 감지, 전체 기간 재다운로드")
+                del prices[t]
+                restated.append(t)
+                continue
+
+            new = merged
+
+        prices[t] = new
+        save_stored_prices(t, new)
+        updates[t] = new.index[-1].date()
+
+    for t, df in download_prices(restated, period).items():
+        prices[t] = df
+        save_stored_prices(t, df)
+        updates[t] = df.index[-1].date()
+
+    if updates:
+        save_sync_log(updates)
+
+    return prices
+
+
+def fetch_stats(ticker, period=None, prices=None):
+    """
+    prices가 주어지면 미리 받아 둔 {ticker: DataFrame}에서 꺼내 쓰고,
+    없으면 로컬 가격 저장소에서 읽는다(새 봉만 증분 다운로드).
+    """
+    if prices is None:
+        prices = sync_prices([ticker], period=period)
+
+    df = prices.get(ticker)
+
+    if df is None:
+        return None
+
+    return compute_stats(ticker, df)
+
+
+def compute_stats(ticker, df):
+    if df is None or df.empty:
+        return None
+
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = [c[0] for c in df.columns]
+
+    stats = compute_universe_stats({ticker: df}, [ticker])
+
+    return stats.get(ticker)
+
+
+# =========================
+# 지표 계산 (봉 × 종목 2D 패널)
+# =========================
+
+MA_WINDOWS = (5, 10, 20, 60)
+VOLUME_MA_WINDOW = 20
+CHANGE_WINDOWS = (1, 5, 20, 60)
+
+# 휴장일(명절 연휴 등)과 데이터 누락에 대비한 달력일 여유
+HISTORY_MARGIN_RATIO = 0.1
+HISTORY_MARGIN_DAYS = 10
+
+
+def required_bars(ma_windows=MA_WINDOWS, volume_window=VOLUME_MA_WINDOW, change_windows=CHANGE_WINDOWS):
+    """
+    설정된 지표를 마지막 봉에서 계산하는 데 필요한 최소 봉 수.
+
+    - 이평선 기울기/돌파는 전일 이평선이 필요 → 최장 이평선 + 1
+    - n일 수익률은 n봉 전 종가가 필요 → n + 1
+    - 기존 기준(마지막 60일선 위치가 61 이상)에 맞춰 1봉 더 둔다.
+    """
+    return max(max(ma_windows) + 1, volume_window, max(change_windows) + 1) + 1
+
+
+MIN_BARS = required_bars()
+
+
+def plan_history_start(bars=None, today=None):
+    """
+    bars개 거래일을 확보하기 위한 다운로드 시작일 (YYYY-MM-DD).
+    주 5거래일 기준 달력일로 바꾼 뒤 휴장일 여유를 더한다.
+    더 긴 이평선을 설정하면 MIN_BARS와 함께 자동으로 넓어진다.
+    """
+    bars = bars or MIN_BARS
+    today = today or date.today()
+
+    days = math.ceil(bars / 5) * 7
+    days = int(days * (1 + HISTORY_MARGIN_RATIO)) + HISTORY_MARGIN_DAYS
+
+    return (today - timedelta(days=days)).strftime("%Y-%m-%d")
+
+# 컬럼형 결과에서 불리언으로 돌려줄 필드
+BOOL_FIELDS = (
+    "cross20_up",
+    "cross20_down",
+    "cross60_down",
+    "above5",
+    "above10",
+    "above20",
+    "above60",
+    "is_aligned",
+)
+
+# compute_stats가 돌려주는 dict의 필드 순서
+STAT_FIELDS = (
+    "close",
+    "ma5",
+    "ma10",
+    "ma20",
+    "ma60",
+    "chg1d",
+    "chg5d",
+    "chg20d",
+    "chg60d",
+    "ma20_slope",
+    "ma60_slope",
+    "vol_ratio",
+) + BOOL_FIELDS
+
+# 채점 후 붙는 필드
+SCORE_FIELDS = ("score", "rs20", "rs60", "grade", "decision", "market_key", "market_name")
+
+RECORD_FIELDS = ("ticker",) + STAT_FIELDS + SCORE_FIELDS
+
+
+class StockRecord:
+    """
+    종목 하나의 지표/채점 결과. 필드가 고정이라 dict 대신 __slots__로 둔다
+    (종목당 키 해시 테이블 없이 필드 값만, 만 종목 이상에서 메모리/할당이 적다).
+
+    기존 dict 코드와 같이 r["score"], r.get(...), dict(r)로 읽고 쓸 수 있다.
+    sort_key는 채점할 때 한 번 만들어 두는 정렬 키 (rank_key).
+    """
+
+    __slots__ = RECORD_FIELDS + ("sort_key",)
+
+    def __init__(self, fields=()):
+        for field, value in dict(fields).items():
+            setattr(self, field, value)
+
+        if "score" in self:
+            self.update_sort_key()
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in RECORD_FIELDS and hasattr(self, field)
+
+    def __eq__(self, other):
+        if isinstance(other, (StockRecord, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"StockRecord({self.to_dict()!r})"
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in RECORD_FIELDS else default
+
+    def keys(self):
+        return [field for field in RECORD_FIELDS if hasattr(self, field)]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.keys()}
+
+    def copy(self):
+        record = StockRecord.__new__(StockRecord)
+
+        for field in self.__slots__:
+            if hasattr(self, field):
+                setattr(record, field, getattr(self, field))
+
+        return record
+
+    def update_sort_key(self):
+        # 점수 높은 순 → 정배열 → 상대강도 → 이평선 기울기 → 거래량
+        self.sort_key = (
+            self.score, self.is_aligned, self.rs20, self.rs60, self.ma20_slope, self.vol_ratio,
+        )
+
+
+def record_json(value):
+    """json.dumps(default=...)용: StockRecord는 dict로 저장한다."""
+    if isinstance(value, StockRecord):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def build_price_panel(prices, tickers, bars=None):
+    """
+    종목별 OHLCV를 (봉 × 종목) 종가/거래량 2D 배열로 모은다.
+
+    한국/미국 종목은 거래일이 서로 달라 날짜 기준으로 맞추면 빈칸이 생기므로,
+    종목마다 종가가 있는 봉만 남겨 가장 최근 봉을 마지막 행에 맞춘다(오른쪽 정렬).
+    봉이 모자란 앞부분은 NaN으로 채운다. bars를 주면 최근 bars개 행만 만든다.
+    """
+    series = []
+
+    for t in tickers:
+        df = prices.get(t)
+
+        if df is None or df.empty:
+            series.append((np.empty(0), np.empty(0)))
+            continue
+
+        close = df["Close"].to_numpy(dtype=float)
+        volume = df["Volume"].to_numpy(dtype=float)
+
+        keep = np.isfinite(close)
+        series.append((close[keep], volume[keep]))
+
+    longest = max((len(c) for c, _ in series), default=0)
+    n_bars = longest if bars is None else min(bars, longest)
+
+    close_panel = np.full((n_bars, len(tickers)), np.nan)
+    volume_panel = np.full((n_bars, len(tickers)), np.nan)
+
+    for j, (close, volume) in enumerate(series):
+        n = min(len(close), n_bars)
+
+        if n == 0:
+            continue
+
+        close_panel[n_bars - n:, j] = close[-n:]
+        volume_panel[n_bars - n:, j] = volume[-n:]
+
+    return close_panel, volume_panel
+
+
+def rolling_mean(values, window):
+    """
+    axis 0(봉) 방향 단순이동평균.
+    창 안에 NaN이 하나라도 있으면 NaN (pandas rolling(window).mean()과 같은 규칙).
+    """
+    out = np.full(values.shape, np.nan)
+
+    if values.shape[0] < window:
+        return out
+
+    finite = np.isfinite(values)
+    zeros = np.zeros((1,) + values.shape[1:])
+
+    csum = np.concatenate([zeros, np.cumsum(np.where(finite, values, 0.0), axis=0)])
+    ccount = np.concatenate([zeros, np.cumsum(finite, axis=0)])
+
+    sums = csum[window:] - csum[:-window]
+    counts = ccount[window:] - ccount[:-window]
+
+    out[window - 1:] = np.where(counts == window, sums / window, np.nan)
+
+    return out
+
+
+def shift_rows(values, k):
+    """k봉 전 값을 같은 행에 놓는다 (앞부분은 NaN)."""
+    out = np.full(values.shape, np.nan)
+
+    if k < values.shape[0]:
+        out[k:] = values[:-k]
+
+    return out
+
+
+def compute_indicator_panel(close, volume):
+    """
+    (봉 × 종목) 종가/거래량 패널에서 모든 행, 모든 종목의 지표를
+    한 번에 계산해 {필드: 2D 배열}로 돌려준다.
+
+    "valid"는 해당 행에서 compute_stats 기준(MIN_BARS)을 만족하는지 여부.
+    """
+    ind = {"close": close}
+
+    for w in MA_WINDOWS:
+        ind[f"ma{w}"] = rolling_mean(close, w)
+
+    vol_ma = rolling_mean(volume, VOLUME_MA_WINDOW)
+
+    for k in CHANGE_WINDOWS:
+        ind[f"chg{k}d"] = (close / shift_rows(close, k) - 1.0) * 100.0
+
+    close_prev = shift_rows(close, 1)
+    ma20_prev = shift_rows(ind["ma20"], 1)
+    ma60_prev = shift_rows(ind["ma60"], 1)
+
+    ma5, ma10, ma20, ma60 = ind["ma5"], ind["ma10"], ind["ma20"], ind["ma60"]
+
+    # 이평선 기울기
+    ind["ma20_slope"] = (ma20 / ma20_prev - 1.0) * 100.0
+    ind["ma60_slope"] = (ma60 / ma60_prev - 1.0) * 100.0
+
+    # 거래량
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ind["vol_ratio"] = np.where(vol_ma > 0, volume / vol_ma, 0.0)
+
+    # 이벤트 감지
+    ind["cross20_up"] = (close_prev < ma20_prev) & (close >= ma20)
+    ind["cross20_down"] = (close_prev >= ma20_prev) & (close < ma20)
+    ind["cross60_down"] = (close_prev >= ma60_prev) & (close < ma60)
+
+    ind["above5"] = close >= ma5
+    ind["above10"] = close >= ma10
+    ind["above20"] = close >= ma20
+    ind["above60"] = close >= ma60
+    ind["is_aligned"] = (close >= ma5) & (ma5 >= ma10) & (ma10 >= ma20) & (ma20 >= ma60)
+
+    bars_so_far = np.cumsum(np.isfinite(close), axis=0)
+    ind["valid"] = np.isfinite(ma60) & (bars_so_far >= MIN_BARS)
+
+    return ind
+
+
+def compute_stats_columns(prices, tickers):
+    """
+    유니버스 전체의 최신 봉 지표를 컬럼형({필드: 1D 배열})으로 계산한다.
+    마지막 봉만 필요하므로 패널은 최근 MIN_BARS개 행만 만든다.
+    """
+    close, volume = build_price_panel(prices, tickers, bars=MIN_BARS)
+
+    columns = {"ticker": np.array(tickers, dtype=object)}
+    columns.update(last_bar_columns(close, volume))
+
+    return columns
+
+
+def last_bar_columns(close, volume):
+    """(봉 × 종목) 패널의 마지막 봉 지표만 {필드: 1D 배열}로."""
+    panel = compute_indicator_panel(close, volume)
+    columns = {}
+
+    for field in ("valid",) + STAT_FIELDS:
+        if panel[field].shape[0] == 0:
+            dtype = bool if field == "valid" or field in BOOL_FIELDS else float
+            columns[field] = np.zeros(close.shape[1], dtype=dtype)
+            continue
+
+        columns[field] = panel[field][-1]
+
+    return columns
+
+
+def stats_from_columns(columns, i):
+    """컬럼형 결과의 i번째 종목을 StockRecord로 꺼낸다."""
+    stats = StockRecord()
+    stats.ticker = columns["ticker"][i]
+
+    for field in STAT_FIELDS:
+        if field in BOOL_FIELDS:
+            setattr(stats, field, bool(columns[field][i]))
+        else:
+            setattr(stats, field, float(columns[field][i]))
+
+    return stats
+
+
+def fill_scores(stats, columns, i, market_key):
+    """score_columns 결과의 i번째 값을 stats에 채우고 정렬 키를 만든다."""
+    stats.score = float(columns["score"][i])
+    stats.rs20 = float(columns["rs20"][i])
+    stats.rs60 = float(columns["rs60"][i])
+    stats.grade = columns["grade"][i]
+    stats.decision = columns["decision"][i]
+    stats.market_key = market_key
+    stats.market_name = MARKET_NAME.get(market_key, "시장")
+    stats.update_sort_key()
+
+    return stats
+
+
+def compute_universe_stats(prices, tickers):
+    """{ticker: stats dict}. 기간이 부족하거나 데이터가 없는 종목은 빠진다."""
+    columns = compute_stats_columns(prices, tickers)
+
+    return {
+        columns["ticker"][i]: stats_from_columns(columns, i)
+        for i in np.flatnonzero(columns["valid"])
+    }
+
+
+# =========================
+# 실시간 감시용 지표 상태 (종목별 이동합 + 링 버퍼)
+# =========================
+
+# 종가 링 버퍼 길이: 최장 이평선의 전일 값과 최장 수익률 기준 종가까지 담는다
+ROLLING_CLOSE_BARS = max(max(MA_WINDOWS), max(CHANGE_WINDOWS)) + 1
+
+# 누적 덧셈 오차를 없애기 위해 이 횟수만큼 갱신하면 버퍼에서 합계를 다시 계산한다
+ROLLING_RESUM_EVERY = 250
+
+
+class RollingState:
+    """
+    한 종목의 이동평균 상태.
+    새 봉은 push로 O(1)에 반영하고(창에서 빠지는 값을 빼고 새 값을 더함),
+    같은 날짜의 봉이 다시 오면(장중 값 → 종가) replace_last로 덮어쓴다.
+    """
+
+    def __init__(self, last_date=None, prev_date=None, closes=(), volumes=(), count=0):
+        self.last_date = last_date
+        self.prev_date = prev_date
+        self.closes = deque(closes, maxlen=ROLLING_CLOSE_BARS)
+        self.volumes = deque(volumes, maxlen=VOLUME_MA_WINDOW)
+        self.count = count
+        self.updates = 0
+        self.resum()
+
+    def resum(self):
+        closes = list(self.closes)
+        volumes = list(self.volumes)
+
+        self.sums = {w: float(sum(closes[-w:])) for w in MA_WINDOWS}
+        self.vol_sum = float(sum(v for v in volumes if math.isfinite(v)))
+        self.vol_nan = sum(1 for v in volumes if not math.isfinite(v))
+        self.updates = 0
+
+    def push(self, day, close, volume):
+        for w in MA_WINDOWS:
+            if len(self.closes) >= w:
+                self.sums[w] -= self.closes[-w]
+            self.sums[w] += close
+
+        if len(self.volumes) == self.volumes.maxlen:
+            self._drop_volume(self.volumes[0])
+        self._add_volume(volume)
+
+        self.closes.append(close)
+        self.volumes.append(volume)
+
+        self.prev_date = self.last_date
+        self.last_date = day
+        self.count += 1
+
+        self.updates += 1
+        if self.updates >= ROLLING_RESUM_EVERY:
+            self.resum()
+
+    def replace_last(self, close, volume):
+        for w in MA_WINDOWS:
+            self.sums[w] += close - self.closes[-1]
+
+        self._drop_volume(self.volumes[-1])
+        self._add_volume(volume)
+
+        self.closes[-1] = close
+        self.volumes[-1] = volume
+
+    def _add_volume(self, volume):
+        if math.isfinite(volume):
+            self.vol_sum += volume
+        else:
+            self.vol_nan += 1
+
+    def _drop_volume(self, volume):
+        if math.isfinite(volume):
+            self.vol_sum -= volume
+        else:
+            self.vol_nan -= 1
+
+    def ma(self, w, ago=0):
+        """w일 이평선 (ago=1이면 전일 값)."""
+        if ago == 0:
+            return self.sums[w] / w
+
+        return (self.sums[w] - self.closes[-1] + self.closes[-1 - w]) / w
+
+    def stats(self, ticker):
+        """compute_stats와 같은 필드의 StockRecord. 봉이 MIN_BARS보다 적으면 None."""
+        if self.count < MIN_BARS:
+            return None
+
+        closes = self.closes
+        close0 = closes[-1]
+        close_prev = closes[-2]
+
+        ma5v, ma10v, ma20v, ma60v = (self.ma(w) for w in (5, 10, 20, 60))
+        ma20_prev = self.ma(20, ago=1)
+        ma60_prev = self.ma(60, ago=1)
+
+        vol_today = self.volumes[-1]
+        vol_avg20 = self.vol_sum / VOLUME_MA_WINDOW if self.vol_nan == 0 else float("nan")
+        vol_ratio = (vol_today / vol_avg20) if vol_avg20 > 0 else 0.0
+
+        return StockRecord({
+            "ticker": ticker,
+            "close": close0,
+            "ma5": ma5v,
+            "ma10": ma10v,
+            "ma20": ma20v,
+            "ma60": ma60v,
+            "chg1d": (close0 / closes[-2] - 1.0) * 100.0,
+            "chg5d": (close0 / closes[-6] - 1.0) * 100.0,
+            "chg20d": (close0 / closes[-21] - 1.0) * 100.0,
+            "chg60d": (close0 / closes[-61] - 1.0) * 100.0,
+            "ma20_slope": (ma20v / ma20_prev - 1.0) * 100.0,
+            "ma60_slope": (ma60v / ma60_prev - 1.0) * 100.0,
+            "vol_ratio": vol_ratio,
+            "cross20_up": (close_prev < ma20_prev) and (close0 >= ma20v),
+            "cross20_down": (close_prev >= ma20_prev) and (close0 < ma20v),
+            "cross60_down": (close_prev >= ma60_prev) and (close0 < ma60v),
+            "above5": close0 >= ma5v,
+            "above10": close0 >= ma10v,
+            "above20": close0 >= ma20v,
+            "above60": close0 >= ma60v,
+            "is_aligned": close0 >= ma5v >= ma10v >= ma20v >= ma60v,
+        })
+
+
+def rolling_state_from_prices(df):
+    """df의 확정 봉으로 상태를 만든다. 버퍼에 들어갈 마지막 봉들의 날짜만 문자열로 바꾼다."""
+    close = df["Close"].to_numpy(dtype=float)
+    volume = df["Volume"].to_numpy(dtype=float)
+    rows = np.flatnonzero(np.isfinite(close))
+
+    if len(rows) == 0:
+        return None
+
+    tail = rows[-ROLLING_CLOSE_BARS:]
+
+    return RollingState(
+        last_date=df.index[tail[-1]].strftime("%Y-%m-%d"),
+        prev_date=df.index[tail[-2]].strftime("%Y-%m-%d") if len(tail) > 1 else None,
+        closes=close[tail].tolist(),
+        volumes=volume[tail[-VOLUME_MA_WINDOW:]].tolist(),
+        count=len(rows),
+    )
+
+
+# =========================
+# 시장 기준
+# =========================
+
+def get_market_key(ticker: str) -> str:
+    kr_semi = [
+        "005930.KS",  # 삼성전자
+        "000660.KS",  # SK하이닉스
+        "009150.KS",  # 삼성전기
+        "011070.KS",  # LG이노텍
+        "319660.KQ",  # 피에스케이
+    ]
+
+    if ticker in kr_semi:
+        return "semi"
+
+    if ticker.endswith(".KS") or ticker.endswith(".KQ"):
+        return "kr"
+
+    semi_keywords = [
+        "NVDA", "AMD", "MU", "TSM", "LRCX", "ASML", "AMAT",
+        "WDC", "ARM", "MRVL", "DELL", "AVGO", "TER", "COHR",
+        "SOXX", "INTC", "SNDK"
+    ]
+
+    clean_ticker = ticker.replace(".US", "").upper()
+
+    if clean_ticker in semi_keywords:
+        return "semi"
+
+    return "us"
+
+
+# =========================
+# 점수 계산
+# =========================
+
+# scoring.json의 조건 연산자
+# (배열에는 원소별로 적용된다)
+SCORING_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def load_scoring_rules():
+    with open(BASE_DIR / "scoring.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compile_condition(cond):
+    """
+    scoring.json 조건을 {필드: 배열} -> 불리언 배열 함수로 바꾼다.
+
+    - "is_aligned"            : 불리언 필드 그대로
+    - ["rs20", ">", 5]        : 필드와 상수 비교
+    - ["ma5", ">=", "ma10"]   : 필드끼리 비교
+    """
+    if isinstance(cond, str):
+        return lambda f: np.asarray(f[cond], dtype=bool)
+
+    lhs, op, rhs = cond
+
+    if op not in SCORING_OPS:
+        raise ValueError(f"알 수 없는 연산자: {op!r} ({cond})")
+
+    fn = SCORING_OPS[op]
+
+    if isinstance(rhs, str):
+        return lambda f: fn(f[lhs], f[rhs])
+
+    return lambda f: fn(f[lhs], rhs)
+
+
+def compile_rule(rule):
+    when = compile_condition(rule["if"])
+
+    if "unless" not in rule:
+        return when
+
+    unless = compile_condition(rule["unless"])
+
+    return lambda f: when(f) & ~unless(f)
+
+
+def compile_scoring_rules(config):
+    """
+    scoring.json을 배열 단위 평가 함수 세 개로 컴파일한다.
+
+    - score(fields)           -> 점수 배열
+    - grade(scores)           -> 등급 배열
+    - decision(fields)        -> 판단 배열 (fields에 "score" 포함)
+
+    그룹은 기본적으로 조건을 만족하는 규칙 점수를 모두 더하고,
+    "first_match"면 위에서부터 처음 만족한 규칙 하나만 반영한다(if/elif).
+    """
+    groups = []
+
+    for group in config["score"]:
+        rules = [(compile_rule(r), float(r["points"])) for r in group["rules"]]
+        groups.append((rules, bool(group.get("first_match", False))))
+
+    grade_levels = [(float(g["min_score"]), g["grade"]) for g in config["grades"]]
+    default_grade = config["default_grade"]
+
+    decision_rules = [(compile_rule(d), d["decision"]) for d in config["decisions"]]
+    default_decision = config["default_decision"]
+
+    def score(fields):
+        shape = np.shape(fields["close"])
+        total = np.zeros(shape)
+
+        for rules, first_match in groups:
+            if first_match:
+                masks = [np.broadcast_to(cond(fields), shape) for cond, _ in rules]
+                points = [np.full(shape, p) for _, p in rules]
+                total += np.select(masks, points, 0.0)
+            else:
+                for cond, p in rules:
+                    total += np.where(cond(fields), p, 0.0)
+
+        return total
+
+    def grade(scores):
+        scores = np.asarray(scores)
+        masks = [scores >= level for level, _ in grade_levels]
+        return np.select(masks, [g for _, g in grade_levels], default_grade).astype(object)
+
+    def decision(fields):
+        shape = np.shape(fields["score"])
+        masks = [np.broadcast_to(cond(fields), shape) for cond, _ in decision_rules]
+        return np.select(masks, [d for _, d in decision_rules], default_decision).astype(object)
+
+    return score, grade, decision
+
+
+_SCORING = {}
+
+
+def scoring_rules():
+    if "rules" not in _SCORING:
+        _SCORING["rules"] = load_scoring_rules()
+    return _SCORING["rules"]
+
+
+def scoring_functions():
+    """컴파일한 (score, grade, decision) 함수. scoring.json은 처음 채점할 때 읽는다."""
+    if "compiled" not in _SCORING:
+        _SCORING["compiled"] = compile_scoring_rules(scoring_rules())
+    return _SCORING["compiled"]
+
+
+def report_thresholds():
+    """
+    scoring.json의 리포트 기준: 상단/중간 구간 점수와
+    요약 이벤트 조건(비중 확대 후보, 거래량 동반 20일선 돌파)을 한 번만 컴파일한다.
+    """
+    if "report" not in _SCORING:
+        rules = scoring_rules()
+        _SCORING["report"] = {
+            "upper": float(rules["buckets"]["upper"]),
+            "middle": float(rules["buckets"]["middle"]),
+            "strong_buy": compile_condition(rules["strong_buy"]),
+            "volume_breakout": compile_condition(rules["volume_breakout"]),
+        }
+    return _SCORING["report"]
+
+
+def score_columns(columns, market_chg20, market_chg60):
+    """
+    컬럼형 지표({필드: 1D 배열})와 종목별 기준시장 20D/60D 수익률 배열로
+    유니버스 전체의 rs20/rs60/score/grade/decision을 한 번에 계산해 columns에 채운다.
+    """
+    score_fields, grade_scores, decide_fields = scoring_functions()
+
+    columns["rs20"] = columns["chg20d"] - market_chg20
+    columns["rs60"] = columns["chg60d"] - market_chg60
+    columns["score"] = score_fields(columns)
+    columns["grade"] = grade_scores(columns["score"])
+    columns["decision"] = decide_fields(columns)
+
+    return columns
+
+
+def score_stats_list(stats_list, markets):
+    """
+    stats dict 목록을 한 번에 채점해 각 dict에
+    score / rs20 / rs60 / grade / decision / market_key / market_name을 채운다.
+    기준시장 데이터가 없으면 기준 수익률을 0으로 본다.
+    """
+    if not stats_list:
+        return stats_list
+
+    columns = {
+        field: np.array([s[field] for s in stats_list])
+        for field in STAT_FIELDS
+    }
+
+    market_keys = [get_market_key(s["ticker"]) for s in stats_list]
+    market_chg20 = np.array([markets.get(k, {}).get("chg20d", 0) for k in market_keys], dtype=float)
+    market_chg60 = np.array([markets.get(k, {}).get("chg60d", 0) for k in market_keys], dtype=float)
+
+    score_columns(columns, market_chg20, market_chg60)
+
+    for i, stats in enumerate(stats_list):
+        fill_scores(stats, columns, i, market_keys[i])
+
+    return stats_list
+
+
+def calc_stock_score(stats, market_stats):
+    """
+    한 종목의 (점수, 20일 상대강도, 60일 상대강도).
+
+    단순히 많이 오른 종목이 아니라 정배열 구조, 이평선 기울기, 기준시장 대비 상대강도,
+    거래량, 20/60일선 돌파·이탈 이벤트를 합산해 점수화한다 (과열 감점/이격도는 쓰지 않는다).
+    그룹별 조건과 가중치, 등급/판단 기준은 scoring.json에 있고 배열 연산으로 컴파일해 쓴다.
+    리포트의 점수 기준 안내도 같은 파일에서 만든다 (scoring_guide_lines).
+    (여러 종목을 한 번에 채점할 때는 score_columns / score_stats_list 사용)
+    """
+
+    rs20 = stats["chg20d"] - market_stats.get("chg20d", 0)
+    rs60 = stats["chg60d"] - market_stats.get("chg60d", 0)
+
+    fields = dict(stats, rs20=rs20, rs60=rs60)
+    score = float(scoring_functions()[0](fields))
+
+    return score, rs20, rs60
+
+
+def grade_from_score(score):
+    return scoring_functions()[1](score).item()
+
+
+def decision_from_stats(stats, score):
+    return scoring_functions()[2](dict(stats, score=score)).item()
+
+
+# =========================
+# 시장 판단
+# =========================
+
+def lookup_stats(ticker, universe_stats=None):
+    """
+    미리 계산해 둔 유니버스 지표가 있으면 사본을 돌려주고(섹션별로 점수 필드를 덧붙이므로),
+    없으면 해당 종목만 따로 계산한다.
+    """
+    if universe_stats is None:
+        return fetch_stats(ticker)
+
+    stats = universe_stats.get(ticker)
+
+    if stats is None:
+        return None
+
+    return stats.copy()
+
+
+def fetch_market_stats(universe_stats=None):
+    markets = {}
+
+    for key, ticker in MARKET_INDEX.items():
+        stats = lookup_stats(ticker, universe_stats)
+
+        if stats is None:
+            continue
+
+        markets[key] = stats
+
+    return markets
+
+
+def market_status_text(markets):
+    lines = ["💰 전체 주식 비중 가이드", ""]
+
+    valid = []
+
+    for key in ["kr", "us", "semi"]:
+        if key not in markets:
+            continue
+
+        m = markets[key]
+        valid.append(m)
+
+        lines.append(
+            f"- {MARKET_NAME[key]}: "
+            f"20일선 {'위' if m['above20'] else '아래'} / "
+            f"60일선 {'위' if m['above60'] else '아래'} / "
+            f"20D {fmt_pct_dot(m['chg20d'])} / "
+            f"60D {fmt_pct_dot(m['chg60d'])}"
+        )
+
+    if not valid:
+        lines.append("시장 데이터 없음")
         lines.append("")
-        for r in upper:
-            lines.append(format_block(r))
+        return lines, "데이터 부족", 30, 60
+
+    above20_count = sum(1 for m in valid if m["above20"])
+    above60_count = sum(1 for m in valid if m["above60"])
+    aligned_count = sum(1 for m in valid if m["is_aligned"])
+
+    score = above20_count + above60_count + aligned_count
+
+    lines.append("")
+
+    if score >= 8:
+        market_status = "공격 가능"
+        min_weight, max_weight = 70, 100
+        comment = "지수와 반도체가 대부분 20/60일선 위에 있음. 주도주 중심 비중 확대 가능."
+    elif score >= 6:
+        market_status = "양호"
+        min_weight, max_weight = 60, 90
+        comment = "시장 추세는 양호. 정배열 강한 종목 위주로 비중 유지 또는 확대."
+    elif score >= 4:
+        market_status = "중립"
+        min_weight, max_weight = 40, 70
+        comment = "시장 추세가 애매함. 주도주만 선별하고 후행주는 관망."
+    elif score >= 2:
+        market_status = "방어"
+        min_weight, max_weight = 20, 50
+        comment = "지수 추세가 약함. 신규매수보다 20/60일선 이탈 관리 우선."
+    else:
+        market_status = "위험"
+        min_weight, max_weight = 0, 30
+        comment = "시장 대부분이 약세. 현금비중 확대와 손절 기준 준수 우선."
+
+    lines.append(f"시장판단: {market_status}")
+    lines.append(f"권장 주식 비중 구간: {min_weight}~{max_weight}%")
+    lines.append(f"해석: {comment}")
+    lines.append("")
+
+    return lines, market_status, min_weight, max_weight
+
+
+# =========================
+# 출력 포맷
+# =========================
+
+def fmt_pct_dot(x: float) -> str:
+    if x > 0:
+        return f"🟢{x:+.2f}%"
+    elif x < 0:
+        return f"🔴{x:+.2f}%"
+    else:
+        return f"{x:+.2f}%"
+
+
+def ma_flag(close: float, ma: float) -> str:
+    return "🟢▲" if close >= ma else "🔴▼"
+
+
+def vol_badge(vol_ratio: float) -> str:
+    if vol_ratio >= 2.0:
+        return "🔥"
+    if vol_ratio >= 1.5:
+        return "⚡"
+    if vol_ratio <= 0.7:
+        return "💧"
+    return ""
+
+
+def format_price(ticker, price):
+    if ticker.endswith(".KS") or ticker.endswith(".KQ"):
+        return f"{price:,.0f}원"
+    return f"${price:,.2f}"
+
+
+def trend_msg(stats):
+    if stats["is_aligned"] and stats["ma20_slope"] > 0 and stats["ma60_slope"] > 0:
+        return "완전 정배열 + 20/60일선 상승"
+
+    if stats["is_aligned"]:
+        return "완전 정배열"
+
+    if stats["above20"] and stats["above60"] and stats["ma20"] >= stats["ma60"]:
+        return "중기 상승 구조"
+
+    if stats["above20"] and not stats["above60"]:
+        return "단기 반등"
+
+    if not stats["above20"] and stats["above60"]:
+        return "중기선 위 조정"
+
+    return "약세 또는 정배열 아님"
+
+
+GRADE_ICONS = {"A": "🟢", "B+": "🟢", "B": "🟡", "C": "🟠"}
+GRADE_COLORS = {"A": "#1a9c3e", "B+": "#1a9c3e", "B": "#d4a106", "C": "#e8730c"}
+
+# 종목 블록 템플릿 (import 시점에 한 번 만들어 두고 format_map만 호출)
+BLOCK_TEXT = (
+    "{name} ({ticker})\n"
+    "{grade_icon} {grade} {score}점 | {decision}\n"
+    "추세: {trend} | {vol}\n"
+    "RS: 20D {rs20}%p / 60D {rs60}%p\n"
+    "종가: {close}\n"
+    "수익: 1D {chg1d} / 5D {chg5d}\n"
+    "수익: 20D {chg20d} / 60D {chg60d}\n"
+    "MA: 5일 {ma5} {flag5} / 10일 {ma10} {flag10}\n"
+    "MA: 20일 {ma20} {flag20} / 60일 {ma60} {flag60}\n"
+).format_map
+
+BLOCK_HTML = (
+    '<div style="margin:8px 0;padding:4px 10px;border-left:4px solid {color}">'
+    "<b>{name}</b> ({ticker})<br>"
+    "{grade_icon} <b>{grade} {score}점</b> | {decision}<br>"
+    "추세: {trend} | {vol}<br>"
+    "RS: 20D {rs20}%p / 60D {rs60}%p<br>"
+    "종가: {close}<br>"
+    "수익: 1D {chg1d} / 5D {chg5d}<br>"
+    "수익: 20D {chg20d} / 60D {chg60d}<br>"
+    "MA: 5일 {ma5} {flag5} / 10일 {ma10} {flag10}<br>"
+    "MA: 20일 {ma20} {flag20} / 60일 {ma60} {flag60}"
+    "</div>"
+).format_map
+
+
+def block_fields(r):
+    """종목 블록 템플릿에 넣을 문자열 값."""
+    ticker = r["ticker"]
+
+    # 추세 상태
+    trend_tags = []
+
+    if r["is_aligned"]:
+        trend_tags.append("정배열")
+    elif r["above20"] and r["above60"]:
+        trend_tags.append("20/60위")
+    elif r["above20"]:
+        trend_tags.append("20위")
+    elif r["above60"]:
+        trend_tags.append("60위")
+    else:
+        trend_tags.append("20/60아래")
+
+    # 이벤트
+    if r["cross20_up"] and report_thresholds()["volume_breakout"](r):
+        trend_tags.append("🚀20돌파")
+    elif r["cross20_up"]:
+        trend_tags.append("⭐20돌파")
+
+    if r["cross20_down"]:
+        trend_tags.append("⚠️20이탈")
+
+    if r["cross60_down"]:
+        trend_tags.append("🚨60이탈")
+
+    fields = {
+        "name": ticker_name(ticker),
+        "ticker": ticker,
+        "grade_icon": GRADE_ICONS.get(r["grade"], "🔴"),
+        "grade": r["grade"],
+        "score": f"{r['score']:.0f}",
+        "decision": r["decision"],
+        "trend": " / ".join(trend_tags),
+        "vol": f"VOL {r['vol_ratio']:.1f}x{vol_badge(r['vol_ratio'])}",
+        "rs20": f"{r['rs20']:+.1f}",
+        "rs60": f"{r['rs60']:+.1f}",
+        "close": format_price(ticker, r["close"]),
+    }
+
+    for key in ("chg1d", "chg5d", "chg20d", "chg60d"):
+        fields[key] = fmt_pct_dot(r[key])
+
+    for w in (5, 10, 20, 60):
+        fields[f"ma{w}"] = format_price(ticker, r[f"ma{w}"])
+        fields[f"flag{w}"] = ma_flag(r["close"], r[f"ma{w}"])
+
+    return fields
+
+
+def format_block(r):
+    return BLOCK_TEXT(block_fields(r))
+
+
+def format_block_html(r, fields=None):
+    fields = fields or block_fields(r)
+    escaped = {k: escape(v) for k, v in fields.items()}
+    return BLOCK_HTML(dict(escaped, color=GRADE_COLORS.get(r["grade"], "#d23c3c")))
+
+
+HTML_OPEN = (
+    '<html><body style="font-family:-apple-system,\'Malgun Gothic\',sans-serif;'
+    'font-size:14px;line-height:1.5">'
+)
+HTML_CLOSE = "</body></html>"
+HTML_LINE = "<div>{}</div>".format
+HTML_HEADING = '<h3 style="margin:14px 0 4px">{}</h3>'.format
+
+
+class ReportWriter:
+    """
+    리포트를 쓰는 즉시 버퍼에 흘려 보낸다 (plain text + 선택적으로 HTML).
+    줄 사이에만 줄바꿈을 넣어 "\n".join(lines)와 같은 본문을 만든다.
+    """
+
+    def __init__(self, html=False):
+        self._text = io.StringIO()
+        self._html = io.StringIO() if html else None
+        self._started = False
+
+        if self._html is not None:
+            self._html.write(HTML_OPEN)
+
+    def _write_text(self, text):
+        if self._started:
+            self._text.write("\n")
+
+        self._text.write(text)
+        self._started = True
+
+    def line(self, text=""):
+        self._write_text(text)
+
+        if self._html is not None:
+            self._html.write(HTML_LINE(escape(text)) if text else "<br>")
+
+    def lines(self, texts):
+        for text in texts:
+            self.line(text)
+
+    def heading(self, text):
+        self._write_text(text)
+
+        if self._html is not None:
+            self._html.write(HTML_HEADING(escape(text)))
+
+    def block(self, r):
+        fields = block_fields(r)
+        self._write_text(BLOCK_TEXT(fields))
+
+        if self._html is not None:
+            self._html.write(format_block_html(r, fields))
+
+    def text(self):
+        return self._text.getvalue()
+
+    def html(self):
+        if self._html is None:
+            return None
+        return self._html.getvalue() + HTML_CLOSE
+
+
+# =========================
+# 섹션 구성
+# =========================
+
+def rank_key(r):
+    return r.sort_key
+
+
+def rank_results(results):
+    """
+    채점된 결과를 정렬하고 상단/중간/하단 구간으로 나눈다.
+    정렬 기준: 점수 높은 순 → 정배열 → 상대강도 → 이평선 기울기 → 거래량
+    """
+    results.sort(key=rank_key, reverse=True)
+
+    # 점수 순으로 정렬되어 있으므로 한 번 훑으며 나눈다 (구간 점수는 scoring.json의 buckets)
+    thresholds = report_thresholds()
+    upper, middle, lower = [], [], []
+
+    for r in results:
+        if r.score >= thresholds["upper"]:
+            upper.append(r)
+        elif r.score >= thresholds["middle"]:
+            middle.append(r)
+        else:
+            lower.append(r)
+
+    return upper, middle, lower
+
+
+def score_section(tickers: list[str], markets: dict, universe_stats=None):
+    """섹션 종목을 채점해 (채점 결과, 데이터 없는 종목, 이벤트 목록)을 돌려준다."""
+    results = []
+    missing = []
+
+    for t in tickers:
+        stats = lookup_stats(t, universe_stats)
+
+        if stats is None:
+            missing.append(t)
+            continue
+
+        results.append(stats)
+
+    METRICS.add_missing(missing)
+
+    # 섹션 전체를 한 번에 채점
+    with METRICS.stage("scoring"):
+        score_stats_list(results, markets)
+
+    return results, missing, section_events(results)
+
+
+def section_events(results):
+    """채점된 결과에서 요약용 이벤트 문구를 종류별로 모은다 (결과 순서 유지)."""
+    event_list = {
+        "cross20_up": [],
+        "cross20_up_volume": [],
+        "cross20_down": [],
+        "cross60_down": [],
+        "strong_buy": [],
+    }
+    thresholds = report_thresholds()
+
+    for stats in results:
+        t = stats["ticker"]
+        score = stats["score"]
+        grade = stats["grade"]
+
+        name = ticker_name(t)
+
+        if stats["cross20_up"]:
+            if thresholds["volume_breakout"](stats):
+                event_list["cross20_up_volume"].append(
+                    f"- {name} ({t}) | 매수 적극 검토 | 거래량 {stats['vol_ratio']:.2f}x / 점수 {score:.0f}"
+                )
+            else:
+                event_list["cross20_up"].append(
+                    f"- {name} ({t}) | 매수 고려 | 점수 {score:.0f}"
+                )
+
+        if stats["cross20_down"]:
+            event_list["cross20_down"].append(
+                f"- {name} ({t}) | 30% 매도 검토 | 점수 {score:.0f}"
+            )
+
+        if stats["cross60_down"]:
+            event_list["cross60_down"].append(
+                f"- {name} ({t}) | 전량 매도 검토 | 점수 {score:.0f}"
+            )
+
+        if thresholds["strong_buy"](stats):
+            event_list["strong_buy"].append(
+                f"- {name} ({t}) | 비중 확대 후보 | 등급 {grade} / 점수 {score:.0f}"
+            )
+
+    return event_list
+
+
+def render_section(writer, title: str, results: list, missing: list):
+    writer.heading(title)
+
+    with METRICS.stage("sort_bucket"):
+        upper, middle, lower = rank_results(results)
+
+    with METRICS.stage("render"):
+        render_buckets(writer, upper, middle, lower, missing)
+
+
+def render_buckets(writer, upper, middle, lower, missing):
+    buckets = [
+        ("🟢 상단: 비중 확대 / 보유 우선 후보", upper),
+        ("🟡 중간: 관망 후보", middle),
+        ("🔴 하단: 비중 축소 / 매수 제외 후보", lower),
+    ]
+
+    for title, bucket in buckets:
+        if bucket:
+            writer.line()
+            writer.heading(title)
+            writer.line()
+            for r in bucket:
+                writer.block(r)
+
+    if missing:
+        writer.line()
+        writer.heading("⚠️ 데이터 없음/기간 부족")
+        for t in missing:
+            writer.line(f"- {t}")
+
+    writer.line()
+
+
+# =========================
+# 메일 발송
+# =========================
+
+# SMTP 서버 (로컬 테스트 서버로 바꿀 수 있다. 예: SMTP_HOST=localhost SMTP_PORT=1025 SMTP_SSL=0)
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.naver.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_USE_SSL = os.environ.get("SMTP_SSL", "1") != "0"
+
+MAIL_SUBJECT = "📈 Stock Alert Bot"
+
+# 수신자별 리포트 설정 (JSON 목록). 없으면 TO_EMAIL 전원에게 같은 리포트 한 통.
+#   [{"to": "a@naver.com", "markets": ["kr"]},
+#    {"to": "b@example.com,c@example.com", "tickers": ["NVDA", "005930.KS"]},
+#    {"channel": "kakao"},
+#    {"channel": "webhook", "to": "https://hooks.example.com/..."}]
+# channel: email(기본) / kakao(나에게 보내기) / webhook(to = URL)
+# markets: 받을 섹션 시장 (kr / us), tickers: 받을 종목. 둘 다 없으면 전체.
+RECIPIENTS_JSON = os.environ.get("STOCK_ALERT_RECIPIENTS", "")
+
+# 설정 파일 없이 채널을 더할 때: 카카오 토큰이 있으면 카카오톡, URL이 있으면 웹훅에도 전체 리포트
+WEBHOOK_URL = os.environ.get("STOCK_ALERT_WEBHOOK_URL", "")
+
+
+# dry-run은 계정/받는 주소를 읽지 않고 전체 리포트 한 통만 렌더링한다
+DRY_RUN_PROFILE = {"channel": "email", "to": [], "markets": None, "tickers": None}
+
+
+def split_addresses(value):
+    return [email.strip() for email in value.split(",") if email.strip()]
+
+
+def load_recipients():
+    """
+    수신자 설정 목록. 각 항목은
+    {"channel": 채널, "to": [주소], "markets": set 또는 None, "tickers": set 또는 None, "ref": 순번}.
+    ref는 재시도 큐가 주소 대신 저장하는 설정 순번이다.
+    """
+    if not RECIPIENTS_JSON.strip():
+        profiles = [{"channel": "email", "to": split_addresses(mail_account()[2]), "markets": None, "tickers": None}]
+
+        if os.environ.get("KAKAO_REFRESH_TOKEN"):
+            profiles.append({"channel": "kakao", "to": [], "markets": None, "tickers": None})
+
+        if WEBHOOK_URL:
+            profiles.append({"channel": "webhook", "to": [WEBHOOK_URL], "markets": None, "tickers": None})
+
+        return [dict(p, ref=i) for i, p in enumerate(profiles)]
+
+    profiles = []
+
+    for entry in json.loads(RECIPIENTS_JSON):
+        to = entry.get("to", "")
+
+        profiles.append({
+            "channel": entry.get("channel", "email"),
+            "to": split_addresses(to) if isinstance(to, str) else list(to),
+            "markets": set(entry["markets"]) if "markets" in entry else None,
+            "tickers": set(entry["tickers"]) if "tickers" in entry else None,
+        })
+
+    return [dict(p, ref=i) for i, p in enumerate(profiles)]
+
+
+class MailSession:
+    """
+    한 번 연결/로그인한 SMTP 세션으로 여러 메시지를 이어서 보낸다.
+    수신자별 리포트를 보내도 TLS 핸드셰이크와 로그인은 실행당 한 번이다.
+    """
+
+    def __init__(self, host=None, port=None, use_ssl=None):
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.use_ssl = SMTP_USE_SSL if use_ssl is None else use_ssl
+        self.server = None
+
+    def __enter__(self):
+        if self.use_ssl:
+            self.server = smtplib.SMTP_SSL(self.host, self.port)
+        else:
+            self.server = smtplib.SMTP(self.host, self.port)
+
+        # with 블록에 들어가기 전에 실패하면 __exit__이 불리지 않으므로 여기서 연결을 닫는다
+        try:
+            self.sender, password, _ = mail_account()
+            self.server.ehlo()
+
+            # 인증을 지원하지 않는 로컬 테스트 서버에서는 로그인을 건너뛴다
+            if self.server.has_extn("auth"):
+                self.server.login(self.sender, password)
+        except BaseException:
+            self.server.close()
+            raise
+
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.server.quit()
+        except smtplib.SMTPException:
+            self.server.close()
+
+        return False
+
+    def send(self, text, recipients, subject=MAIL_SUBJECT, html=None):
+        """html이 있으면 plain text와 함께 multipart/alternative로 보낸다."""
+        body = (
+            "📈 Stock Alert Bot\n"
+            "--------------------\n"
+            f"{text}"
+        )
+
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
+        msg = MIMEMultipart("alternative" if html else "mixed")
+        msg["From"] = self.sender
+        msg["To"] = ", ".join(recipients)
+        msg["Subject"] = subject
+
+        msg.attach(MIMEText(body, "plain", "utf-8"))
+
+        if html:
+            msg.attach(MIMEText(html, "html", "utf-8"))
+
+        self.server.send_message(
+            msg,
+            from_addr=self.sender,
+            to_addrs=recipients
+        )
+
+        print(f"Email sent to {', '.join(recipients)}")
+
+
+def send_to_email(text: str):
+    """TO_EMAIL 전원에게 같은 메시지 한 통."""
+    with MailSession() as session:
+        session.send(text, split_addresses(mail_account()[2]))
+
+
+# =========================
+# 알림 채널 (메일 / 카카오톡 / 웹훅 동시 발송 + 재시도 큐)
+# =========================
+
+KAKAO_TOKEN_URL = "https://kauth.kakao.com/oauth/token"
+KAKAO_MEMO_URL = "https://kapi.kakao.com/v2/api/talk/memo/default/send"
+
+# 액세스/리프레시 토큰 캐시 (실행 간 유지). 카카오톡으로 보낼 때만 읽고, 만료가 가까울 때만 갱신한다.
+# 소유자만 읽을 수 있는 파일(0600)로 저장하고, GitHub Actions에서는 캐시에서 뺀다(워크플로 참고).
+KAKAO_TOKEN_PATH = STATE_DIR / "kakao_token.json"
+
+# 액세스 토큰 만료 이 시간(초) 전부터 미리 갱신
+KAKAO_REFRESH_AHEAD = 600
+
+# 0이면 토큰 파일이 다음 실행까지 남지 않는 환경 (GitHub Actions: 캐시에서 뺐다).
+# 이때 카카오가 새 리프레시 토큰을 내려주면 저장할 곳이 없으므로 시크릿을 바꾸라고 경고한다.
+KAKAO_TOKEN_PERSISTED = os.environ.get("STOCK_ALERT_KAKAO_TOKEN_CACHE", "1") != "0"
+
+_KAKAO_TOKEN_LOCK = threading.Lock()
+
+# 카카오톡 텍스트 템플릿 한 건의 글자 수 한도 (머리말 포함)
+KAKAO_TEXT_LIMIT = 1000
+KAKAO_PREFIX = (
+    "📈 Stock Alert Bot\n"
+    "--------------------\n"
+)
+
+# 웹훅 한 건의 본문 바이트 한도 (0이면 나누지 않음. 예: Discord 2000자 → 2000)
+WEBHOOK_MAX_BYTES = int(os.environ.get("STOCK_ALERT_WEBHOOK_MAX_BYTES", "0"))
+
+# 발송 실패한 알림을 다음 실행에서 다시 보내기 위한 큐
+OUTBOX_PATH = STATE_DIR / "outbox.json"
+
+# 재시도 대기 (초, 실패할 때마다 2배, 최대값) / 최대 시도 횟수 (넘으면 버림)
+OUTBOX_BACKOFF = 300
+OUTBOX_BACKOFF_MAX = 6 * 3600
+OUTBOX_MAX_ATTEMPTS = 8
+
+
+# 여러 조각일 때 끝에 붙는 번호 (자리는 최대 크기로 미리 잡는다)
+CHUNK_SUFFIX = "\n\n(999/999)"
+
+
+def text_size(text, unit):
+    return len(text.encode("utf-8")) if unit == "bytes" else len(text)
+
+
+def min_chunk_limit(unit):
+    """번호와 글자 하나(바이트 단위면 UTF-8 최대 4바이트)가 들어가는 최소 한도."""
+    return text_size(CHUNK_SUFFIX, unit) + (4 if unit == "bytes" else 1)
+
+
+def fit_paragraph(paragraph, budget, unit):
+    """
+    문단이 한도보다 클 때만 줄 단위로, 한 줄이 한도보다 크면 그 줄을 잘라 나눈다.
+    (앞 조각과 같은 메시지에 들어갈 때 사이에 둘 구분자, 조각)을 내보낸다:
+    문단 첫 조각은 빈 줄, 같은 문단의 다음 줄은 줄바꿈, 잘린 줄의 뒷부분은 구분자 없음.
+    """
+    if text_size(paragraph, unit) <= budget:
+        yield "\n\n", paragraph
+        return
+
+    separator = "\n\n"
+
+    for line in paragraph.split("\n"):
+        while text_size(line, unit) > budget:
+            if unit == "bytes":
+                head = line.encode("utf-8")[:budget].decode("utf-8", errors="ignore")
+            else:
+                head = line[:budget]
+
+            # 한도가 글자 하나보다 작아도 조각마다 최소 한 글자는 진행한다
+            head = head or line[0]
+
+            yield separator, head
+            separator = ""
+            line = line[len(head):]
+
+        if line:
+            yield separator, line
+
+        separator = "\n"
+
+
+def chunk_message(text, limit, unit="chars"):
+    """
+    본문을 채널 길이 한도(limit, unit: chars / bytes) 안에 들어가는 최소 개수의 조각으로 나눈다.
+
+    - 빈 줄로 나뉜 문단(종목 블록 하나가 한 문단)을 앞에서부터 한 번만 훑으며 채워 넣고,
+      문단은 쪼개지 않는다 (한 문단이 한도를 넘을 때만 줄 단위로 나누고, 같은 조각에 든 줄은 줄바꿈으로 잇는다)
+    - 여러 조각이면 끝에 (i/n)을 붙인다. 번호 자리는 미리 한도에서 빼 둔다.
+    limit <= 0이면 나누지 않고, 번호와 글자 하나도 못 넣는 한도면 ValueError.
+    """
+    if limit <= 0 or text_size(text, unit) <= limit:
+        return [text]
+
+    if limit < min_chunk_limit(unit):
+        raise ValueError(f"메시지 길이 한도 {limit} {unit}가 너무 작음 (최소 {min_chunk_limit(unit)})")
+
+    budget = limit - text_size(CHUNK_SUFFIX, unit)
+    parts = []
+    buf = []
+    used = 0
+
+    for paragraph in re.split(r"\n{2,}", text.strip("\n")):
+        for separator, piece in fit_paragraph(paragraph, budget, unit):
+            size = text_size(piece, unit)
+
+            if buf and used + len(separator) + size > budget:
+                parts.append("".join(buf))
+                buf = []
+                used = 0
+
+            if buf:
+                buf.append(separator)
+                used += len(separator)
+
+            buf.append(piece)
+            used += size
+
+    if buf:
+        parts.append("".join(buf))
+
+    if len(parts) == 1:
+        return parts
+
+    return [f"{part}\n\n({i}/{len(parts)})" for i, part in enumerate(parts, start=1)]
+
+
+class KakaoAuthError(RuntimeError):
+    """액세스 토큰이 만료/폐기되어 거절됨 (갱신 후 다시 보낼 수 있음)."""
+
+
+def load_kakao_token():
+    if not KAKAO_TOKEN_PATH.exists():
+        return {}
+
+    try:
+        with open(KAKAO_TOKEN_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[kakao] 토큰 캐시 읽기 실패, 새로 갱신: {e}")
+        return {}
+
+
+def save_kakao_token(token):
+    KAKAO_TOKEN_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = KAKAO_TOKEN_PATH.with_suffix(f".{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+
+    # 쓰고 나서 chmod하면 그 사이 다른 사용자가 읽을 수 있으므로 처음부터 0600으로 만든다
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(json.dumps(token, indent=2))
+
+    tmp.replace(KAKAO_TOKEN_PATH)
+
+
+@contextmanager
+def kakao_token_lock():
+    """같은 프로세스의 스레드와 다른 프로세스가 동시에 토큰을 갱신하지 않도록 잠근다."""
+    with _KAKAO_TOKEN_LOCK, file_lock(KAKAO_TOKEN_PATH.with_suffix(".lock")):
+        yield
+
+
+def kakao_access_token(force=False):
+    """
+    캐시된 액세스 토큰을 돌려주고, 만료가 가깝거나(KAKAO_REFRESH_AHEAD) force일 때만 갱신한다.
+    갱신 응답에 새 리프레시 토큰이 오면 함께 저장해 다음 실행부터 그 토큰을 쓴다.
+    KAKAO_REFRESH_TOKEN 시크릿이 바뀌면 캐시를 버리고 새 시크릿으로 시작한다.
+    """
+    seed = os.environ["KAKAO_REFRESH_TOKEN"]
+    seed_id = hashlib.sha256(seed.encode()).hexdigest()[:16]
+
+    with kakao_token_lock():
+        token = load_kakao_token()
+
+        if token.get("seed") != seed_id:
+            token = {"seed": seed_id, "refresh_token": seed}
+
+        now = time.time()
+
+        if not force and token.get("access_token") and token["expires_at"] - KAKAO_REFRESH_AHEAD > now:
+            return token["access_token"]
+
+        r = requests.post(
+            KAKAO_TOKEN_URL,
+            data={
+                "grant_type": "refresh_token",
+                "client_id": os.environ["KAKAO_REST_API_KEY"],
+                "refresh_token": token["refresh_token"],
+            },
+            timeout=15,
+        )
+        result = r.json()
+
+        if r.status_code != 200 or not result.get("access_token"):
+            raise RuntimeError(f"Failed to refresh Kakao token: {r.status_code} {result.get('error_code', result)}")
+
+        token["access_token"] = result["access_token"]
+        token["expires_at"] = now + int(result.get("expires_in", 0))
+
+        # 리프레시 토큰은 만료가 가까울 때만 새로 내려온다
+        if result.get("refresh_token"):
+            token["refresh_token"] = result["refresh_token"]
+            token["refresh_token_expires_at"] = now + int(result.get("refresh_token_expires_in", 0))
+
+            if KAKAO_TOKEN_PERSISTED:
+                print("[kakao] 리프레시 토큰 갱신됨")
+            else:
+                # 카카오는 남은 기간이 한 달 미만일 때만 새 토큰을 준다 → 기존 시크릿도 곧 만료된다
+                expires = datetime.fromtimestamp(now + int(result.get("refresh_token_expires_in", 0)), timezone.utc)
+                print(
+                    "::warning title=KAKAO_REFRESH_TOKEN 교체 필요::"
+                    "카카오가 리프레시 토큰을 새로 발급했지만 이 환경에서는 저장되지 않는다. "
+                    "기존 KAKAO_REFRESH_TOKEN 시크릿은 한 달 안에 만료되므로 새로 발급받아 시크릿을 바꿀 것 "
+                    f"(새 토큰 만료 {expires:%Y-%m-%d})"
+                )
+
+        save_kakao_token(token)
+
+        return token["access_token"]
+
+
+def send_to_kakao(text: str, access_token: str):
+    pretty = KAKAO_PREFIX + text
+
+    data = {
+        "template_object": json.dumps({
+            "object_type": "text",
+            "text": pretty,
+            "link": {
+                "web_url": "https://www.tradingview.com",
+                "mobile_web_url": "https://www.tradingview.com"
+            }
+        }, ensure_ascii=False)
+    }
+
+    r = requests.post(
+        KAKAO_MEMO_URL,
+        headers={"Authorization": f"Bearer {access_token}"},
+        data=data,
+        timeout=15,
+    )
+
+    if r.status_code == 401:
+        raise KakaoAuthError(f"Kakao token rejected: {r.text}")
+
+    if r.status_code != 200:
+        raise RuntimeError(f"Kakao send failed: {r.status_code} {r.text}")
+
+
+def send_email_batch(items):
+    """메일 항목들을 SMTP 세션 하나로 보낸다. 보내지 못한 항목을 돌려준다."""
+    pending = list(items)
+
+    try:
+        with MailSession() as session:
+            while pending:
+                session.send(pending[0]["text"], pending[0]["to"], html=pending[0].get("html"))
+                pending.pop(0)
+    except (OSError, KeyError, smtplib.SMTPException) as e:
+        # KeyError: 메일 계정 환경변수 없음 (다음 실행에서 설정되면 재시도 큐에서 보낸다)
+        print(f"[notify] email 발송 실패: {e!r}")
+
+        for item in pending:
+            item["error"] = str(e)
+
+    return pending
+
+
+def send_kakao_batch(items):
+    failed = []
+
+    try:
+        access_token = kakao_access_token()
+    except (OSError, KeyError, ValueError, RuntimeError) as e:
+        print(f"[notify] kakao 토큰 갱신 실패: {e}")
+        return [{**item, "error": str(e)} for item in items]
+
+    for item in items:
+        parts = chunk_message(item["text"], KAKAO_TEXT_LIMIT - text_size(KAKAO_PREFIX, "chars"))
+
+        # 재시도 항목은 지난번에 보낸 조각을 건너뛴다 (같은 본문은 항상 같은 조각으로 나뉜다)
+        sent = item.get("sent_parts", 0)
+
+        try:
+            for m in parts[sent:]:
+                try:
+                    send_to_kakao(m, access_token)
+                except KakaoAuthError:
+                    # 캐시된 토큰이 만료 전에 폐기된 경우: 한 번만 새로 받아 다시 보낸다
+                    access_token = kakao_access_token(force=True)
+                    send_to_kakao(m, access_token)
+
+                sent += 1
+
+            print(f"Kakao sent ({len(parts)} messages)")
+        except (OSError, RuntimeError) as e:
+            print(f"[notify] kakao 발송 실패: {e}")
+            failed.append({**item, "sent_parts": sent, "error": str(e)})
+
+    return failed
+
+
+def send_webhook_batch(items):
+    failed = []
+
+    for item in items:
+        try:
+            for url in item["to"]:
+                for part in chunk_message(item["text"], WEBHOOK_MAX_BYTES, unit="bytes"):
+                    r = requests.post(url, json={"text": part}, timeout=15)
+                    r.raise_for_status()
+
+            print(f"Webhook sent to {len(item['to'])} url(s)")
+        except (OSError, ValueError) as e:
+            # 예외 문구에는 시크릿인 웹훅 URL(호스트/경로)이 들어 있으므로 종류와 상태 코드만 남긴다
+            response = getattr(e, "response", None)
+            error = type(e).__name__ + (f" {response.status_code}" if response is not None else "")
+
+            print(f"[notify] webhook 발송 실패: {error}")
+            failed.append({**item, "error": error})
+
+    return failed
+
+
+CHANNEL_SENDERS = {
+    "email": send_email_batch,
+    "kakao": send_kakao_batch,
+    "webhook": send_webhook_batch,
+}
+
+
+async def fan_out(items):
+    """채널별로 묶어 동시에 보낸다 (채널 하나가 느리거나 실패해도 다른 채널은 그대로)."""
+    by_channel = {}
+
+    for item in items:
+        by_channel.setdefault(item["channel"], []).append(item)
+
+    unknown = [item for ch, group in by_channel.items() if ch not in CHANNEL_SENDERS for item in group]
+
+    for item in unknown:
+        print(f"[notify] 알 수 없는 채널, 버림: {item['channel']}")
+
+    results = await asyncio.gather(*(
+        asyncio.to_thread(CHANNEL_SENDERS[ch], group)
+        for ch, group in by_channel.items()
+        if ch in CHANNEL_SENDERS
+    ))
+
+    return [item for failed in results for item in failed]
+
+
+def load_outbox():
+    if not OUTBOX_PATH.exists():
+        return []
+
+    try:
+        with open(OUTBOX_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[notify] 재시도 큐 읽기 실패, 비운다: {e}")
+        return []
+
+
+def outbox_entry(item):
+    """
+    큐에 저장할 항목. 받는 곳(웹훅 URL은 시크릿, 메일 주소)은 저장하지 않고
+    수신자 설정 순번(ref)만 남긴다. 재시도할 때 resolve_recipients가 환경변수에서 다시 찾는다.
+    """
+    if item.get("ref") is None:
+        return item
+
+    return {key: value for key, value in item.items() if key != "to"}
+
+
+def resolve_recipients(items):
+    """
+    받는 곳이 없는 재시도 항목에 지금 수신자 설정의 주소를 채운다.
+    설정이 바뀌어 같은 순번/채널이 없으면 버린다. 설정을 읽지 못하면 (채운 항목, 그대로 둘 항목).
+    """
+    if all("to" in item for item in items):
+        return items, []
+
+    try:
+        profiles = load_recipients()
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        print(f"[notify] 수신자 설정 읽기 실패, 재시도 보류: {e!r}")
+        return [i for i in items if "to" in i], [i for i in items if "to" not in i]
+
+    resolved = []
+
+    for item in items:
+        if "to" in item:
+            resolved.append(item)
+            continue
+
+        ref = item.get("ref")
+
+        if ref is None or ref >= len(profiles) or profiles[ref]["channel"] != item["channel"]:
+            print(f"[notify] {item['channel']} 수신 설정이 바뀌어 재시도 항목 버림")
+            continue
+
+        resolved.append({**item, "to": profiles[ref]["to"]})
+
+    return resolved, []
+
+
+def save_outbox(outbox):
+    if not outbox:
+        OUTBOX_PATH.unlink(missing_ok=True)
+        return
+
+    outbox = [outbox_entry(item) for item in outbox]
+
+    OUTBOX_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = OUTBOX_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(outbox, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(OUTBOX_PATH)
+
+
+def deliver(items, now=None):
+    """
+    새 알림과 재시도 시각이 된 큐 항목을 모든 채널로 동시에 보낸다.
+    실패한 항목은 지수 백오프로 다음 시도 시각을 정해 큐에 남긴다 (예외를 올리지 않는다).
+    items: [{"channel", "to", "ref", "text"}] (큐에는 to 대신 ref만 저장)
+    """
+    now = now or datetime.now(timezone.utc)
+    outbox = load_outbox()
+
+    due = [i for i in outbox if datetime.fromisoformat(i["next_attempt"]) <= now]
+    waiting = [i for i in outbox if datetime.fromisoformat(i["next_attempt"]) > now]
+
+    if due:
+        print(f"[notify] 재시도 큐 {len(due)}건 발송")
+        due, held = resolve_recipients(due)
+        waiting += held
+
+    failed = asyncio.run(fan_out(due + list(items)))
+
+    for item in failed:
+        attempts = item.get("attempts", 0) + 1
+
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            print(f"[notify] {item['channel']} {attempts}회 실패, 버림: {item.get('error')}")
+            continue
+
+        delay = min(OUTBOX_BACKOFF * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+        waiting.append({
+            **item,
+            "attempts": attempts,
+            "next_attempt": (now + timedelta(seconds=delay)).isoformat(),
+        })
+
+    if failed:
+        print(f"[notify] {len(failed)}건 재시도 큐에 저장")
+
+    save_outbox(waiting)
+
+    return failed
+
+
+# =========================
+# 알림 상태 (변동분만 발송)
+# =========================
+
+ALERT_STATE_PATH = STATE_DIR / "alert_state.json"
+
+# 전체 리포트를 보내는 주기(시간). 그 사이 실행은 변동분만 보낸다. 0이면 매번 전체 리포트.
+FULL_REPORT_EVERY_HOURS = float(os.environ.get("STOCK_ALERT_FULL_REPORT_HOURS", "20"))
+
+# 1이면 주기와 관계없이 이번 실행은 전체 리포트
+FORCE_FULL_REPORT = os.environ.get("STOCK_ALERT_FORCE_FULL", "") == "1"
+
+# 변동 비교에 쓰는 이벤트 플래그와 문구
+ALERT_FLAGS = {
+    "cross20_up": "⭐ 20일선 상향돌파",
+    "cross20_down": "⚠️ 20일선 하향이탈",
+    "cross60_down": "🚨 60일선 하향이탈",
+}
+
+
+def grade_rank():
+    """scoring.json 등급을 낮은 순서부터 0, 1, 2... 로 매긴다."""
+    rules = scoring_rules()
+    grades = [rules["default_grade"]]
+    grades += [g["grade"] for g in sorted(rules["grades"], key=lambda g: g["min_score"])]
+    return {g: i for i, g in enumerate(grades)}
+
+
+def load_alert_state():
+    if not ALERT_STATE_PATH.exists():
+        return {"last_full_report": None, "tickers": {}}
+
+    try:
+        with open(ALERT_STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[alert state] 읽기 실패, 전체 리포트로 보낸다: {e}")
+        return {"last_full_report": None, "tickers": {}}
+
+
+def save_alert_state(state):
+    ALERT_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = ALERT_STATE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(ALERT_STATE_PATH)
+
+
+def snapshot_results(results):
+    """종목별로 비교할 값(등급/판단/이벤트 플래그)만 남긴다."""
+    return {
+        r["ticker"]: {
+            "grade": r["grade"],
+            "decision": r["decision"],
+            "score": r["score"],
+            **{flag: r[flag] for flag in ALERT_FLAGS},
+        }
+        for r in results
+    }
+
+
+def full_report_due(state, now):
+    if FORCE_FULL_REPORT or FULL_REPORT_EVERY_HOURS <= 0:
+        return True
+
+    last = state.get("last_full_report")
+
+    if not last:
+        return True
+
+    elapsed = now - datetime.strptime(last, "%Y-%m-%dT%H:%M:%SZ")
+
+    return elapsed >= timedelta(hours=FULL_REPORT_EVERY_HOURS)
+
+
+def diff_alert_state(previous, current):
+    """
+    이전 실행 대비 변동을 종류별 문구 목록으로 돌려준다.
+    - new_events: 이전엔 없던 돌파/이탈 이벤트
+    - upgrades / downgrades: 등급 변화
+    - decisions: 판단 변화 (등급 변화와 별개로 표시)
+    이전 상태에 없던 종목은 새 이벤트만 본다.
+    """
+    rank = grade_rank()
+    changes = {"new_events": [], "upgrades": [], "downgrades": [], "decisions": []}
+
+    for t, cur in current.items():
+        prev = previous.get(t, {})
+        name = ticker_name(t)
+
+        for flag, label in ALERT_FLAGS.items():
+            if cur[flag] and not prev.get(flag, False):
+                changes["new_events"].append(
+                    f"- {name} ({t}) | {label} | {cur['decision']} | 점수 {cur['score']:.0f}"
+                )
+
+        if not prev:
+            continue
+
+        old_rank = rank.get(prev["grade"], 0)
+        new_rank = rank.get(cur["grade"], 0)
+
+        if new_rank > old_rank:
+            changes["upgrades"].append(
+                f"- {name} ({t}) | {prev['grade']} → {cur['grade']} | 점수 {cur['score']:.0f}"
+            )
+        elif new_rank < old_rank:
+            changes["downgrades"].append(
+                f"- {name} ({t}) | {prev['grade']} → {cur['grade']} | 점수 {cur['score']:.0f}"
+            )
+
+        if cur["decision"] != prev["decision"]:
+            changes["decisions"].append(
+                f"- {name} ({t}) | {prev['decision']} → {cur['decision']}"
+            )
+
+    return changes
+
+
+def delta_report_lines(header, changes):
+    lines = [header, "", "📌 지난 리포트 이후 변동", ""]
+
+    sections = [
+        ("new_events", "🚨 새 돌파/이탈 이벤트"),
+        ("upgrades", "⬆️ 등급 상향"),
+        ("downgrades", "⬇️ 등급 하향"),
+        ("decisions", "🔁 판단 변경"),
+    ]
+
+    for key, title in sections:
+        if changes[key]:
+            lines.append(title)
+            lines += changes[key]
+            lines.append("")
+
+    return lines
+
+
+# =========================
+# 리포트 구성 (수신자별)
+# =========================
+
+# 점수/등급 기준 안내에 쓰는 필드 이름과 단위 (없으면 필드 이름 그대로)
+FIELD_LABELS = {
+    "close": "현재가",
+    "ma5": "5일선",
+    "ma10": "10일선",
+    "ma20": "20일선",
+    "ma60": "60일선",
+    "chg1d": "1D",
+    "chg5d": "5D",
+    "chg20d": "20D",
+    "chg60d": "60D",
+    "ma20_slope": "20일선 기울기",
+    "ma60_slope": "60일선 기울기",
+    "vol_ratio": "20일 평균 대비 거래량",
+    "cross20_up": "20일선 상향돌파",
+    "cross20_down": "20일선 하향이탈",
+    "cross60_down": "60일선 하향이탈",
+    "above5": "5일선 위",
+    "above10": "10일선 위",
+    "above20": "20일선 위",
+    "above60": "60일선 위",
+    "is_aligned": "완전 정배열",
+    "rs20": "RS20",
+    "rs60": "RS60",
+    "score": "점수",
+}
+
+FIELD_UNITS = {
+    "chg1d": "%",
+    "chg5d": "%",
+    "chg20d": "%",
+    "chg60d": "%",
+    "ma20_slope": "%",
+    "ma60_slope": "%",
+    "vol_ratio": "배",
+    "rs20": "%p",
+    "rs60": "%p",
+    "score": "점",
+}
+
+OP_SYMBOLS = {">": ">", ">=": "≥", "<": "<", "<=": "≤", "==": "=", "!=": "≠"}
+
+
+def condition_text(cond):
+    """scoring.json 조건을 안내 문구로 바꾼다. 예: ["rs20", ">", 5] → "RS20 > 5%p"."""
+    if isinstance(cond, str):
+        return FIELD_LABELS.get(cond, cond)
+
+    lhs, op, rhs = cond
+
+    if isinstance(rhs, str):
+        value = FIELD_LABELS.get(rhs, rhs)
+    else:
+        value = f"{rhs:g}{FIELD_UNITS.get(lhs, '')}"
+
+    return f"{FIELD_LABELS.get(lhs, lhs)} {OP_SYMBOLS.get(op, op)} {value}"
+
+
+def rule_text(rule):
+    text = condition_text(rule["if"])
+
+    if "unless" in rule:
+        text += f" ({condition_text(rule['unless'])} 아닐 때)"
+
+    return text
+
+
+def scoring_guide_lines():
+    """점수/등급 기준 안내. 규칙/등급/판단/구간을 모두 scoring.json에서 만든다."""
+    rules = scoring_rules()
+    thresholds = report_thresholds()
+    groups = rules["score"]
+
+    lines = [
+        "📊 점수/등급 기준",
+        "점수 = " + " + ".join(g.get("title", g["group"]) for g in groups),
+        "완전 정배열 = 현재가 ≥ 5일선 ≥ 10일선 ≥ 20일선 ≥ 60일선",
+        "",
+    ]
+
+    for group in groups:
+        title = group.get("title", group["group"])
+        lines.append(f"{title} (위에서 처음 맞는 하나만)" if group.get("first_match") else title)
+
+        for rule in group["rules"]:
+            lines.append(f"- {rule_text(rule)} {rule['points']:+g}")
 
-    if middle:
-        lines.append("")
-        lines.append("🟡 중간: 관망 후보")
         lines.append("")
-        for r in middle:
-            lines.append(format_block(r))
 
-    if lower:
-        lines.append("")
-        lines.append("🔴 하단: 비중 축소 / 매수 제외 후보")
-        lines.append("")
-        for r in lower:
-            lines.append(format_block(r))
+    grades = [f"{g['grade']} {g['min_score']:g}점↑" for g in rules["grades"]]
+    lowest = rules["grades"][-1]["min_score"]
+    lines.append("등급: " + " / ".join(grades) + f" / {rules['default_grade']} {lowest:g}점↓")
+    lines.append("")
+    lines.append("판단 (위에서 처음 맞는 것)")
+
+    for d in rules["decisions"]:
+        lines.append(f"- {rule_text(d)} → {d['decision']}")
+
+    lines.append(f"- 그 외 → {rules['default_decision']}")
+    lines.append("")
+
+    lines.append(
+        f"구간: 상단 {thresholds['upper']:g}점↑ / 중간 {thresholds['middle']:g}점↑ / "
+        f"하단 {thresholds['middle']:g}점↓"
+    )
+    lines.append(
+        f"요약: 20일선 상향돌파 + {condition_text(rules['volume_breakout'])} = 매수 적극 검토 / "
+        f"{condition_text(rules['strong_buy'])} = 비중 확대 후보"
+    )
+    lines.append("정렬: 점수 → 정배열 → 상대강도 → 이평선 기울기 → 거래량")
+    lines.append("")
+
+    return lines
+
+
+def write_summary(writer, all_events):
+    writer.heading("📌 오늘 주요 이벤트")
+    writer.line()
+
+    has_event = any(len(v) > 0 for v in all_events.values())
+
+    if not has_event:
+        writer.line("오늘 주요 이벤트 없음")
+        writer.line()
+    else:
+        if all_events["strong_buy"]:
+            writer.heading("🟢 비중 확대 후보")
+            writer.lines(all_events["strong_buy"])
+            writer.line()
+
+        if all_events["cross20_up_volume"]:
+            writer.heading("🚀 20일선 상향돌파 + 거래량")
+            writer.lines(all_events["cross20_up_volume"])
+            writer.line()
+
+        if all_events["cross20_up"]:
+            writer.heading("⭐ 20일선 상향돌파")
+            writer.lines(all_events["cross20_up"])
+            writer.line()
+
+        if all_events["cross20_down"]:
+            writer.heading("⚠️ 20일선 하향이탈")
+            writer.lines(all_events["cross20_down"])
+            writer.line()
+
+        if all_events["cross60_down"]:
+            writer.heading("🚨 60일선 하향이탈")
+            writer.lines(all_events["cross60_down"])
+            writer.line()
+
+
+def recipient_sections(profile, rows):
+    """
+    수신자 설정(markets / tickers)에 맞는 섹션과 종목만 남긴다.
+    결과 목록은 복사해 돌려주므로 렌더링 중 정렬이 다른 수신자에게 영향을 주지 않는다.
+    """
+    view = []
+
+    for row in rows:
+        if profile["markets"] is not None and row["market"] not in profile["markets"]:
+            continue
+
+        results = list(row["results"])
+        missing = list(row["missing"])
+
+        if profile["tickers"] is not None:
+            results = [r for r in results if r["ticker"] in profile["tickers"]]
+            missing = [t for t in missing if t in profile["tickers"]]
+
+            if not results and not missing:
+                continue
+
+        view.append({**row, "results": results, "missing": missing})
+
+    return view
+
+
+def write_full_report(writer, header, market_lines, view):
+    """헤더 → 시장 판단 → 이벤트 요약 → 점수 기준 → 섹션 순서로 writer에 바로 쓴다."""
+    all_events = {
+        "cross20_up": [],
+        "cross20_up_volume": [],
+        "cross20_down": [],
+        "cross60_down": [],
+        "strong_buy": [],
+    }
+
+    # 이벤트는 섹션 결과 순서(정렬 전)대로 모은다
+    for row in view:
+        if row.get("screen"):
+            continue
+
+        for event_key, events in section_events(row["results"]).items():
+            all_events[event_key] += events
+
+    writer.heading(header)
+    writer.line()
+    writer.lines(market_lines)
+
+    write_summary(writer, all_events)
+    writer.lines(scoring_guide_lines())
+
+    for row in view:
+        if row.get("screen"):
+            render_screen(writer, row)
+        else:
+            render_section(writer, row["title"], row["results"], row["missing"])
+
+
+def recipient_changes(view, previous, current):
+    """수신자가 받는 종목의 변동만 비교한다."""
+    allowed = {r["ticker"] for row in view for r in row["results"]}
+
+    return diff_alert_state(previous, {t: v for t, v in current.items() if t in allowed})
+
+
+# =========================
+# 시장 범위 실행 (방금 마감한 시장만 새로 계산)
+# =========================
+
+LAST_RUN_PATH = STATE_DIR / "last_run.json"
+
+# STOCK_ALERT_MARKET: kr(한국장 마감 후) / us(미국장 마감 후) / all
+RUN_MARKET = os.environ.get("STOCK_ALERT_MARKET", "all")
+
+# 범위별로 새로 받는 기준지수 (한국 반도체주 기준 SOXX는 미국장에서 갱신)
+MARKET_SCOPES = {
+    "kr": ("kr",),
+    "us": ("us", "semi"),
+    "all": ("kr", "us", "semi"),
+}
+
+
+def report_sections():
+    """(시장, 제목, 종목 리스트) 순서대로. 종목 리스트는 호출 시점 값을 쓴다."""
+    return [
+        ("kr", "📦 PORTFOLIO - 🇰🇷 KOREA", ticker_config("TICKERS_KR")),
+        ("us", "📦 PORTFOLIO - 🇺🇸 USA", ticker_config("TICKERS_US")),
+        ("kr", "👀 WATCHLIST - 🇰🇷 KOREA", ticker_config("WATCHLIST_KR")),
+        ("us", "👀 WATCHLIST - 🇺🇸 USA", ticker_config("WATCHLIST_US")),
+    ]
+
+
+def load_last_run():
+    empty = {"markets": {}, "sections": {}, "screens": {}}
+
+    if not LAST_RUN_PATH.exists():
+        return empty
+
+    try:
+        with open(LAST_RUN_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[last run] 읽기 실패, 전 시장을 새로 계산한다: {e}")
+        return empty
+
+
+def save_last_run(last_run):
+    LAST_RUN_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = LAST_RUN_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(last_run, ensure_ascii=False, default=record_json), encoding="utf-8")
+    tmp.replace(LAST_RUN_PATH)
+
+
+def stored_section(last_run, title, tickers):
+    """지난 실행 결과를 쓸 수 있으면 돌려준다. 종목 구성이 바뀌었으면 None."""
+    stored = last_run["sections"].get(title)
+
+    if stored is None or stored["tickers"] != list(tickers):
+        return None
+
+    return {**stored, "results": [StockRecord(r) for r in stored["results"]]}
+
+
+def stored_screen(last_run, source, tickers):
+    """지난 실행의 스크리닝 결과. 구성종목이 바뀌었으면 None (종목 목록 대신 digest로 비교)."""
+    stored = last_run.get("screens", {}).get(source)
+
+    if stored is None or stored["digest"] != tickers_digest(tickers):
+        return None
+
+    return {**stored, "results": [StockRecord(r) for r in stored["results"]]}
+
+
+# =========================
+# 스크리닝 유니버스 (지수 구성종목 파일 → 점수 상위 N종목)
+# =========================
+
+# 구성종목 파일 디렉터리. *.csv / *.json 파일 하나가 스크리닝 섹션 하나 (파일 이름 = 섹션 이름)
+#   CSV: ticker(또는 symbol),name,sector 헤더. 종목 코드는 야후 형식 (005930.KS, 247540.KQ, AAPL)
+#   JSON: [{"ticker": "AAPL", "name": "애플", "sector": "IT"}, ...] 또는 {"AAPL": "애플", ...}
+UNIVERSE_DIR = Path(os.environ.get("STOCK_ALERT_UNIVERSE_DIR", BASE_DIR / "universe"))
+
+# 구성종목 파일에서 만든 종목 색인 캐시 (파일 크기/수정 시각이 같으면 다시 읽지 않는다)
+UNIVERSE_INDEX_PATH = STATE_DIR / "universe_index.json"
+
+# 스크리닝 섹션에 보여줄 점수 상위 종목 수
+SCREEN_TOP_N = int(os.environ.get("STOCK_ALERT_SCREEN_TOP", "20"))
+
+# 스크리닝 프로세스 수 (0/1: 단일 프로세스, auto: CPU 수). 프로세스마다 맡은 종목의
+# 가격 동기화/패널 구성/채점을 한다. 구성종목이 SHARD_MIN_TICKERS 이상일 때만 나눈다
+# (그보다 적으면 프로세스 시작 비용이 더 크다)
+SCORING_WORKERS = os.environ.get("STOCK_ALERT_WORKERS", "0")
+SHARD_MIN_TICKERS = 2000
+
+# 색인의 시장 코드 (array('B')에 번호로 저장)
+UNIVERSE_MARKETS = ("kr", "us")
+
+_UNIVERSE = {}
+
+
+class UniverseIndex:
+    """
+    구성종목 파일 전체의 종목 → 이름/시장/섹터 색인.
+    종목마다 dict를 만들지 않고 정렬된 종목 코드 목록과 같은 순서의 컬럼만 둔다.
+    조회는 이진 탐색, 소스(지수)별 구성종목은 행 번호 배열.
+    """
+
+    __slots__ = ("tickers", "names", "markets", "sectors", "sector_names", "sources", "signature")
+
+    def __init__(self, tickers, names, markets, sectors, sector_names, sources, signature):
+        self.tickers = tickers
+        self.names = names
+        self.markets = markets
+        self.sectors = sectors
+        self.sector_names = sector_names
+        self.sources = sources
+        self.signature = signature
+
+    @classmethod
+    def build(cls, source_rows, signature):
+        """source_rows: {소스 이름: [(ticker, name, sector), ...]}. 같은 종목은 처음 나온 이름/섹터를 쓴다."""
+        first = {}
+
+        for rows in source_rows.values():
+            for ticker, name, sector in rows:
+                if ticker not in first or not first[ticker][0]:
+                    first[ticker] = (name, sector)
+
+        tickers = sorted(first)
+        sector_names = sorted({sector for _, sector in first.values()})
+        sector_id = {s: i for i, s in enumerate(sector_names)}
+
+        index = cls(
+            tickers,
+            [first[t][0] or t for t in tickers],
+            array("B", (UNIVERSE_MARKETS.index(exchange_market(t)) for t in tickers)),
+            array("H", (sector_id[first[t][1]] for t in tickers)),
+            sector_names,
+            {},
+            signature,
+        )
+
+        for source, rows in source_rows.items():
+            index.sources[source] = array("I", sorted({index.find(t) for t, _, _ in rows}))
+
+        return index
+
+    def find(self, ticker):
+        """행 번호. 없으면 -1."""
+        i = bisect_left(self.tickers, ticker)
+        return i if i < len(self.tickers) and self.tickers[i] == ticker else -1
+
+    def name(self, ticker):
+        i = self.find(ticker)
+        return self.names[i] if i >= 0 else None
+
+    def sector(self, ticker):
+        i = self.find(ticker)
+        return self.sector_names[self.sectors[i]] if i >= 0 else ""
+
+    def source_tickers(self, source):
+        return [self.tickers[i] for i in self.sources[source]]
+
+    def source_market(self, source):
+        """구성종목이 가장 많은 시장 (kr / us)."""
+        rows = self.sources[source]
+        kr = sum(1 for i in rows if self.markets[i] == 0)
+        return "kr" if kr * 2 >= len(rows) else "us"
+
+    def to_json(self):
+        return {
+            "signature": self.signature,
+            "tickers": self.tickers,
+            "names": self.names,
+            "markets": self.markets.tobytes().hex(),
+            "sectors": list(self.sectors),
+            "sector_names": self.sector_names,
+            "sources": {k: list(v) for k, v in self.sources.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data["tickers"],
+            data["names"],
+            array("B", bytes.fromhex(data["markets"])),
+            array("H", data["sectors"]),
+            data["sector_names"],
+            {k: array("I", v) for k, v in data["sources"].items()},
+            data["signature"],
+        )
+
+
+def exchange_market(ticker):
+    return "kr" if ticker_exchange(ticker) == "krx" else "us"
+
+
+def universe_files():
+    if not UNIVERSE_DIR.is_dir():
+        return []
+
+    return sorted(p for p in UNIVERSE_DIR.iterdir() if p.suffix.lower() in (".csv", ".json"))
+
+
+def read_constituents(path: Path):
+    """구성종목 파일 하나를 (ticker, name, sector) 목록으로 읽는다."""
+    if path.suffix.lower() == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if isinstance(data, dict):
+            return [(t.strip(), str(name).strip(), "") for t, name in data.items()]
+
+        return [
+            (row["ticker"].strip(), str(row.get("name", "")).strip(), str(row.get("sector", "")).strip())
+            for row in data
+        ]
+
+    # utf-8-sig: 엑셀에서 저장한 CSV의 BOM 제거
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        fields = {name.strip().lower(): name for name in reader.fieldnames or []}
+        ticker_col = fields.get("ticker") or fields.get("symbol")
+
+        if ticker_col is None:
+            raise ValueError(f"{path.name}: ticker(또는 symbol) 열이 없음")
+
+        name_col = fields.get("name")
+        sector_col = fields.get("sector")
+
+        return [
+            (
+                row[ticker_col].strip(),
+                (row.get(name_col) or "").strip() if name_col else "",
+                (row.get(sector_col) or "").strip() if sector_col else "",
+            )
+            for row in reader
+            if (row.get(ticker_col) or "").strip()
+        ]
+
+
+def universe_signature(paths):
+    return [[p.name, p.stat().st_size, p.stat().st_mtime_ns] for p in paths]
+
+
+def universe_index():
+    """
+    구성종목 색인. 실행마다 한 번만 만들고, 파일이 바뀌지 않았으면 캐시 파일을 그대로 읽는다.
+    구성종목 파일이 없으면 None.
+    """
+    if "index" in _UNIVERSE:
+        return _UNIVERSE["index"]
+
+    paths = universe_files()
+    index = None
+
+    if paths:
+        signature = universe_signature(paths)
+
+        try:
+            with open(UNIVERSE_INDEX_PATH, "r", encoding="utf-8") as f:
+                cached = UniverseIndex.from_json(json.load(f))
+
+            if cached.signature == signature:
+                index = cached
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if index is None:
+            index = UniverseIndex.build({p.stem: read_constituents(p) for p in paths}, signature)
+
+            UNIVERSE_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp = UNIVERSE_INDEX_PATH.with_suffix(".tmp")
+            tmp.write_text(json.dumps(index.to_json(), ensure_ascii=False), encoding="utf-8")
+            tmp.replace(UNIVERSE_INDEX_PATH)
+
+    _UNIVERSE["index"] = index
+    return index
+
+
+def screen_sections():
+    """(시장, 제목, 소스 이름, 종목 리스트). 구성종목 파일이 없으면 빈 목록."""
+    index = universe_index()
+
+    if index is None:
+        return []
+
+    return [
+        (index.source_market(source), f"🔎 SCREENING - {source}", source, index.source_tickers(source))
+        for source in index.sources
+    ]
+
+
+def tickers_digest(tickers):
+    return hashlib.sha256("\n".join(tickers).encode("utf-8")).hexdigest()[:16]
+
+
+def screening_workers():
+    """SCORING_WORKERS를 프로세스 수로. auto면 CPU 수."""
+    if str(SCORING_WORKERS).strip().lower() == "auto":
+        return os.cpu_count() or 1
+    return int(SCORING_WORKERS or 0)
+
+
+def sharded_screening(tickers, workers=None):
+    """이 종목 수를 프로세스 풀로 나눠 받고/계산하는지 (workers > 1이고 SHARD_MIN_TICKERS 이상)."""
+    workers = screening_workers() if workers is None else workers
+    return workers > 1 and len(tickers) >= SHARD_MIN_TICKERS
+
+
+# =========================
+# 스크리닝 가격 패널 (구성종목 파일 하나 = npz 파일 하나)
+# =========================
+
+# 구성종목은 종목별 CSV 대신 (봉 × 종목) 날짜/종가/거래량 배열 하나로 보관해 그대로 채점 패널로 쓴다.
+# 종목마다 종가가 있는 최근 MIN_BARS개 봉을 오른쪽 정렬로 두고, 모자란 앞부분은 NaN/NaT
+SCREEN_STORE_DIR = STATE_DIR / "screen"
+
+
+def screen_store_path(name):
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", name)
+    return SCREEN_STORE_DIR / f"{safe}.npz"
+
+
+def empty_screen_panel(n_tickers):
+    """(dates, close, volume) 빈 패널 (MIN_BARS × n_tickers)."""
+    return (
+        np.full((MIN_BARS, n_tickers), np.datetime64("NaT"), dtype="datetime64[D]"),
+        np.full((MIN_BARS, n_tickers), np.nan),
+        np.full((MIN_BARS, n_tickers), np.nan),
+    )
+
+
+def load_screen_panel(name, tickers):
+    """
+    저장된 스크리닝 패널을 tickers 열 순서로 돌려준다 (dates, close, volume).
+    저장된 적 없는 종목(구성종목 추가)은 빈 열이고, 구성종목에서 빠진 종목은 버린다.
+    """
+    dates, close, volume = empty_screen_panel(len(tickers))
+    path = screen_store_path(name)
+
+    if not path.exists():
+        return dates, close, volume
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            stored = {t: j for j, t in enumerate(data["tickers"].tolist())}
+            source = np.array([stored.get(t, -1) for t in tickers], dtype=int)
+            have = source >= 0
+            rows = min(MIN_BARS, data["close"].shape[0])
+
+            dates[-rows:, have] = data["dates"][-rows:][:, source[have]]
+            close[-rows:, have] = data["close"][-rows:][:, source[have]]
+            volume[-rows:, have] = data["volume"][-rows:][:, source[have]]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"[screen store] {name} 패널 읽기 실패, 전 종목 재다운로드: {e}")
+        return empty_screen_panel(len(tickers))
+
+    return dates, close, volume
+
+
+def save_screen_panel(name, tickers, dates, close, volume):
+    SCREEN_STORE_DIR.mkdir(parents=True, exist_ok=True)
+
+    path = screen_store_path(name)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+
+    with open(tmp, "wb") as f:
+        np.savez(f, tickers=np.array(tickers, dtype=str), dates=dates, close=close, volume=volume)
+
+    tmp.replace(path)
+
+
+def last_bar_dates(dates):
+    """열마다 마지막 봉 날짜 (date, 봉이 없으면 None)."""
+    return [None if np.isnat(d) else d.item() for d in dates[-1]]
+
+
+def screen_panel_stale(name, tickers, now=None):
+    """네트워크 호출 없이, 스크리닝 패널에 새 봉을 받아야 하는 종목이 있는지."""
+    dates, _, _ = load_screen_panel(name, tickers)
+
+    return any(needs_refresh(t, last, now) for t, last in zip(tickers, last_bar_dates(dates)))
 
-    if missing:
-        lines.append("")
-        lines.append("⚠️ 데이터 없음/기간 부족")
-        for t in missing:
-            lines.append(f"- {t}")
 
-    lines.append("")
+def set_screen_column(dates, close, volume, j, df):
+    """OHLCV DataFrame에서 종가가 있는 최근 봉을 j열에 오른쪽 정렬로 채운다."""
+    values = df["Close"].to_numpy(dtype=float)
+    keep = np.isfinite(values)
+    n = min(int(keep.sum()), dates.shape[0])
 
-    return lines, event_list
+    dates[:, j] = np.datetime64("NaT")
+    close[:, j] = np.nan
+    volume[:, j] = np.nan
 
+    if n == 0:
+        return
 
-# =========================
-# 메일 발송
-# =========================
+    dates[-n:, j] = df.index[keep][-n:].to_numpy(dtype="datetime64[D]")
+    close[-n:, j] = values[keep][-n:]
+    volume[-n:, j] = df["Volume"].to_numpy(dtype=float)[keep][-n:]
 
-def send_to_email(text: str):
-    subject = "📈 Stock Alert Bot"
 
-    body = (
-        "📈 Stock Alert Bot\n"
-        "--------------------\n"
-        f"{text}"
+def screen_column_frame(dates, close, volume, j):
+    """j열을 merge_price_delta에 넘길 Close/Volume DataFrame으로."""
+    keep = ~np.isnat(dates[:, j])
+
+    return pd.DataFrame(
+        {"Close": close[keep, j], "Volume": volume[keep, j]},
+        index=pd.DatetimeIndex(dates[keep, j].astype("datetime64[ns]"), name="Date"),
     )
 
-    recipients = [email.strip() for email in TO_EMAIL.split(",") if email.strip()]
 
-    msg = MIMEMultipart()
-    msg["From"] = NAVER_EMAIL
-    msg["To"] = ", ".join(recipients)
-    msg["Subject"] = subject
+def sync_screen_panel(tickers, dates, close, volume, prices=None, concurrency=None):
+    """
+    스크리닝 패널을 sync_prices와 같은 규칙으로 제자리 갱신한다. 갱신한 열이 있으면 True.
 
-    msg.attach(MIMEText(body, "plain", "utf-8"))
+    - prices(이번 실행에 이미 동기화한 {ticker: DataFrame})에 있는 종목: 다운로드 없이 그 값으로 채움
+    - 봉이 MIN_BARS보다 적은 종목: 필요한 최소 구간 다운로드
+    - 그 밖의 종목: 끝난 거래일이 있으면 마지막 봉 근처부터 새 봉만 받아 이어 붙임
+      (겹치는 확정 봉이 수정됐으면 전체 기간 재다운로드)
+    """
+    now = datetime.now(timezone.utc)
+    prices = prices or {}
+    column = {t: j for j, t in enumerate(tickers)}
+    filled = (~np.isnat(dates)).sum(axis=0)
+    last_bars = last_bar_dates(dates)
+    changed = False
+    deltas = set()
+    jobs = []
+
+    for j, t in enumerate(tickers):
+        df = prices.get(t)
+
+        if df is not None and not df.empty:
+            set_screen_column(dates, close, volume, j, df)
+            changed = True
+            continue
 
-    with smtplib.SMTP_SSL("smtp.naver.com", 465) as server:
-        server.login(NAVER_EMAIL, NAVER_APP_PASSWORD)
-        server.send_message(
-            msg,
-            from_addr=NAVER_EMAIL,
-            to_addrs=recipients
+        if filled[j] < max(MIN_BARS, PRICE_STORE_OVERLAP + 1):
+            jobs.append((t, history_window()))
+            continue
+
+        if not needs_refresh(t, last_bars[j], now):
+            continue
+
+        deltas.add(t)
+        jobs.append((t, {"start": str(dates[-PRICE_STORE_OVERLAP, j])}))
+
+    restated = []
+
+    for t, new in iter_downloads(jobs, concurrency):
+        if new is None:
+            continue
+
+        j = column[t]
+
+        if t in deltas:
+            merged = merge_price_delta(screen_column_frame(dates, close, volume, j), new)
+
+            if merged is None:
+                print(f"[screen store] {t} 과거 가격 수정 감지, 전체 기간 재다운로드")
+                restated.append(t)
+                continue
+
+            new = merged
+
+        set_screen_column(dates, close, volume, j, new)
+        changed = True
+
+    for t, df in download_prices(restated, concurrency=concurrency).items():
+        set_screen_column(dates, close, volume, column[t], df)
+        changed = True
+
+    return changed
+
+
+def screen_section(name, tickers, prices, markets, top_n=None, workers=None):
+    """
+    구성종목 전체를 컬럼형으로 한 번에 계산/채점하고 점수 상위 top_n개만 결과 dict로 꺼낸다.
+    (채점 결과 상위 목록, 기간 부족/데이터 없는 종목 수)
+
+    가격은 name의 스크리닝 패널에서 읽어 새 봉만 받아 갱신하고 그대로 채점한다
+    (prices에 이미 있는 종목은 다운로드하지 않는다).
+    sharded_screening이면 종목(열) 구간별로 프로세스 풀 작업이 패널 갱신과 채점을 맡고,
+    부모가 갱신된 구간을 모아 한 번 저장한 뒤 구간별 상위 목록을 합친다.
+    """
+    top_n = SCREEN_TOP_N if top_n is None else top_n
+    workers = screening_workers() if workers is None else workers
+
+    market_keys = [get_market_key(t) for t in tickers]
+    market_chg20 = np.array([markets.get(k, {}).get("chg20d", 0) for k in market_keys], dtype=float)
+    market_chg60 = np.array([markets.get(k, {}).get("chg60d", 0) for k in market_keys], dtype=float)
+
+    dates, close, volume = load_screen_panel(name, tickers)
+
+    if sharded_screening(tickers, workers):
+        results, skipped, changed = screen_sharded(
+            tickers, dates, close, volume, prices, market_chg20, market_chg60, top_n, workers,
         )
+    else:
+        changed = sync_screen_panel(tickers, dates, close, volume, prices)
+        results, skipped = score_top_rows(tickers, close, volume, market_chg20, market_chg60, top_n)
+
+    if changed:
+        save_screen_panel(name, tickers, dates, close, volume)
+
+    return results, skipped
+
+
+def score_top_rows(tickers, close, volume, market_chg20, market_chg60, top_n):
+    """패널의 마지막 봉을 채점해 rank_results 순서 상위 top_n개의 결과 dict와 기간 부족 종목 수."""
+    columns = {"ticker": np.array(tickers, dtype=object)}
+    columns.update(last_bar_columns(close, volume))
+
+    score_columns(columns, market_chg20, market_chg60)
+
+    valid = np.flatnonzero(columns["valid"])
+
+    # rank_key와 같은 정렬 기준 (lexsort는 마지막 키가 1순위, 내림차순은 부호를 뒤집어서).
+    # 안정 정렬이라 동점이면 앞 종목이 먼저다.
+    order = np.lexsort(tuple(
+        -columns[field][valid].astype(float)
+        for field in ("vol_ratio", "ma20_slope", "rs60", "rs20", "is_aligned", "score")
+    ))
+
+    results = []
+
+    for i in valid[order[:top_n]]:
+        results.append(fill_scores(stats_from_columns(columns, i), columns, i, get_market_key(tickers[i])))
+
+    return results, len(tickers) - len(valid)
+
+
+def init_screen_worker(provider, share):
+    """
+    (프로세스 풀 초기화, 프로세스당 한 번) 부모와 같은 시세 제공자를 쓰고,
+    속도 제한은 설정값을 share(프로세스 수)로 나눠 모든 프로세스의 합이 단일 프로세스와 같게 한다.
+    """
+    set_provider(provider)
+    RATE_LIMITERS["yahoo"] = TokenBucket(FETCH_RATE_PER_SEC / share, max(1, FETCH_RATE_BURST // share))
+
+
+def screen_shard(tickers, dates, close, volume, prices, market_chg20, market_chg60, top_n, concurrency):
+    """
+    (프로세스 풀 작업) 구간 종목의 패널 열을 이 프로세스에서 갱신하고 채점한다.
+    다운로드 스레드 수는 부모가 나눠 준 concurrency를 쓴다.
+    패널은 파일에 쓰지 않고 돌려준다 (부모가 모아 한 번에 저장).
+    (구간 상위 top_n개, 기간 부족 종목 수, 갱신된 (dates, close, volume) 또는 변경 없으면 None)
+    """
+    changed = sync_screen_panel(tickers, dates, close, volume, prices, concurrency)
+    results, skipped = score_top_rows(tickers, close, volume, market_chg20, market_chg60, top_n)
+
+    return results, skipped, (dates, close, volume) if changed else None
+
+
+def screen_sharded(tickers, dates, close, volume, prices, market_chg20, market_chg60, top_n, workers):
+    """
+    종목을 workers개 연속 구간(패널 열 구간)으로 나눠 구간마다 패널 갱신/채점을 프로세스 풀에서 돌린다.
+    갱신된 구간은 패널(dates, close, volume)에 제자리로 다시 써 넣는다.
+    구간마다 이미 정렬된 상위 top_n개를 돌려주므로 부모는 병합(heapq.merge)해 앞 top_n개만 취한다.
+    구간 순서대로 병합하므로 동점 순서도 단일 프로세스 결과와 같다.
+    (상위 top_n개, 기간 부족 종목 수, 패널 갱신 여부)
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    bounds = np.linspace(0, len(tickers), workers + 1).astype(int)
+    spans = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+    prices = prices or {}
+
+    # 다운로드 스레드 수는 설정값을 프로세스 수로 나눈다 (모든 프로세스의 합이 설정값)
+    concurrency = max(1, FETCH_CONCURRENCY // workers)
+
+    # spawn: 다운로드 스레드가 돌던 부모를 fork하지 않는다 (macOS/Windows와 같은 동작)
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context,
+        initializer=init_screen_worker, initargs=(PROVIDER, workers),
+    ) as pool:
+        futures = [
+            pool.submit(
+                screen_shard, tickers[start:stop],
+                dates[:, start:stop], close[:, start:stop], volume[:, start:stop],
+                {t: prices[t] for t in tickers[start:stop] if t in prices},
+                market_chg20[start:stop], market_chg60[start:stop], top_n, concurrency,
+            )
+            for start, stop in spans
+        ]
+        shards = [f.result() for f in futures]
+
+    # 작업들이 갱신한 구간을 패널에 다시 써 넣는다 (저장은 호출한 쪽이 한 번에)
+    changed = False
+
+    for (start, stop), (_, _, panel) in zip(spans, shards):
+        if panel is None:
+            continue
+
+        dates[:, start:stop], close[:, start:stop], volume[:, start:stop] = panel
+        changed = True
+
+    merged = heapq.merge(*[results for results, _, _ in shards], key=rank_key, reverse=True)
+
+    return list(itertools.islice(merged, top_n)), sum(skipped for _, skipped, _ in shards), changed
+
+
+def render_screen(writer, row):
+    """스크리닝 섹션: 상위 N종목을 점수 순서 그대로, 섹터 분포와 함께."""
+    index = universe_index()
+
+    writer.heading(row["title"])
+    writer.line(f"구성종목 {row['size']}개 중 점수 상위 {len(row['results'])}개 (기간 부족/데이터 없음 {row['skipped']}개)")
+
+    sectors = {}
+
+    for r in row["results"]:
+        sector = index.sector(r["ticker"]) if index is not None else ""
+
+        if sector:
+            sectors[sector] = sectors.get(sector, 0) + 1
+
+    if sectors:
+        writer.line("섹터: " + " · ".join(f"{s} {n}" for s, n in sorted(sectors.items(), key=lambda x: -x[1])))
+
+    writer.line()
+
+    with METRICS.stage("render"):
+        for r in row["results"]:
+            writer.block(r)
 
-    print(f"Email sent to {', '.join(recipients)}")
+    writer.line()
 
 
 # =========================
 # 메인
 # =========================
 
-def main():
-    now_kst = datetime.utcnow() + timedelta(hours=9)
+def main(market=None, dry_run=False):
+    """
+    실행마다 단계별 지표를 새로 모아 METRICS_DIR에 남긴다 (실패해도 기록).
+    market: kr / us / all (없으면 STOCK_ALERT_MARKET). 범위 밖 시장은 지난 실행 결과를 쓴다.
+    dry_run: 전체 리포트를 출력만 하고 발송/알림 상태/지난 실행 결과는 건드리지 않는다.
+    """
+    with recorded_run(market or RUN_MARKET):
+        run_report(market, dry_run=dry_run)
+
+
+@contextmanager
+def recorded_run(market):
+    """이번 실행의 METRICS를 새로 만들고, 끝나면(실패해도) 파일로 남긴다."""
+    global METRICS
+    METRICS = RunMetrics()
+    METRICS.market = market
+
+    try:
+        yield METRICS
+    except BaseException:
+        METRICS.status = "error"
+        raise
+    finally:
+        path = METRICS.write()
+        print(f"Metrics written to {path}")
+
+
+def run_report(market=None, dry_run=False):
+    market = market or RUN_MARKET
+
+    if market not in MARKET_SCOPES:
+        raise ValueError(f"알 수 없는 시장 범위: {market!r} (kr / us / all)")
+
+    scope = MARKET_SCOPES[market]
+
+    # 지난 실행에서 실패해 큐에 남은 알림부터 보낸다 (이번 실행이 생략되어도)
+    if not dry_run and OUTBOX_PATH.exists():
+        with METRICS.stage("send"):
+            deliver([])
+
+    now_utc = datetime.utcnow()
+    header = report_header(now_utc)
+
+    # 범위 밖 시장의 섹션/기준지수는 지난 실행 결과를 그대로 쓴다 (없으면 새로 계산)
+    last_run = load_last_run()
+    sections = report_sections()
+
+    fresh_titles = {
+        title
+        for key, title, tickers in sections
+        if key in scope or stored_section(last_run, title, tickers) is None
+    }
+    fresh_benchmarks = [
+        key for key in MARKET_INDEX
+        if key in scope or key not in last_run["markets"]
+    ]
+
+    # 구성종목 스크리닝도 같은 규칙 (범위 밖 시장은 지난 상위 N 결과)
+    screens = screen_sections()
+    fresh_screens = {
+        source
+        for key, _, source, tickers in screens
+        if key in scope or stored_screen(last_run, source, tickers) is None
+    }
+
+    # 이번 실행에 필요한 종목(기준지수 포함)을 로컬 저장소 기준으로 동기화한다.
+    # 저장된 종목은 마지막 저장일 이후 봉만, 전 종목을 동시에 받는다.
+    # 스크리닝 구성종목은 여기서 받지 않고 screen_section이 스크리닝 패널에서 갱신한다
+    universe = universe_tickers(
+        [MARKET_INDEX[key] for key in fresh_benchmarks],
+        *[tickers for _, title, tickers in sections if title in fresh_titles],
+    )
+
+    # 네트워크 호출 전에 거래일 캘린더로 확인: 저장된 마지막 봉 이후 어느 종목도
+    # 새 봉이 생길 수 없으면(휴장일/주말 재실행) 다운로드/계산/발송을 모두 생략한다
+    stale = stale_tickers(universe) or any(
+        screen_panel_stale(source, tickers)
+        for _, _, source, tickers in screens
+        if source in fresh_screens
+    )
+
+    if not (dry_run or FORCE_FULL_REPORT) and load_alert_state()["tickers"] and not stale:
+        print("저장된 마지막 봉 이후 끝난 거래일 없음 (휴장일/주말) - 실행 생략")
+        METRICS.status = "skipped"
+        return
+
+    with METRICS.stage("fetch"):
+        prices = sync_prices(universe)
+
+    # 전 종목 지표를 (날짜 × 종목) 패널로 한 번에 계산
+    with METRICS.stage("indicators"):
+        universe_stats = compute_universe_stats(prices, universe)
+
+    with METRICS.stage("market"):
+        markets = dict(last_run["markets"])
+        markets.update(fetch_market_stats(universe_stats))
+
+    rows = []
+    run_sections = {}
+
+    for key, title, tickers in sections:
+        if title in fresh_titles:
+            results, missing, _ = score_section(tickers, markets, universe_stats)
+        else:
+            stored = stored_section(last_run, title, tickers)
+            results, missing = stored["results"], stored["missing"]
+
+        run_sections[title] = {
+            "market": key,
+            "tickers": list(tickers),
+            "results": results,
+            "missing": missing,
+        }
+
+        rows.append({"market": key, "title": title, "results": results, "missing": missing})
+
+    # 스크리닝 상위 N은 전체 리포트에만 싣고 이벤트 요약/변동 알림 대상에서는 뺀다
+    run_screens = {}
+
+    for key, title, source, tickers in screens:
+        if source in fresh_screens:
+            with METRICS.stage("screening"):
+                results, skipped = screen_section(source, tickers, prices, markets)
+
+            screen = {
+                "market": key,
+                "digest": tickers_digest(tickers),
+                "size": len(tickers),
+                "skipped": skipped,
+                "results": results,
+            }
+        else:
+            screen = stored_screen(last_run, source, tickers)
+
+        run_screens[source] = screen
+
+        rows.append({
+            "market": key,
+            "title": title,
+            "results": screen["results"],
+            "missing": [],
+            "screen": True,
+            "size": screen["size"],
+            "skipped": screen["skipped"],
+        })
+
+    if not dry_run:
+        save_last_run({"markets": markets, "sections": run_sections, "screens": run_screens})
+
+    publish_report(header, markets, rows, now_utc, dry_run=dry_run)
+
+
+def report_header(now_utc):
+    now_kst = now_utc + timedelta(hours=9)
     today = now_kst.strftime("%m/%d %H:%M")
 
-    header = f"📈 주도주 추세추종 리포트 | {today}"
+    return f"📈 주도주 추세추종 리포트 | {today}"
 
-    lines = [header, ""]
 
-    markets = fetch_market_stats()
-    market_lines, market_status, min_weight, max_weight = market_status_text(markets)
-    lines += market_lines
+def publish_report(header, markets, rows, now_utc, dry_run=False):
+    """
+    채점이 끝난 섹션(rows)으로 수신자별 리포트를 만들어 보내고 알림 상태를 갱신한다.
+    rows: [{"market", "title", "results", "missing"}, ...] (스크리닝 섹션은 "screen": True)
+    """
+    with METRICS.stage("market"):
+        market_lines, market_status, min_weight, max_weight = market_status_text(markets)
 
-    all_events = {
-        "cross20_up": [],
-        "cross20_up_volume": [],
-        "cross20_down": [],
-        "cross60_down": [],
-        "strong_buy": [],
+    # 이번 실행이 전체 리포트인지 먼저 정해, 변동분만 보낼 때는 종목 블록을 렌더링하지 않는다
+    alert_state = load_alert_state()
+    full_report = dry_run or full_report_due(alert_state, now_utc)
+
+    all_results = [r for row in rows if not row.get("screen") for r in row["results"]]
+    current = snapshot_results(all_results)
+    messages = []
+
+    # 수신자마다 받을 섹션/종목만 골라 리포트를 만든다 (설정이 없으면 전체 한 통)
+    profiles = [DRY_RUN_PROFILE] if dry_run else load_recipients()
+
+    for profile in profiles:
+        view = recipient_sections(profile, rows)
+
+        # 메일은 plain text와 HTML을 함께 쓴다
+        writer = ReportWriter(html=profile["channel"] == "email")
+
+        if full_report:
+            write_full_report(writer, header, market_lines, view)
+        else:
+            changes = recipient_changes(view, alert_state["tickers"], current)
+
+            if not any(changes.values()):
+                continue
+
+            with METRICS.stage("render"):
+                writer.lines(delta_report_lines(header, changes))
+
+        message = writer.text()
+        print("\n" + message + "\n" + "-" * 40)
+
+        item = {"channel": profile["channel"], "to": profile["to"], "ref": profile.get("ref"), "text": message}
+
+        if profile["channel"] == "email":
+            item["html"] = writer.html()
+
+        messages.append(item)
+
+    if dry_run:
+        print(f"dry-run: {len(messages)}건 발송 생략")
+        return
+
+    if not messages:
+        print("지난 리포트 이후 변동 없음 - 발송 생략")
+        alert_state["tickers"] = current
+        save_alert_state(alert_state)
+        return
+
+    # 실패한 채널은 재시도 큐가 맡으므로 다시 계산하지 않도록 상태는 그대로 갱신한다
+    with METRICS.stage("send"):
+        deliver(messages)
+
+    alert_state["tickers"] = current
+
+    if full_report:
+        alert_state["last_full_report"] = now_utc.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    save_alert_state(alert_state)
+
+
+# =========================
+# 샤드 실행 (map-reduce: 여러 러너/머신에 유니버스를 나눠 계산 → 한 곳에서 합쳐 발송)
+# =========================
+
+# 샤드 결과 파일 디렉터리 (merge는 인자가 없으면 여기의 partial-*.json을 읽는다)
+PARTIALS_DIR = STATE_DIR / "partials"
+
+PARTIAL_FORMAT = 1
+
+# 샤드 결과 파일의 종목 행 컬럼 순서 (행마다 키를 반복하지 않는다)
+PARTIAL_FIELDS = RECORD_FIELDS
+
+
+def in_shard(ticker, index, count):
+    """종목 코드의 crc32로 나눈다. 종목 목록 순서나 실행 환경과 관계없이 항상 같은 샤드."""
+    return zlib.crc32(ticker.encode("utf-8")) % count == index
+
+
+def partial_path(directory, index, count):
+    return Path(directory) / f"partial-{index:03d}-of-{count:03d}.json"
+
+
+def pack_rows(results):
+    return [[r[field] for field in PARTIAL_FIELDS] for r in results]
+
+
+def unpack_rows(rows):
+    return [StockRecord(zip(PARTIAL_FIELDS, row)) for row in rows]
+
+
+def run_shard(index, count, output_dir=None):
+    """
+    샤드 단계: 섹션/구성종목 중 index번째 샤드(전체 count개)만 받아 계산/채점하고
+    결과 파일 하나를 남긴다. 발송/알림 상태는 건드리지 않는다.
+    기준지수는 모든 샤드가 받는다 (상대강도 계산용).
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"샤드 번호 {index}가 범위(0 ~ {count - 1}) 밖")
+
+    sections = report_sections()
+    screens = screen_sections()
+
+    def shard(tickers):
+        return [t for t in tickers if in_shard(t, index, count)]
+
+    universe = universe_tickers(
+        list(MARKET_INDEX.values()),
+        *[shard(tickers) for _, _, tickers in sections],
+    )
+
+    with METRICS.stage("fetch"):
+        prices = sync_prices(universe)
+
+    with METRICS.stage("indicators"):
+        universe_stats = compute_universe_stats(prices, universe)
+
+    with METRICS.stage("market"):
+        markets = fetch_market_stats(universe_stats)
+
+    partial = {
+        "format": PARTIAL_FORMAT,
+        "shard": index,
+        "count": count,
+        "created_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "markets": markets,
+        "fields": PARTIAL_FIELDS,
+        "sections": {},
+        "screens": {},
     }
 
-    body_lines = []
+    for _, title, tickers in sections:
+        results, missing, _ = score_section(shard(tickers), markets, universe_stats)
+        partial["sections"][title] = {"rows": pack_rows(results), "missing": missing}
 
-    section_lines, events = build_section_lines("📦 PORTFOLIO - 🇰🇷 KOREA", TICKERS_KR, markets)
-    body_lines += section_lines
-    for key in all_events:
-        all_events[key] += events[key]
+    for _, _, source, tickers in screens:
+        shard_tickers = shard(tickers)
 
-    section_lines, events = build_section_lines("📦 PORTFOLIO - 🇺🇸 USA", TICKERS_US, markets)
-    body_lines += section_lines
-    for key in all_events:
-        all_events[key] += events[key]
+        with METRICS.stage("screening"):
+            # 샤드마다 따로 패널 파일을 둔다 (상태 디렉터리를 같이 써도 서로 덮어쓰지 않게)
+            results, skipped = screen_section(
+                f"{source}-{index:03d}-of-{count:03d}", shard_tickers, prices, markets,
+            )
 
-    section_lines, events = build_section_lines("👀 WATCHLIST - 🇰🇷 KOREA", WATCHLIST_KR, markets)
-    body_lines += section_lines
-    for key in all_events:
-        all_events[key] += events[key]
+        partial["screens"][source] = {
+            "size": len(shard_tickers),
+            "skipped": skipped,
+            "rows": pack_rows(results),
+        }
+
+    path = partial_path(output_dir or PARTIALS_DIR, index, count)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(
+        json.dumps(partial, ensure_ascii=False, separators=(",", ":"), default=record_json),
+        encoding="utf-8",
+    )
+    tmp.replace(path)
 
-    section_lines, events = build_section_lines("👀 WATCHLIST - 🇺🇸 USA", WATCHLIST_US, markets)
-    body_lines += section_lines
-    for key in all_events:
-        all_events[key] += events[key]
+    watched = universe_tickers(universe, *[shard(tickers) for _, _, _, tickers in screens])
+    print(f"[shard {index}/{count}] 종목 {len(watched)}개 → {path}")
 
-    summary = ["📌 오늘 주요 이벤트", ""]
+    return path
 
-    has_event = any(len(v) > 0 for v in all_events.values())
 
-    if not has_event:
-        summary.append("오늘 주요 이벤트 없음")
-        summary.append("")
+def load_partials(paths):
+    """파일/디렉터리 목록에서 샤드 결과를 읽는다. 샤드 수가 서로 다르면 ValueError."""
+    files = []
+
+    for p in [Path(p) for p in paths] or [PARTIALS_DIR]:
+        files += sorted(p.glob("partial-*.json")) if p.is_dir() else [p]
+
+    partials = []
+
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            partial = json.load(f)
+
+        if partial.get("format") != PARTIAL_FORMAT or tuple(partial["fields"]) != PARTIAL_FIELDS:
+            raise ValueError(f"{path}: 이 버전과 맞지 않는 샤드 결과 파일")
+
+        partials.append(partial)
+
+    if not partials:
+        raise ValueError("샤드 결과 파일 없음")
+
+    counts = {p["count"] for p in partials}
+
+    if len(counts) > 1:
+        raise ValueError(f"샤드 수가 다른 결과 파일이 섞여 있음: {sorted(counts)}")
+
+    partials.sort(key=lambda p: p["shard"])
+
+    return partials
+
+
+def merge_partials(partials):
+    """
+    병합 단계: 샤드 결과를 섹션 종목 순서대로 다시 모아 한 번 실행한 것과 같은 rows와 markets를 만든다.
+    이벤트 요약(all_events)은 합친 결과에서 만들므로 순서도 단일 실행과 같다.
+    (markets, rows, 섹션별 last_run 항목, 스크리닝별 last_run 항목)
+    """
+    count = partials[0]["count"]
+    present = {p["shard"] for p in partials}
+    absent = [i for i in range(count) if i not in present]
+
+    if absent:
+        print(f"[merge] 샤드 {count}개 중 누락: {', '.join(map(str, absent))} (해당 종목은 데이터 없음으로 표시)")
+
+    markets = {}
+
+    for partial in reversed(partials):
+        markets.update(partial["markets"])
+
+    rows = []
+    run_sections = {}
+
+    for key, title, tickers in report_sections():
+        by_ticker = {}
+
+        for partial in partials:
+            for r in unpack_rows(partial["sections"].get(title, {}).get("rows", [])):
+                by_ticker[r["ticker"]] = r
+
+        results = [by_ticker[t] for t in tickers if t in by_ticker]
+        missing = [t for t in tickers if t not in by_ticker]
+
+        run_sections[title] = {"market": key, "tickers": list(tickers), "results": results, "missing": missing}
+        rows.append({"market": key, "title": title, "results": results, "missing": missing})
+
+    run_screens = {}
+
+    for key, title, source, tickers in screen_sections():
+        shards = [p["screens"][source] for p in partials if source in p["screens"]]
+
+        # 샤드마다 이미 rank_key 순으로 정렬되어 있다
+        merged = heapq.merge(*[unpack_rows(s["rows"]) for s in shards], key=rank_key, reverse=True)
+
+        screen = {
+            "market": key,
+            "digest": tickers_digest(tickers),
+            "size": sum(s["size"] for s in shards),
+            "skipped": sum(s["skipped"] for s in shards),
+            "results": list(itertools.islice(merged, SCREEN_TOP_N)),
+        }
+        run_screens[source] = screen
+
+        rows.append({
+            "market": key,
+            "title": title,
+            "results": screen["results"],
+            "missing": [],
+            "screen": True,
+            "size": screen["size"],
+            "skipped": screen["skipped"],
+        })
+
+    METRICS.add_missing([t for row in rows for t in row["missing"]])
+
+    return markets, rows, run_sections, run_screens
+
+
+def run_merge(paths=(), dry_run=False):
+    """병합 단계 전체: 샤드 결과를 합쳐 리포트를 만들고 (dry_run이 아니면) 발송/상태 저장."""
+    with METRICS.stage("merge"):
+        markets, rows, run_sections, run_screens = merge_partials(load_partials(paths))
+
+    now_utc = datetime.utcnow()
+    header = report_header(now_utc)
+
+    if not dry_run:
+        save_last_run({"markets": markets, "sections": run_sections, "screens": run_screens})
+
+    publish_report(header, markets, rows, now_utc, dry_run=dry_run)
+
+
+# =========================
+# 명령줄
+# =========================
+
+def condition_fields(cond):
+    if isinstance(cond, str):
+        return [cond]
+
+    lhs, _, rhs = cond
+
+    return [lhs, rhs] if isinstance(rhs, str) else [lhs]
+
+
+def validate_config():
+    """
+    tickers.json / scoring.json / 수신자 설정 / 구성종목 파일을 검사해 (오류, 경고) 문구 목록을 돌려준다.
+    네트워크와 numpy/pandas/yfinance를 쓰지 않는다.
+    """
+    errors = []
+    warnings = []
+
+    try:
+        ticker_lists = load_tickers()[:4]
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        errors.append(f"tickers.json: {e}")
     else:
-        if all_events["strong_buy"]:
-            summary.append("🟢 비중 확대 후보")
-            summary += all_events["strong_buy"]
-            summary.append("")
+        seen = {}
+        names = ("portfolio.kr", "portfolio.us", "watchlist.kr", "watchlist.us")
+
+        for section, tickers in zip(names, ticker_lists):
+            for t in tickers:
+                if t in seen:
+                    errors.append(f"tickers.json: {t} 중복 ({seen[t]}, {section})")
+                seen.setdefault(t, section)
+
+                if section.endswith(".kr") != (ticker_exchange(t) == "krx"):
+                    errors.append(f"tickers.json: {t} 거래소가 {section} 섹션과 맞지 않음")
+
+    try:
+        rules = load_scoring_rules()
+        compile_scoring_rules(rules)
+        compile_condition(rules["strong_buy"])
+        compile_condition(rules["volume_breakout"])
+
+        if float(rules["buckets"]["upper"]) < float(rules["buckets"]["middle"]):
+            errors.append("scoring.json: buckets.upper가 buckets.middle보다 작음")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        errors.append(f"scoring.json: {e!r}")
+    else:
+        known = set(STAT_FIELDS) | {"rs20", "rs60", "score"}
+        rule_list = [r for group in rules["score"] for r in group["rules"]] + rules["decisions"]
+        rule_list += [{"if": rules["strong_buy"]}, {"if": rules["volume_breakout"]}]
+
+        for rule in rule_list:
+            for key in ("if", "unless"):
+                for field in condition_fields(rule[key]) if key in rule else []:
+                    if field not in known:
+                        errors.append(f"scoring.json: 알 수 없는 필드 {field!r}")
+
+    if RECIPIENTS_JSON.strip():
+        try:
+            for profile in load_recipients():
+                if profile["channel"] not in CHANNEL_SENDERS:
+                    errors.append(f"STOCK_ALERT_RECIPIENTS: 알 수 없는 채널 {profile['channel']!r}")
+                elif profile["channel"] != "kakao" and not profile["to"]:
+                    errors.append(f"STOCK_ALERT_RECIPIENTS: {profile['channel']} 수신 주소 없음")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            errors.append(f"STOCK_ALERT_RECIPIENTS: {e!r}")
+
+    for path in universe_files():
+        try:
+            rows = read_constituents(path)
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            errors.append(f"universe/{path.name}: {e}")
+            continue
 
-        if all_events["cross20_up_volume"]:
-            summary.append("🚀 20일선 상향돌파 + 거래량")
-            summary += all_events["cross20_up_volume"]
-            summary.append("")
+        if not rows:
+            warnings.append(f"universe/{path.name}: 구성종목 없음")
 
-        if all_events["cross20_up"]:
-            summary.append("⭐ 20일선 상향돌파")
-            summary += all_events["cross20_up"]
-            summary.append("")
+        for t, _, _ in rows:
+            if re.fullmatch(r"\d{6}", t):
+                errors.append(f"universe/{path.name}: {t}에 거래소 접미사(.KS / .KQ)가 없음")
 
-        if all_events["cross20_down"]:
-            summary.append("⚠️ 20일선 하향이탈")
-            summary += all_events["cross20_down"]
-            summary.append("")
+        markets = {exchange_market(t) for t, _, _ in rows}
 
-        if all_events["cross60_down"]:
-            summary.append("🚨 60일선 하향이탈")
-            summary += all_events["cross60_down"]
-            summary.append("")
-
-        guide = [
-            "📊 점수/등급 기준",
-            "점수 = 정배열 구조 + 이평선 기울기 + 상대강도 + 거래량 + 돌파/이탈 이벤트",
-            "",
-            "정배열 구조: 최대 30점",
-            "- 완전 정배열(현재가 ≥ 5일 ≥ 10일 ≥ 20일 ≥ 60일) = +30",
-            "- 부분 점수: 20일선 위 +8 / 60일선 위 +8 / 5≥10 +5 / 10≥20 +5 / 20≥60 +5",
-            "",
-            "이평선 기울기: 최대 24점",
-            "- 20일선 상승 +12 / 60일선 상승 +12",
-            "",
-            "상대강도: 최대 36점",
-            "- 20D가 기준시장보다 강함 +12 / RS20 +5%p 초과 추가 +6",
-            "- 60D가 기준시장보다 강함 +12 / RS60 +10%p 초과 추가 +6",
-            "",
-            "거래량: 최대 10점",
-            "- 20일 평균 거래량 대비 2.0배 이상 +10 / 1.5배 이상 +6 / 0.7배 이하 -3",
-            "",
-            "돌파/이탈 이벤트",
-            "- 20일선 상향돌파 +8",
-            "- 20일선 하향이탈 -20",
-            "- 60일선 하향이탈 -35",
-            "",
-            "등급: A 80점↑ / B+ 65점↑ / B 50점↑ / C 35점↑ / D 35점↓",
-            "판단: 20이탈=30% 매도 검토 / 60이탈=전량 매도 검토 / 20돌파=재매수 후보",
-            "정렬: 점수 → 정배열 → 상대강도 → 이평선 기울기 → 거래량",
-            "",
-        ]
+        if len(markets) > 1:
+            warnings.append(f"universe/{path.name}: 한국/미국 종목이 섞여 있음 (많은 쪽 시장으로 실행)")
+
+    if 0 < WEBHOOK_MAX_BYTES < min_chunk_limit("bytes"):
+        errors.append(
+            f"STOCK_ALERT_WEBHOOK_MAX_BYTES: {WEBHOOK_MAX_BYTES}가 너무 작음 (최소 {min_chunk_limit('bytes')})"
+        )
+
+    if RUN_MARKET not in MARKET_SCOPES:
+        errors.append(f"STOCK_ALERT_MARKET: 알 수 없는 시장 범위 {RUN_MARKET!r}")
+
+    year = date.today().year
+
+    if year not in KRX_HOLIDAYS:
+        warnings.append(f"KRX_HOLIDAYS에 {year}년 휴장일이 없음 (휴장일에도 다운로드한다)")
+
+    return errors, warnings
+
+
+def score_only(market=None, tickers=None):
+    """
+    다운로드/지표 계산/채점만 하고 종목별 점수 표를 출력한다.
+    렌더링/발송/알림 상태는 건드리지 않는다.
+    """
+    scope = MARKET_SCOPES[market or RUN_MARKET]
+
+    if tickers:
+        sections = [("custom", "종목 지정", tickers)]
+    else:
+        sections = [row for row in report_sections() if row[0] in scope]
+
+    universe = universe_tickers(list(MARKET_INDEX.values()), *[row[2] for row in sections])
+    prices = sync_prices(universe)
+    universe_stats = compute_universe_stats(prices, universe)
+    markets = fetch_market_stats(universe_stats)
+
+    for _, title, section_tickers in sections:
+        results, missing, _ = score_section(section_tickers, markets, universe_stats)
+        rank_results(results)
+
+        print(title)
+
+        for r in results:
+            print(f"  {r['ticker']:<11} {r['score']:>4.0f}  {r['grade']:<2}  {r['decision']:<12} {ticker_name(r['ticker'])}")
+
+        for t in missing:
+            print(f"  {t:<11}    -  데이터 없음")
+
+        print()
+
+
+def cli(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="stock_alert.py", description="주도주 추세추종 리포트")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    run = commands.add_parser("run", help="리포트를 계산해 발송 (기본)")
+    dry = commands.add_parser("dry-run", help="발송/상태 저장 없이 전체 리포트만 출력")
+    score = commands.add_parser("score", help="채점 결과 표만 출력")
+    commands.add_parser("validate", help="tickers.json / scoring.json / 수신자 / 구성종목 설정 검사")
+
+    shard = commands.add_parser("shard", help="유니버스 중 한 샤드만 계산해 결과 파일로 저장")
+    shard.add_argument("--index", type=int, required=True, help="샤드 번호 (0부터)")
+    shard.add_argument("--count", type=int, required=True, help="전체 샤드 수")
+    shard.add_argument("--output", help="결과 파일 디렉터리 (기본: .state/partials)")
+
+    merge = commands.add_parser("merge", help="샤드 결과 파일을 합쳐 리포트 발송")
+    merge.add_argument("paths", nargs="*", help="결과 파일/디렉터리 (기본: .state/partials)")
+    merge.add_argument("--dry-run", action="store_true", help="발송/상태 저장 없이 전체 리포트만 출력")
+
+    for sub in (run, dry, score):
+        sub.add_argument("--market", choices=sorted(MARKET_SCOPES), help="시장 범위 (기본: STOCK_ALERT_MARKET)")
+
+    for sub in (run, dry, shard):
+        sub.add_argument("--workers", help="스크리닝 채점 프로세스 수 (auto = CPU 수, 기본: STOCK_ALERT_WORKERS)")
+
+    score.add_argument("--tickers", help="채점할 종목 (쉼표 구분, 기본: 시장 범위의 전 섹션)")
+
+    args = parser.parse_args(argv)
+    command = args.command or "run"
+
+    if getattr(args, "workers", None):
+        global SCORING_WORKERS
+        SCORING_WORKERS = args.workers
+
+    if command == "validate":
+        errors, warnings = validate_config()
+
+        for w in warnings:
+            print(f"경고: {w}")
+
+        for e in errors:
+            print(f"오류: {e}")
+
+        if not errors:
+            print("설정 정상")
+
+        return 1 if errors else 0
+
+    if command == "score":
+        tickers = [t.strip() for t in args.tickers.split(",") if t.strip()] if args.tickers else None
+        score_only(args.market, tickers)
+        return 0
 
-    lines = lines + summary + guide + body_lines
+    if command == "shard":
+        with recorded_run(f"shard-{args.index}-of-{args.count}"):
+            run_shard(args.index, args.count, args.output)
+        return 0
 
-    message = "\n".join(lines)
+    if command == "merge":
+        with recorded_run("merge"):
+            run_merge(args.paths, dry_run=args.dry_run)
+        return 0
 
-    print("\n" + message + "\n" + "-" * 40)
-    send_to_email(message)
+    main(getattr(args, "market", None), dry_run=command == "dry-run")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
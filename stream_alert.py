@@ -0,0 +1,287 @@
+"""
+포트폴리오 종목 실시간 감시 모드.
+
+실시간 체결가를 받을 때마다 오늘 봉을 임시 종가로 보고 이동평균/돌파 상태를 O(1)로 갱신하고,
+20일선 상향돌파 / 20일선 하향이탈 / 60일선 하향이탈이 새로 생기면 바로 메일을 보낸다.
+같은 종목의 같은 이벤트는 하루에 한 번만 알린다.
+
+- 실시간: Yahoo Finance 스트리머(websocket + protobuf)
+- 테스트: JSONL 체결 파일 재생
+    {"ticker": "NVDA", "price": 171.2, "time": "2026-10-16T14:30:05-04:00", "volume": 1200000}
+
+사용 예:
+    python stream_alert.py
+    python stream_alert.py --replay ticks.jsonl --dry-run
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import websockets
+
+import stock_alert as sa
+
+YAHOO_STREAM_URL = "wss://streamer.finance.yahoo.com/?version=2"
+
+# 스트리머는 주기적으로 구독을 다시 보내야 연결을 유지한다
+RESUBSCRIBE_SECONDS = 15
+
+# 연결이 끊겼을 때 재접속 대기 (초, 실패할 때마다 2배, 최대값)
+RECONNECT_BACKOFF = 2.0
+RECONNECT_BACKOFF_MAX = 60.0
+
+KR_TZ = ZoneInfo("Asia/Seoul")
+US_TZ = ZoneInfo("America/New_York")
+
+# 실시간으로 알리는 이벤트와 문구
+STREAM_EVENTS = {
+    "cross20_up": "⭐ 20일선 상향돌파 | 매수 고려",
+    "cross20_down": "⚠️ 20일선 하향이탈 | 30% 매도 검토",
+    "cross60_down": "🚨 60일선 하향이탈 | 전량 매도 검토",
+}
+
+
+def exchange_tz(ticker):
+    if ticker.endswith(".KS") or ticker.endswith(".KQ"):
+        return KR_TZ
+    return US_TZ
+
+
+class TickTracker:
+    """
+    한 종목의 실시간 이동평균 상태.
+    확정 일봉까지의 RollingState를 복사해 두고, 체결이 오면 오늘 봉을 임시 종가로
+    추가(push)하거나 덮어써(replace_last) 이벤트를 다시 판단한다.
+    """
+
+    def __init__(self, ticker, state):
+        self.ticker = ticker
+        self.state = state
+        self.fired = set()
+
+    def on_tick(self, price, when, volume=None):
+        """새로 발생한 이벤트 키 목록을 돌려준다."""
+        day = when.astimezone(exchange_tz(self.ticker)).strftime("%Y-%m-%d")
+
+        if day < self.state.last_date:
+            return []
+
+        if volume is None:
+            volume = self.state.volumes[-1] if day == self.state.last_date else float("nan")
+
+        if day == self.state.last_date:
+            self.state.replace_last(price, float(volume))
+        else:
+            self.state.push(day, price, float(volume))
+            self.fired = {key for key in self.fired if key[0] == day}
+
+        stats = self.state.stats(self.ticker)
+
+        if stats is None:
+            return []
+
+        new_events = []
+
+        for event in STREAM_EVENTS:
+            if stats[event] and (day, event) not in self.fired:
+                self.fired.add((day, event))
+                new_events.append(event)
+
+        return new_events
+
+
+def build_trackers(tickers):
+    """가격 저장소를 동기화하고 확정 일봉 기준 상태로 종목별 추적기를 만든다."""
+    prices = sa.sync_prices(tickers)
+    trackers = {}
+
+    for t in tickers:
+        df = prices.get(t)
+
+        if df is None or df.empty:
+            print(f"[stream] {t} 가격 데이터 없음, 제외")
+            continue
+
+        state = sa.rolling_state_from_prices(df)
+
+        if state is None or state.stats(t) is None:
+            print(f"[stream] {t} 기간 부족, 제외")
+            continue
+
+        trackers[t] = TickTracker(t, state)
+
+    return trackers
+
+
+def format_alert(ticker, event, price, when):
+    name = sa.TICKER_NAME_MAP.get(ticker, ticker)
+    local = when.astimezone(exchange_tz(ticker)).strftime("%m/%d %H:%M:%S")
+
+    return (
+        f"{STREAM_EVENTS[event]}\n"
+        f"{name} ({ticker}) | 현재가 {sa.format_price(ticker, price)} | {local}"
+    )
+
+
+# =========================
+# 체결 피드
+# =========================
+
+def decode_yahoo_message(raw):
+    """스트리머 메시지(JSON 안의 base64 protobuf 또는 base64 문자열)를 PricingData로 바꾼다."""
+    from yfinance.pricing_pb2 import PricingData
+
+    try:
+        payload = json.loads(raw)
+        encoded = payload.get("message", "")
+    except (ValueError, AttributeError):
+        encoded = raw
+
+    data = PricingData()
+    data.ParseFromString(base64.b64decode(encoded))
+
+    return data
+
+
+async def yahoo_feed(tickers):
+    """Yahoo 스트리머에서 (ticker, price, when, volume)을 계속 내보낸다. 끊기면 재접속."""
+    backoff = RECONNECT_BACKOFF
+    subscribe = json.dumps({"subscribe": list(tickers)})
+
+    while True:
+        try:
+            async with websockets.connect(YAHOO_STREAM_URL) as ws:
+                await ws.send(subscribe)
+                backoff = RECONNECT_BACKOFF
+
+                async def keep_subscribed():
+                    while True:
+                        await asyncio.sleep(RESUBSCRIBE_SECONDS)
+                        await ws.send(subscribe)
+
+                heartbeat = asyncio.create_task(keep_subscribed())
+
+                try:
+                    async for raw in ws:
+                        try:
+                            data = decode_yahoo_message(raw)
+                        except Exception as e:
+                            print(f"[stream] 메시지 해석 실패: {e}")
+                            continue
+
+                        if not data.id or data.price <= 0:
+                            continue
+
+                        when = datetime.fromtimestamp(data.time / 1000, tz=timezone.utc)
+                        volume = float(data.day_volume) if data.day_volume else None
+
+                        yield data.id, float(data.price), when, volume
+                finally:
+                    heartbeat.cancel()
+
+        except (OSError, websockets.WebSocketException) as e:
+            print(f"[stream] 연결 끊김: {e} / {backoff:.0f}초 후 재접속")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+
+async def replay_feed(path, speed=0.0):
+    """
+    JSONL 체결 파일을 순서대로 내보낸다.
+    speed > 0이면 체결 시각 간격을 speed배 빠르게 재현하고, 0이면 기다리지 않는다.
+    """
+    previous = None
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+
+            if not line:
+                continue
+
+            tick = json.loads(line)
+            when = parse_tick_time(tick["time"])
+
+            if speed > 0 and previous is not None:
+                await asyncio.sleep(max(0.0, (when - previous).total_seconds() / speed))
+
+            previous = when
+
+            yield tick["ticker"], float(tick["price"]), when, tick.get("volume")
+
+
+def parse_tick_time(value):
+    """epoch 초 또는 ISO 8601 문자열. 타임존이 없으면 UTC로 본다."""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+
+    when = datetime.fromisoformat(value)
+
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+
+    return when
+
+
+# =========================
+# 실행
+# =========================
+
+async def run_stream(feed, trackers, dry_run=False):
+    sending = set()
+
+    async for ticker, price, when, volume in feed:
+        tracker = trackers.get(ticker)
+
+        if tracker is None:
+            continue
+
+        for event in tracker.on_tick(price, when, volume):
+            text = format_alert(ticker, event, price, when)
+            print("\n" + text + "\n" + "-" * 40)
+
+            if not dry_run:
+                # 메일 발송이 체결 처리를 막지 않도록 별도 스레드에서 보낸다
+                task = asyncio.create_task(asyncio.to_thread(sa.send_to_email, text))
+                sending.add(task)
+                task.add_done_callback(sending.discard)
+
+    # 재생 피드가 끝나면 보내는 중인 알림을 마저 기다린다
+    if sending:
+        await asyncio.gather(*sending, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="포트폴리오 실시간 이평선 돌파/이탈 알림")
+    parser.add_argument("--replay", help="실시간 대신 재생할 JSONL 체결 파일")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="재생 속도 배수 (0이면 기다리지 않음)")
+    parser.add_argument("--tickers", help="감시할 종목 (쉼표 구분, 기본: 포트폴리오 전체)")
+    parser.add_argument("--dry-run", action="store_true", help="메일을 보내지 않고 출력만")
+    args = parser.parse_args()
+
+    if args.tickers:
+        tickers = [t.strip() for t in args.tickers.split(",") if t.strip()]
+    else:
+        tickers = sa.universe_tickers(sa.TICKERS_KR, sa.TICKERS_US)
+
+    trackers = build_trackers(tickers)
+    print(f"[stream] {len(trackers)}개 종목 감시 시작")
+
+    if args.replay:
+        feed = replay_feed(args.replay, args.speed)
+    else:
+        feed = yahoo_feed(list(trackers))
+
+    try:
+        asyncio.run(run_stream(feed, trackers, dry_run=args.dry_run))
+    except KeyboardInterrupt:
+        print("[stream] 종료")
+
+
+if __name__ == "__main__":
+    main()
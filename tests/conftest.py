@@ -0,0 +1,18 @@
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# stock_alert는 import할 때 상태 디렉터리를 정하므로, 테스트가 저장소의 .state를 건드리지 않도록 먼저 돌려 둔다.
+# 스크리닝 프로세스 풀(spawn)도 이 환경변수를 물려받는다
+STATE_DIR = tempfile.mkdtemp(prefix="stock-alert-test-")
+os.environ["STOCK_ALERT_STATE_DIR"] = STATE_DIR
+os.environ.setdefault("NAVER_EMAIL", "test@example.com")
+os.environ.setdefault("NAVER_APP_PASSWORD", "test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
@@ -0,0 +1,62 @@
+from datetime import date, datetime
+
+import stock_alert as sa
+
+KST = sa.EXCHANGES["krx"]["tz"]
+ET = sa.EXCHANGES["nyse"]["tz"]
+
+
+def kst(*args):
+    return datetime(*args, tzinfo=KST)
+
+
+def et(*args):
+    return datetime(*args, tzinfo=ET)
+
+
+def test_krx_chuseok_falls_back_to_last_session():
+    # 2026-09-24(목), 25(금) 추석 연휴
+    assert sa.latest_session("krx", kst(2026, 9, 24, 16, 0)) == date(2026, 9, 23)
+    assert sa.latest_session("krx", kst(2026, 9, 27, 12, 0)) == date(2026, 9, 23)
+
+    # 연휴 뒤 첫 거래일은 장 마감 전까지 직전 거래일이 최신
+    assert sa.latest_session("krx", kst(2026, 9, 28, 10, 0)) == date(2026, 9, 23)
+    assert sa.latest_session("krx", kst(2026, 9, 28, 15, 30)) == date(2026, 9, 28)
+
+
+def test_krx_needs_refresh_around_chuseok():
+    last_bar = date(2026, 9, 23)
+
+    assert not sa.needs_refresh("005930.KS", last_bar, kst(2026, 9, 25, 11, 0))
+    assert not sa.needs_refresh("005930.KS", last_bar, kst(2026, 9, 27, 20, 0))
+
+    # 정규장 중에는 장중 값이 바뀌므로 다시 받는다
+    assert sa.needs_refresh("005930.KS", last_bar, kst(2026, 9, 28, 10, 0))
+    assert sa.needs_refresh("005930.KS", last_bar, kst(2026, 9, 28, 16, 0))
+
+
+def test_nyse_thanksgiving_falls_back_to_last_session():
+    # 2026-11-26(목) 추수감사절
+    assert sa.latest_session("nyse", et(2026, 11, 26, 18, 0)) == date(2026, 11, 25)
+    assert not sa.in_session("nyse", et(2026, 11, 26, 11, 0))
+    assert sa.latest_session("nyse", et(2026, 11, 27, 16, 0)) == date(2026, 11, 27)
+
+
+def test_nyse_needs_refresh_around_thanksgiving():
+    last_bar = date(2026, 11, 25)
+
+    assert not sa.needs_refresh("NVDA", last_bar, et(2026, 11, 26, 11, 0))
+    assert not sa.needs_refresh("NVDA", last_bar, et(2026, 11, 27, 8, 0))
+    assert sa.needs_refresh("NVDA", last_bar, et(2026, 11, 27, 17, 0))
+
+
+def test_exchange_follows_ticker_suffix():
+    # 같은 시각이어도 한국 종목은 KRX, 그 밖은 NYSE 캘린더를 따른다
+    now = kst(2026, 9, 25, 12, 0)
+
+    assert not sa.needs_refresh("005930.KS", date(2026, 9, 23), now)
+    assert sa.needs_refresh("NVDA", date(2026, 9, 23), now)
+
+
+def test_missing_last_bar_always_refreshes():
+    assert sa.needs_refresh("NVDA", None, et(2026, 11, 26, 11, 0))
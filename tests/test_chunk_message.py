@@ -0,0 +1,64 @@
+import re
+
+import pytest
+
+import stock_alert as sa
+
+
+def body(part):
+    """(i/n) 번호를 뗀 본문."""
+    return re.sub(r"\n\n\(\d+/\d+\)$", "", part)
+
+
+def blocks(n, width=40):
+    return "\n\n".join(f"종목 {i:02d}\n" + "가" * width for i in range(n))
+
+
+def test_short_text_is_not_split():
+    assert sa.chunk_message("hello", 100) == ["hello"]
+    assert sa.chunk_message(blocks(50), 0) == [blocks(50)]
+
+
+def test_char_limit_keeps_blocks_whole():
+    text = blocks(30)
+    parts = sa.chunk_message(text, 200)
+
+    assert len(parts) > 1
+    assert all(len(p) <= 200 for p in parts)
+    assert parts[0].endswith(f"(1/{len(parts)})")
+    assert "\n\n".join(body(p) for p in parts) == text
+
+
+def test_byte_limit_counts_utf8():
+    text = blocks(30)
+    parts = sa.chunk_message(text, 300, unit="bytes")
+
+    assert len(parts) > 1
+    assert all(len(p.encode("utf-8")) <= 300 for p in parts)
+    assert "\n\n".join(body(p) for p in parts) == text
+
+
+def test_oversized_block_joins_its_lines_with_single_newline():
+    lines = [f"line {i} " + "x" * 20 for i in range(6)]
+    text = "\n".join(lines)
+    limit = 2 * len(lines[0]) + 1 + len(sa.CHUNK_SUFFIX)
+
+    parts = sa.chunk_message(text, limit)
+
+    assert [body(p) for p in parts] == [
+        "\n".join(lines[0:2]),
+        "\n".join(lines[2:4]),
+        "\n".join(lines[4:6]),
+    ]
+
+
+def test_overlong_line_is_cut_without_breaking_characters():
+    text = "가" * 100
+    parts = sa.chunk_message(text, sa.min_chunk_limit("bytes") + 5, unit="bytes")
+
+    assert "".join(body(p) for p in parts) == text
+
+
+def test_limit_below_minimum_raises():
+    with pytest.raises(ValueError):
+        sa.chunk_message(blocks(5), sa.min_chunk_limit("chars") - 1)
@@ -0,0 +1,57 @@
+import smtplib
+
+import pytest
+
+import stock_alert as sa
+
+
+class FakeSMTP:
+    """연결만 흉내 내고 닫혔는지 기록한다."""
+
+    opened = []
+
+    def __init__(self, host, port):
+        self.closed = False
+        self.opened.append(self)
+
+    def ehlo(self):
+        pass
+
+    def has_extn(self, name):
+        return True
+
+    def login(self, user, password):
+        raise smtplib.SMTPAuthenticationError(535, b"bad password")
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch):
+    FakeSMTP.opened = []
+    monkeypatch.setattr(smtplib, "SMTP", FakeSMTP)
+    return FakeSMTP
+
+
+def test_failed_login_closes_connection(fake_smtp):
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        with sa.MailSession(use_ssl=False):
+            pass
+
+    assert [s.closed for s in fake_smtp.opened] == [True]
+
+
+def test_missing_mail_account_goes_to_outbox(fake_smtp, monkeypatch):
+    monkeypatch.delenv("NAVER_EMAIL")
+    monkeypatch.setattr(sa, "SMTP_USE_SSL", False)
+    items = [{"channel": "email", "to": ["a@example.com"], "text": "hello"}]
+
+    failed = sa.send_email_batch(items)
+
+    assert failed == items
+    assert "NAVER_EMAIL" in failed[0]["error"]
+    assert [s.closed for s in fake_smtp.opened] == [True]
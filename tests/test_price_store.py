@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+import stock_alert as sa
+
+
+def bars(start, closes, **extra):
+    index = pd.bdate_range(start, periods=len(closes), name="Date")
+    data = {"Close": np.asarray(closes, dtype=float), "Volume": np.full(len(closes), 1000.0)}
+    data.update(extra)
+    return pd.DataFrame(data, index=index)
+
+
+def test_appends_new_bars_and_overwrites_last_bar():
+    stored = bars("2026-10-05", [10.0, 11.0, 12.0, 13.0])
+    # 마지막 저장 봉(장중 값)은 새 값으로 덮어쓰고 뒤에 새 봉을 붙인다
+    delta = bars("2026-10-07", [12.0, 13.5, 14.0])
+
+    merged = sa.merge_price_delta(stored, delta)
+
+    assert list(merged["Close"]) == [10.0, 11.0, 12.0, 13.5, 14.0]
+    assert merged.index.is_monotonic_increasing
+    assert list(merged.columns) == ["Close", "Volume"]
+
+
+def test_restated_settled_bar_requests_full_download():
+    stored = bars("2026-10-05", [10.0, 11.0, 12.0, 13.0])
+    # 확정 봉(10-07) 종가가 허용치 넘게 달라짐 → 액면분할 등 과거 수정
+    delta = bars("2026-10-07", [6.0, 6.5, 7.0])
+
+    assert sa.merge_price_delta(stored, delta) is None
+
+
+def test_small_drift_within_tolerance_is_merged():
+    stored = bars("2026-10-05", [10.0, 11.0, 12.0, 13.0])
+    delta = bars("2026-10-07", [12.0 * (1 + sa.PRICE_RESTATE_TOLERANCE / 2), 13.0, 14.0])
+
+    merged = sa.merge_price_delta(stored, delta)
+
+    assert merged is not None
+    assert len(merged) == 5
+
+
+def test_extra_delta_columns_are_dropped():
+    stored = bars("2026-10-05", [10.0, 11.0])
+    delta = bars("2026-10-06", [11.0, 12.0], Open=[1.0, 2.0])
+
+    merged = sa.merge_price_delta(stored, delta)
+
+    assert list(merged.columns) == ["Close", "Volume"]
+    assert list(merged["Close"]) == [10.0, 11.0, 12.0]
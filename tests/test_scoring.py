@@ -0,0 +1,147 @@
+import numpy as np
+
+import stock_alert as sa
+
+# 비교 기준: scoring.json 도입 전 한 종목씩 채점하던 방식 그대로
+
+
+def scalar_score(stats, market_stats):
+    score = 0
+
+    if stats["is_aligned"]:
+        score += 30
+    else:
+        if stats["above20"]:
+            score += 8
+        if stats["above60"]:
+            score += 8
+        if stats["ma5"] >= stats["ma10"]:
+            score += 5
+        if stats["ma10"] >= stats["ma20"]:
+            score += 5
+        if stats["ma20"] >= stats["ma60"]:
+            score += 5
+
+    if stats["ma20_slope"] > 0:
+        score += 12
+    if stats["ma60_slope"] > 0:
+        score += 12
+
+    rs20 = stats["chg20d"] - market_stats.get("chg20d", 0)
+    rs60 = stats["chg60d"] - market_stats.get("chg60d", 0)
+
+    if rs20 > 0:
+        score += 12
+    if rs20 > 5:
+        score += 6
+    if rs60 > 0:
+        score += 12
+    if rs60 > 10:
+        score += 6
+
+    if stats["vol_ratio"] >= 2.0:
+        score += 10
+    elif stats["vol_ratio"] >= 1.5:
+        score += 6
+    elif stats["vol_ratio"] <= 0.7:
+        score -= 3
+
+    if stats["cross20_up"]:
+        score += 8
+    if stats["cross20_down"]:
+        score -= 20
+    if stats["cross60_down"]:
+        score -= 35
+
+    return score, rs20, rs60
+
+
+def scalar_grade(score):
+    if score >= 80:
+        return "A"
+    if score >= 65:
+        return "B+"
+    if score >= 50:
+        return "B"
+    if score >= 35:
+        return "C"
+    return "D"
+
+
+def scalar_decision(stats, score):
+    if stats["cross60_down"]:
+        return "전량 매도 검토"
+    if stats["cross20_down"]:
+        return "30% 매도 검토"
+    if score >= 80:
+        return "비중 확대 후보"
+    if score >= 65:
+        return "보유 유지 / 분할매수 후보"
+    if score >= 50:
+        return "관망 후보"
+    if score >= 35:
+        return "비중 축소 후보"
+    return "약세 / 매수 제외"
+
+
+def random_stats(n, seed=0):
+    """경계값(정확히 기준과 같은 값)이 자주 나오도록 몇 개 값 중에서 고른다."""
+    rng = np.random.default_rng(seed)
+    ma = rng.choice([90.0, 95.0, 100.0, 105.0], size=(n, 4))
+
+    stats = []
+
+    for i in range(n):
+        stats.append({
+            "ticker": f"T{i}",
+            "close": 100.0,
+            "ma5": ma[i, 0],
+            "ma10": ma[i, 1],
+            "ma20": ma[i, 2],
+            "ma60": ma[i, 3],
+            "ma20_slope": float(rng.choice([-0.5, 0.0, 0.5])),
+            "ma60_slope": float(rng.choice([-0.5, 0.0, 0.5])),
+            "chg20d": float(rng.choice([-3.0, 0.0, 2.0, 5.0, 7.0, 12.0])),
+            "chg60d": float(rng.choice([-5.0, 0.0, 2.0, 10.0, 12.0, 25.0])),
+            "vol_ratio": float(rng.choice([0.5, 0.7, 1.0, 1.5, 1.8, 2.0, 3.0])),
+            "is_aligned": bool(rng.random() < 0.3),
+            "above20": bool(rng.random() < 0.5),
+            "above60": bool(rng.random() < 0.5),
+            "cross20_up": bool(rng.random() < 0.2),
+            "cross20_down": bool(rng.random() < 0.2),
+            "cross60_down": bool(rng.random() < 0.1),
+        })
+
+    return stats
+
+
+def test_compiled_rules_match_scalar_scoring():
+    score, grade, decision = sa.compile_scoring_rules(sa.load_scoring_rules())
+    market = {"chg20d": 2.0, "chg60d": 0.0}
+    stats = random_stats(2000)
+
+    fields = {key: np.array([s[key] for s in stats]) for key in stats[0] if key != "ticker"}
+    fields["rs20"] = fields["chg20d"] - market["chg20d"]
+    fields["rs60"] = fields["chg60d"] - market["chg60d"]
+
+    scores = score(fields)
+    grades = grade(scores)
+    decisions = decision(dict(fields, score=scores))
+
+    for i, s in enumerate(stats):
+        expected, _, _ = scalar_score(s, market)
+
+        assert scores[i] == expected
+        assert grades[i] == scalar_grade(expected)
+        assert decisions[i] == scalar_decision(s, expected)
+
+
+def test_single_stock_helpers_match_scalar_scoring():
+    market = {"chg20d": 5.0, "chg60d": 10.0}
+
+    for s in random_stats(300, seed=1):
+        score, rs20, rs60 = sa.calc_stock_score(s, market)
+
+        assert (score, rs20, rs60) == scalar_score(s, market)
+        assert sa.grade_from_score(score) == scalar_grade(score)
+        assert sa.decision_from_stats(s, score) == scalar_decision(s, score)
@@ -0,0 +1,67 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import stock_alert as sa
+
+
+class SyntheticProvider:
+    """종목 코드로 시드를 만든 합성 일봉 (NEW로 시작하는 종목은 봉이 모자란 신규 상장)."""
+
+    host = None
+
+    def __init__(self, n_bars=120):
+        self.dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_bars, name="Date")
+
+    def history(self, ticker, window):
+        rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+        dates = self.dates[-20:] if ticker.startswith("NEW") else self.dates
+        close = 100.0 * np.exp(np.cumsum(rng.normal(0.001, 0.02, len(dates))))
+        volume = rng.integers(100_000, 1_000_000, len(dates)).astype(float)
+
+        df = pd.DataFrame({"Close": close, "Volume": volume}, index=dates)
+
+        if "start" in window:
+            df = df[df.index >= pd.Timestamp(window["start"])]
+
+        return df
+
+
+TICKERS = (
+    [f"{i:06d}.KS" for i in range(40)]
+    + [f"SYN{i:03d}" for i in range(40)]
+    + ["NEW001", "NEW002"]
+)
+
+MARKETS = {key: {"chg20d": 1.5, "chg60d": 3.0} for key in sa.MARKET_INDEX}
+
+
+def test_sharded_screening_matches_single_process(monkeypatch):
+    monkeypatch.setattr(sa, "PROVIDER", SyntheticProvider())
+    monkeypatch.setattr(sa, "SHARD_MIN_TICKERS", 1)
+
+    single = sa.screen_section("single", TICKERS, None, MARKETS, top_n=15, workers=0)
+    sharded = sa.screen_section("sharded", TICKERS, None, MARKETS, top_n=15, workers=3)
+
+    assert single == sharded
+    assert single[1] == 2
+    assert single[0] == sorted(single[0], key=sa.rank_key, reverse=True)
+
+    for one, many in zip(sa.load_screen_panel("single", TICKERS), sa.load_screen_panel("sharded", TICKERS)):
+        np.testing.assert_array_equal(one, many)
+
+
+def test_screen_panel_matches_price_panel(monkeypatch):
+    provider = SyntheticProvider()
+    monkeypatch.setattr(sa, "PROVIDER", provider)
+
+    sa.screen_section("panel", TICKERS, None, MARKETS, workers=0)
+    dates, close, volume = sa.load_screen_panel("panel", TICKERS)
+
+    prices = {t: provider.history(t, {}) for t in TICKERS}
+    expected_close, expected_volume = sa.build_price_panel(prices, TICKERS, bars=sa.MIN_BARS)
+
+    np.testing.assert_array_equal(close, expected_close)
+    np.testing.assert_array_equal(volume, expected_volume)
+    assert dates[-1, 0] == np.datetime64(provider.dates[-1].date())